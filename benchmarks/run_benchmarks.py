@@ -0,0 +1,208 @@
+"""
+Benchmarks of the simulation engines.
+
+Runs fixed scenarios and writes the runs per second, events per second and peak memory of each
+to a json file, then compares them with a stored baseline. The scenarios vary one parameter at a
+time from a base scenario, since the full matrix of all parameters would take hours to run.
+
+Usage:
+  python -m benchmarks.run_benchmarks [--full] [--output results.json] [--baseline baseline.json]
+                                      [--update-baseline] [--tolerance 0.25] [--workers 2] [--repeat 3]
+
+Exits with 1 if a scenario has become slower than the baseline by more than the tolerance.
+The baseline is specific to the machine, create it with --update-baseline before comparing.
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+import simpy
+
+import desim.interface as des
+import desim.simulation as sim
+from desim.data import NonTechCost, TimeFormat
+
+FORMAT_VERSION = 1
+DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_BASELINE = os.path.join(DIRECTORY, 'baseline.json')
+DEFAULT_OUTPUT = os.path.join(DIRECTORY, 'results.json')
+
+# The base scenario that the other scenarios vary
+BASE = dict(engine='simpy', method='monte_carlo', flow_rate=50, flow_time=2, until=10, runs=20, processes=5,
+            branching=1, non_tech=NonTechCost.CONTINOUSLY)
+
+# The values of each parameter that are run, the others have the values of the base scenario
+QUICK = {
+    'engine': ['batch'],
+    'method': ['simulation', 'monte_carlo', 'parallell'],
+    'flow_rate': [10, 200],
+    'processes': [20],
+    'branching': [3],
+    'non_tech': list(NonTechCost),
+}
+
+FULL = {
+    'engine': ['batch'],
+    'method': ['simulation', 'monte_carlo', 'parallell'],
+    'flow_rate': [1, 10, 200, 1000],
+    'flow_time': [0.5, 5],
+    'until': [5, 30],
+    'runs': [5, 100],
+    'processes': [2, 20, 50],
+    'branching': [2, 3, 5],
+    'non_tech': list(NonTechCost),
+}
+
+
+def scenarios(matrix: dict) -> dict:
+    """
+    The scenarios of a matrix as {name: parameters}, the base scenario and one scenario for each
+    value that differs from the base.
+    """
+    result = {scenario_name(BASE): dict(BASE)}
+    for key, values in matrix.items():
+        for value in values:
+            parameters = dict(BASE, **{key: value})
+            result.setdefault(scenario_name(parameters), parameters)
+    return result
+
+
+def scenario_name(parameters: dict) -> str:
+    return ','.join([f'{k}={v.value if isinstance(v, NonTechCost) else v}' for k, v in parameters.items()])
+
+
+def create_simulation(parameters: dict):
+    """
+    The arguments of a Des run method for a scenario. Every process can be followed by the next
+    @branching processes with equal probabilities, the last processes end the lifecycle.
+    """
+    n = parameters['processes']
+    processes = [sim.Process(i, 1, 1000 * i, 500 * i, f'Process {i}', parameters['non_tech'], TimeFormat.MONTH)
+                 for i in range(1, n + 1)]
+    dsm = dict()
+    for i, p in enumerate(processes):
+        # The columns are the start, the processes and the end
+        row = [0] * (n + 2)
+        targets = [min(j, n + 1) for j in range(i + 2, i + 2 + parameters['branching'])]
+        for j in targets:
+            row[j] += 1 / len(targets)
+        dsm[p.name] = row
+
+    non_tech_processes = [sim.NonTechnicalProcess('Quality management', 10000, 0)]
+    return (parameters['flow_time'], parameters['flow_rate'], processes[0].name, processes, non_tech_processes,
+            parameters['non_tech'], dsm, TimeFormat.YEAR, 0.08, parameters['until'])
+
+
+def run_scenario(simulation: des.Des, parameters: dict):
+    arguments = create_simulation(parameters)
+    method = parameters['method']
+    if method == 'simulation':
+        return simulation.run_simulation(*arguments, seed=1)
+    if method == 'monte_carlo':
+        return simulation.run_monte_carlo_simulation(*arguments, runs=parameters['runs'], seed=1)
+    return simulation.run_parallell_simulations(*arguments, runs=parameters['runs'], seed=1)
+
+
+def measure(simulation: des.Des, parameters: dict, repeat: int = 3) -> dict:
+    """
+    Runs a scenario timed @repeat times, keeping the fastest since the slower runs are slowed down by
+    other work on the machine, then profiled to count the events and traced to find the peak memory.
+    The events per second are the events that simpy scheduled for the runs, divided by the time that they
+    took. They are None for the batch engine, which has no events. The peak memory is of this process,
+    so it does not include the workers of parallel runs.
+    """
+    runs = 1 if parameters['method'] == 'simulation' else parameters['runs']
+    seconds = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run_scenario(simulation, parameters)
+        seconds = min(seconds, time.perf_counter() - start)
+
+    events_per_second = None
+    if parameters['engine'] == 'simpy':
+        stats = des.Des().run_simulation(*create_simulation(parameters), seed=1, profile=True).stats
+        events_per_second = stats.counters['events_scheduled'] * runs / seconds
+
+    tracemalloc.start()
+    run_scenario(simulation, parameters)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        'seconds': seconds,
+        'runs_per_second': runs / seconds,
+        'events_per_second': events_per_second,
+        'peak_memory_bytes': peak,
+    }
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    """
+    The scenarios that are slower than in the baseline by more than the tolerance, as
+    (name, runs per second, runs per second of the baseline).
+    """
+    regressions = []
+    for name, result in results['scenarios'].items():
+        base = baseline['scenarios'].get(name)
+        if base is not None and result['runs_per_second'] < base['runs_per_second'] * (1 - tolerance):
+            regressions.append((name, result['runs_per_second'], base['runs_per_second']))
+    return regressions
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description='Benchmarks of the simulation engines')
+    parser.add_argument('--full', action='store_true', help='Run every value of the full matrix')
+    parser.add_argument('--output', default=DEFAULT_OUTPUT, help='The json file that the results are written to')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help='The json file of the baseline')
+    parser.add_argument('--update-baseline', action='store_true', help='Write the results to the baseline')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='The accepted relative slowdown from the baseline')
+    parser.add_argument('--workers', type=int, default=2, help='The workers of the parallel scenarios')
+    parser.add_argument('--repeat', type=int, default=3, help='The timed runs of each scenario')
+    args = parser.parse_args(argv)
+
+    results = {
+        'version': FORMAT_VERSION,
+        'machine': {'platform': platform.platform(), 'python': platform.python_version(), 'cpus': os.cpu_count(),
+                    'numpy': np.__version__, 'simpy': simpy.__version__},
+        'scenarios': dict(),
+    }
+    simulations = {engine: des.Des(workers=args.workers, engine=engine) for engine in des.ENGINES}
+    try:
+        for simulation in simulations.values():
+            simulation.get_pool()  # The workers are started before the parallel scenarios are timed
+        for name, parameters in scenarios(FULL if args.full else QUICK).items():
+            results['scenarios'][name] = measure(simulations[parameters['engine']], parameters, args.repeat)
+            r = results['scenarios'][name]
+            events = '' if r['events_per_second'] is None else f'{r["events_per_second"]:.0f} events/s, '
+            print(f'{name}: {r["runs_per_second"]:.1f} runs/s, {events}{r["peak_memory_bytes"] / 2 ** 20:.1f} MiB')
+    finally:
+        for simulation in simulations.values():
+            simulation.close()
+
+    with open(args.output, 'w') as file:
+        json.dump(results, file, indent=2)
+
+    if args.update_baseline:
+        with open(args.baseline, 'w') as file:
+            json.dump(results, file, indent=2)
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print(f'No baseline at {args.baseline}, create it with --update-baseline')
+        return 0
+
+    with open(args.baseline) as file:
+        regressions = compare(results, json.load(file), args.tolerance)
+    for name, runs_per_second, baseline in regressions:
+        print(f'Regression in {name}: {runs_per_second:.1f} runs/s, baseline {baseline:.1f} runs/s')
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
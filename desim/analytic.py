@@ -0,0 +1,264 @@
+import heapq
+
+import numpy as np
+
+from desim.data import NonTechCost
+from desim.routing import RoutingTable
+from desim.simulation import SimulationModel, is_whole_year
+
+
+class AnalyticModel(object):
+    """
+    Computes the expected cost, revenue and NPV series of a SimulationModel without running it,
+    by treating the DSM as an absorbing Markov chain over the processes.
+
+    The chain of an entity is walked over the time steps: the probability that a process is started
+    at a time is propagated to its successors when it ends, and processes that take no time are
+    solved at once with the fundamental matrix of the chain. The series of one entity are then
+    convolved with the expected arrivals of the flow, which start when the entity that runs the
+    processes before the flow has been absorbed.
+
+    The series are the mean of infinitely many runs of the simulation, including when the costs
+    are observed in the same time step as they are added. Rows of the DSM that sum to more than 1
+    run several processes at once and are not supported.
+
+    Processes shorter than a time step move the entities off the time steps, so the walk keeps the
+    exact times. Repeated short processes can reach very many times with very small probabilities,
+    the times reached with a probability below the tolerance are not followed.
+
+    The series are computed for every time step of the model and the observations of its output
+    interval are returned.
+    """
+
+    def __init__(self, model: SimulationModel, tolerance: float = 1e-12) -> None:
+        if len(model.interarrival_processes) > 1:
+            raise ValueError('The analytic model needs a single flow start process')
+        self.model = model
+        self.processes = model.processes
+        self.length = model.observation_steps
+        self.timestep = model.timestep
+        self.tolerance = tolerance
+        self.index = {id(p): i for i, p in enumerate(self.processes)}
+        # The amount of time steps of each process, 0 if it is shorter than a time step
+        self.num_steps = np.array([int(p.time * p.W / self.timestep) if p.time >= self.timestep else 0
+                                   for p in self.processes])
+        self.instant = np.array([p.time == 0 for p in self.processes])
+        # The time that each process takes in the simulation
+        self.durations = [int(n) * self.timestep if n > 0 else p.time for n, p in zip(self.num_steps, self.processes)]
+
+    def transition_matrix(self, routing: RoutingTable) -> np.ndarray:
+        """
+        The probabilities of going from each process to each other process. The probability
+        of ending the lifecycle after a process is one minus the sum of its row.
+        """
+        matrix = np.zeros((len(self.processes), len(self.processes)))
+        for i, process in enumerate(self.processes):
+            row = routing.get(process.name)
+            if row is None:
+                continue
+            if row.multiple:
+                raise ValueError(f'The row of {process.name} sums to more than 1, which runs several '
+                                 f'processes at once and can not be solved analytically')
+            for target, weight in zip(row.targets, row.weights):
+                if target is not None:
+                    matrix[i, self.index[id(target)]] += weight / row.total
+
+        return matrix
+
+    def process_amounts(self, ent_amount: float) -> np.ndarray:
+        """
+        The (processes × 2) costs and revenues that each process adds in each of its time steps,
+        or all at once if it is shorter than a time step. Includes the non-technical costs added
+        to the process.
+        """
+        total_time = sum([p.time for p in self.processes])
+        amounts = np.zeros((len(self.processes), 2))
+        for i, p in enumerate(self.processes):
+            cost = p.cost
+            if p.add_non_tech == NonTechCost.TO_TECHNICAL_PROCESS:
+                cost += self.model.non_tech_costs * p.time / (total_time * ent_amount)
+            steps = max(self.num_steps[i], 1)
+            amounts[i] = cost / steps, p.revenue / steps
+
+        return amounts
+
+    def walk(self, process, routing: RoutingTable, start_time: float):
+        """
+        Walks the chain of an entity that starts with the process at the given time. Returns the
+        (steps × processes) probabilities that each process is started in each time step, and the
+        probabilities that the lifecycle ends at each time, as a dict of {key: [time, probability]}.
+
+        Times that only differ by rounding share a key.
+        """
+        matrix = self.transition_matrix(routing)
+        # Processes that take no time are followed at the same time
+        fundamental = np.linalg.inv(np.eye(len(self.processes)) - matrix * self.instant[:, None])
+        ends = 1 - matrix.sum(axis=1)
+
+        started = np.zeros((self.length, len(self.processes)))
+        absorbed = dict()
+        direct = np.zeros(len(self.processes))
+        direct[self.index[id(process)]] = 1
+        pending = {self.time_key(start_time): [start_time, direct]}
+        queue = list(pending)
+        while queue:
+            key = heapq.heappop(queue)
+            time, direct = pending.pop(key)
+            step = key[0]
+            if step >= self.length:
+                continue
+
+            probabilities = direct @ fundamental
+            if probabilities.sum() < self.tolerance:
+                continue
+            started[step] += probabilities
+            for i in np.flatnonzero(probabilities).tolist():
+                p = probabilities[i]
+                if self.instant[i]:
+                    end_time = time  # The successors are already included by the fundamental matrix
+                else:
+                    end_time = time + self.durations[i]
+                    end_key = self.time_key(end_time)
+                    if end_key not in pending:
+                        pending[end_key] = [end_time, np.zeros(len(self.processes))]
+                        heapq.heappush(queue, end_key)
+                    pending[end_key][1] += p * matrix[i]
+
+                if ends[i] > 0:
+                    absorbed.setdefault(self.time_key(end_time), [end_time, 0])[1] += p * ends[i]
+
+        return started, absorbed
+
+    def time_key(self, time: float):
+        """
+        The time step of a time and its rounded offset within the time step.
+        """
+        step = int(round(time / self.timestep, 9) // 1)
+        return step, round(time - step * self.timestep, 9)
+
+    def entity_increments(self, started: np.ndarray, amounts: np.ndarray) -> np.ndarray:
+        """
+        The expected (steps × 2) costs and revenues that an entity adds to each observation.
+        A process started in time step t, after its observation, adds its k:th step to observation t + 1 + k.
+        """
+        cumulative = np.vstack([np.zeros(len(self.processes)), np.cumsum(started, axis=0)])
+        d = np.arange(self.length)
+        increments = np.zeros((self.length, 2))
+        for i in range(len(self.processes)):
+            if self.num_steps[i] == 0:
+                increments[1:] += np.outer(started[:-1, i], amounts[i])
+            else:
+                # The steps of the process started between d - num_steps and d - 1
+                low = np.maximum(d - self.num_steps[i], 0)
+                increments += np.outer(cumulative[d, i] - cumulative[low, i], amounts[i])
+
+        return increments
+
+    def first_process_increments(self, process, amounts: np.ndarray) -> np.ndarray:
+        """
+        The (steps × 2) amounts that the first process of an entity started at step 0 adds to each observation.
+        """
+        i = self.index[id(process)]
+        increments = np.zeros((self.length, 2))
+        increments[1:max(self.num_steps[i], 1) + 1] = amounts[i]
+        return increments
+
+    def arrivals(self, flow_starts):
+        """
+        The expected amount of entities that arrive in each time step, given the {key: [time, probability]}
+        of the start of the flow. Returns {offset key: (start time, arrivals after the observation of their
+        step, arrivals before it)}, since the lifecycle of an entity depends on its offset from the time steps.
+        """
+        model = self.model
+        n_entities, timeout, ticks = model.flow_ticks()
+        if n_entities == 0 or ticks == 0:
+            return dict()
+
+        mod_entities = model.flow_rate % (1 / timeout)
+        before_flow = model.interarrival_process != self.processes[0].name
+        arrivals = dict()
+        for (step, offset), (now, probability) in flow_starts.items():
+            after, ahead = arrivals.setdefault(offset, (now, np.zeros(self.length), np.zeros(self.length)))[1:]
+            # The ticks of the flow follow the timeouts of the lifecycle in the simulation
+            start = now
+            for tick in range(ticks):
+                now = start + tick * timeout
+                step = self.time_key(now)[0]
+                if step >= self.length:
+                    break
+                amount = n_entities
+                if is_whole_year(now) and mod_entities != 0:
+                    amount *= 1 + int(mod_entities)
+                # The first entities are created after the observation of their step. The flow waits for the
+                # following ticks before the observation of their step, when it waits for longer than a step
+                # or when it started before the observations did.
+                if offset == 0 and tick > 0 and (timeout > self.timestep or not before_flow):
+                    ahead[step] += probability * amount
+                else:
+                    after[step] += probability * amount
+
+        return arrivals
+
+    def convolve(self, arrivals: np.ndarray, increments: np.ndarray) -> np.ndarray:
+        return np.stack([np.convolve(arrivals, increments[:, j])[:self.length] for j in range(2)], axis=1)
+
+    def expected_increments(self) -> np.ndarray:
+        """
+        The expected (steps × 2) costs and revenues added to each observation by all entities.
+        """
+        model = self.model
+        increments = np.zeros((self.length, 2))
+
+        if model.interarrival_process != self.processes[0].name:
+            started, flow_starts = self.walk(self.processes[0], model.routing_before_flow, 0)
+            increments += self.entity_increments(started, self.process_amounts(1))
+        else:
+            flow_starts = {self.time_key(0): [0, 1]}
+
+        arrivals = self.arrivals(flow_starts)
+        if len(arrivals) == 0:
+            return increments
+
+        process = model.interarrival_processes[0]
+        amounts = self.process_amounts(model.total_ent_amount)
+        for offset, (start_time, after, ahead) in arrivals.items():
+            # The lifecycle is walked from the offset of the flow, relative to the step where it starts
+            started, _ = self.walk(process, model.routing_after_flow, start_time - self.time_key(start_time)[0] * self.timestep)
+            entity = self.entity_increments(started, amounts)
+            increments += self.convolve(after, entity)
+            if ahead.any():
+                # Entities created before the observation of their step have their first process observed one step earlier
+                first = self.first_process_increments(process, amounts)
+                entity_ahead = entity - first + np.vstack([first[1:], np.zeros((1, 2))])
+                increments += self.convolve(ahead, entity_ahead)
+
+        return increments
+
+    def has_entities(self) -> bool:
+        """
+        Whether any entity has been created when the costs are first observed.
+        """
+        model = self.model
+        if model.interarrival_process != self.processes[0].name:
+            return True
+        n_entities, _, ticks = model.flow_ticks()
+        return n_entities > 0 and ticks > 0
+
+    def expected_series(self):
+        """
+        Returns the time steps and the expected cumulative NPV, total costs and total revenues.
+        """
+        model = self.model
+        increments = self.expected_increments()
+        if model.add_non_tech == NonTechCost.CONTINOUSLY and self.has_entities():
+            increments[1:, 0] += model.non_tech_costs * self.timestep / model.until
+
+        costs, revenues = np.cumsum(increments, axis=0).T
+        if model.add_non_tech == NonTechCost.LUMP_SUM:
+            costs[0] += model.non_tech_costs  # Only the first observation, as in the simulation
+
+        time = np.array(model.observation_times)
+        cashflow = np.diff(revenues) - np.diff(costs)
+        npv = np.append(0, np.cumsum(cashflow / (1 + model.discount_rate) ** time[1:]))
+        every = model.output_every
+        return time[::every], npv[::every], costs[::every], revenues[::every]
@@ -0,0 +1,277 @@
+from time import perf_counter
+
+import numpy as np
+
+from desim.data import NonTechCost
+from desim.profiling import SimulationStats
+from desim.simulation import SimulationModel
+
+
+class BatchModel(object):
+    """
+    Runs many runs of a SimulationModel at once with numpy instead of simpy.
+
+    The entities of all runs are held as cohorts in arrays of (run, amount of entities, current process,
+    start time of the process, routing table, observed ahead). Every iteration all cohorts finish their
+    current process: the costs and revenues of the process are added to the series of their run, and
+    each cohort is divided over the following processes with a multinomial draw. Cohorts of the same run
+    that are in the same state are merged, since the entities in them behave the same from then on.
+
+    The runs have the same distribution as the runs of the simulation with the same model, and are
+    observed in the same way, but they do not draw the same random numbers. Rows of the DSM that sum
+    to more than 1 run several processes at once and are not supported. The runs are observed in every
+    time step of the model and the observations of its output interval are kept.
+    """
+
+    def __init__(self, model: SimulationModel) -> None:
+        if len(model.interarrival_processes) > 1:
+            raise ValueError('The batch engine needs a single flow start process')
+        if model.antithetic or model.common_random_numbers:
+            raise ValueError('The batch engine does not support antithetic runs or common random numbers')
+        self.model = model
+        self.processes = model.processes
+        self.steps = model.steps
+        self.time_steps = model.time_steps
+        # The runs are observed every time step, and every output_every:th observation is kept
+        self.observation_steps = model.observation_steps
+        self.observation_times = model.observation_times
+        self.timestep = model.timestep
+        self.before_flow = model.interarrival_process != self.processes[0].name
+        # The amount of time steps of each process, 0 if it is shorter than a time step
+        self.num_steps = np.array([int(p.time * p.W / self.timestep) if p.time >= self.timestep else 0
+                                   for p in self.processes])
+        # The time that each process takes in the simulation
+        self.durations = np.array([n * self.timestep if n > 0 else p.time for n, p in zip(self.num_steps, self.processes)])
+        # The transitions and amounts of the entities before the flow (0) and in the flow (1)
+        self.transitions = np.stack([self.transition_matrix(model.routing_before_flow),
+                                     self.transition_matrix(model.routing_after_flow)])
+        self.amounts = np.stack([self.process_amounts(1), self.process_amounts(model.total_ent_amount)])
+
+    def transition_matrix(self, routing) -> np.ndarray:
+        """
+        The probabilities of going from each process to each other process, and of ending
+        the lifecycle in the last column.
+        """
+        matrix = np.zeros((len(self.processes), len(self.processes) + 1))
+        index = {id(p): i for i, p in enumerate(self.processes)}
+        for i, process in enumerate(self.processes):
+            row = routing.get(process.name)
+            if row is None or len(row.columns) == 0:
+                matrix[i, -1] = 1
+                continue
+            if row.multiple:
+                raise ValueError(f'The row of {process.name} sums to more than 1, which runs several '
+                                 f'processes at once and is not supported by the batch engine')
+            for target, weight in zip(row.targets, row.weights):
+                matrix[i, -1 if target is None else index[id(target)]] += weight / row.total
+
+        return matrix / matrix.sum(axis=1, keepdims=True)
+
+    def process_amounts(self, ent_amount: float) -> np.ndarray:
+        """
+        The (processes × 2) costs and revenues that each process adds in each of its time steps,
+        or all at once if it is shorter than a time step.
+        """
+        total_time = sum([p.time for p in self.processes])
+        amounts = np.zeros((len(self.processes), 2))
+        for i, p in enumerate(self.processes):
+            cost = p.cost
+            if p.add_non_tech == NonTechCost.TO_TECHNICAL_PROCESS and ent_amount > 0:
+                cost += self.model.non_tech_costs * p.time / (total_time * ent_amount)
+            steps = max(self.num_steps[i], 1)
+            amounts[i] = cost / steps, p.revenue / steps
+
+        return amounts
+
+    def time_steps_of(self, times: np.ndarray) -> np.ndarray:
+        """
+        The time step of each time, ignoring rounding errors.
+        """
+        return np.floor(np.round(times / self.timestep, 9)).astype(int)
+
+    def allocate_series(self, runs: int):
+        return self.model.allocate_series(runs)
+
+    def random_generator(self, first_run: int):
+        if self.model.seed is None:
+            return np.random.default_rng()
+        return np.random.default_rng(np.random.SeedSequence(self.model.seed, spawn_key=(first_run,)))
+
+    def run_into(self, time, npvs, costs, revenues, start: int, runs: int, run_offset: int = 0):
+        """
+        Runs the model for the rows start to start + runs of the given (runs × steps) arrays, in the
+        same way as SimulationModel.run_into. The runs are drawn together from one random stream,
+        seeded by the seed of the model and the index of the first run. Returns the SimulationStats
+        of the runs if the model is profiled, otherwise None. The batch engine has no events or
+        phases, so the stats only have the runs and the total time.
+        """
+        begin = perf_counter()
+        random = self.random_generator(run_offset + start)
+        increments = self.run_increments(runs, random)
+        model = self.model
+        if model.add_non_tech == NonTechCost.CONTINOUSLY and self.has_entities():
+            increments[:, 1:, 0] += model.non_tech_costs * self.timestep / model.until
+
+        run_costs = np.cumsum(increments[:, :, 0], axis=1)
+        run_revenues = np.cumsum(increments[:, :, 1], axis=1)
+        if model.add_non_tech == NonTechCost.LUMP_SUM:
+            run_costs[:, 0] += model.non_tech_costs  # Only the first observation, as in the simulation
+
+        time[:] = model.time_steps
+        discount = (1 + model.discount_rate) ** np.array(self.observation_times[1:])
+        cashflow = np.diff(run_revenues, axis=1) - np.diff(run_costs, axis=1)
+        run_npvs = np.zeros(run_costs.shape)
+        run_npvs[:, 1:] = np.cumsum(cashflow / discount, axis=1)
+        every = model.output_every
+        npvs[start:start + runs] = run_npvs[:, ::every]
+        costs[start:start + runs] = run_costs[:, ::every]
+        revenues[start:start + runs] = run_revenues[:, ::every]
+
+        if not model.profile:
+            return None
+        stats = SimulationStats()
+        stats.runs = runs
+        stats.timings['total'] = perf_counter() - begin
+        return stats
+
+    def has_entities(self) -> bool:
+        """
+        Whether any entity has been created when the costs are first observed.
+        """
+        if self.before_flow:
+            return True
+        n_entities, _, ticks = self.model.flow_ticks()
+        return n_entities > 0 and ticks > 0
+
+    def run_increments(self, runs: int, random) -> np.ndarray:
+        """
+        Runs the entities of all runs and returns the (runs × steps × 2) costs and revenues
+        added to each observation.
+        """
+        # Per step amounts of the running processes as changes, and the amounts added once
+        rates = np.zeros((runs, self.observation_steps + 1, 2))
+        once = np.zeros((runs, self.observation_steps + 1, 2))
+
+        if self.before_flow:
+            cohorts = Cohorts(np.arange(runs), np.ones(runs, dtype=int), np.zeros(runs, dtype=int),
+                              np.zeros(runs), np.zeros(runs, dtype=int), np.zeros(runs, dtype=bool))
+            ended = self.run_cohorts(cohorts, rates, once, random)
+            flow_starts = np.full(runs, np.inf)
+            flow_starts[ended.run] = ended.time
+        else:
+            flow_starts = np.zeros(runs)
+
+        cohorts = self.flow_cohorts(flow_starts)
+        if cohorts is not None:
+            self.run_cohorts(cohorts, rates, once, random)
+
+        return np.cumsum(rates, axis=1)[:, :self.observation_steps] + once[:, :self.observation_steps]
+
+    def flow_cohorts(self, flow_starts: np.ndarray):
+        """
+        The cohorts created by the flow of each run, which starts at the given times.
+        """
+        model = self.model
+        n_entities, timeout, ticks = model.flow_ticks()
+        started = np.isfinite(flow_starts)
+        if n_entities == 0 or ticks == 0 or not started.any():
+            return None
+
+        runs = np.flatnonzero(started)
+        # The ticks are counted, as in the lifecycle of the simulation
+        times = flow_starts[runs][:, None] + np.arange(ticks)[None, :] * timeout
+        steps = self.time_steps_of(times)
+        valid = steps < self.observation_steps
+
+        amounts = np.full(times.shape, n_entities)
+        mod_entities = model.flow_rate % (1 / timeout)
+        if mod_entities != 0:
+            amounts[np.round(times, 9) % 1 == 0] *= 1 + int(mod_entities)
+
+        # The flow creates the entities of the later ticks before the observation of their step, when
+        # it starts on a time step and waits for longer than a step or started before the observations did
+        on_step = np.isclose(times[:, :1], steps[:, :1] * self.timestep, rtol=0, atol=1e-9)
+        ahead = on_step & (np.arange(ticks) > 0)[None, :] & (timeout > self.timestep or not self.before_flow)
+
+        run = np.broadcast_to(runs[:, None], times.shape)[valid]
+        n = int(valid.sum())
+        process = [id(p) for p in self.processes].index(id(model.interarrival_processes[0]))
+        return Cohorts(run, amounts[valid], np.full(n, process), times[valid], np.ones(n, dtype=int), ahead[valid])
+
+    def run_cohorts(self, cohorts, rates: np.ndarray, once: np.ndarray, random):
+        """
+        Runs the cohorts until their lifecycles have ended and adds their amounts to the series.
+        Returns the cohorts that have ended, at the time they ended.
+        """
+        ended = []
+        while len(cohorts.run) > 0:
+            steps = self.time_steps_of(cohorts.time)
+            running = steps < self.observation_steps
+            cohorts, steps = cohorts.select(running), steps[running]
+            if len(cohorts.run) == 0:
+                break
+
+            self.add_amounts(cohorts, steps, rates, once)
+
+            # Divide the cohorts over the following processes
+            end_times = cohorts.time + self.durations[cohorts.process]
+            probabilities = self.transitions[cohorts.table, cohorts.process]
+            counts = random.multinomial(cohorts.count, probabilities)
+            i, target = np.nonzero(counts)
+            finished = target == len(self.processes)
+            ended.append((cohorts.run[i[finished]], end_times[i[finished]]))
+
+            i, target = i[~finished], target[~finished]
+            cohorts = Cohorts(cohorts.run[i], counts[i, target], target, end_times[i], cohorts.table[i],
+                              np.zeros(len(i), dtype=bool)).merged()
+
+        run = np.concatenate([r for r, _ in ended]) if ended else np.zeros(0, dtype=int)
+        time = np.concatenate([t for _, t in ended]) if ended else np.zeros(0)
+        return Cohorts(run, np.ones(len(run), dtype=int), np.zeros(len(run), dtype=int), time,
+                       np.zeros(len(run), dtype=int), np.zeros(len(run), dtype=bool))
+
+    def add_amounts(self, cohorts, steps: np.ndarray, rates: np.ndarray, once: np.ndarray):
+        """
+        Adds the amounts of the current processes of the cohorts to the series. A process started in
+        time step t, after its observation, adds its k:th step to observation t + 1 + k.
+        """
+        amounts = self.amounts[cohorts.table, cohorts.process] * cohorts.count[:, None]
+        first = steps + 1 - cohorts.ahead
+        num_steps = self.num_steps[cohorts.process]
+        timed = num_steps > 0
+
+        np.add.at(rates, (cohorts.run[timed], first[timed]), amounts[timed])
+        last = np.minimum(first[timed] + num_steps[timed], self.observation_steps)
+        np.add.at(rates, (cohorts.run[timed], last), -amounts[timed])
+        np.add.at(once, (cohorts.run[~timed], first[~timed]), amounts[~timed])
+
+
+class Cohorts(object):
+    """
+    Entities of the runs of a BatchModel that are in the same state, as arrays with one element per cohort.
+    """
+    __slots__ = ('run', 'count', 'process', 'time', 'table', 'ahead')
+
+    def __init__(self, run, count, process, time, table, ahead) -> None:
+        self.run = run
+        self.count = count
+        self.process = process
+        self.time = time
+        self.table = table
+        self.ahead = ahead
+
+    def select(self, mask):
+        return Cohorts(self.run[mask], self.count[mask], self.process[mask], self.time[mask], self.table[mask],
+                       self.ahead[mask])
+
+    def merged(self):
+        """
+        Merges the cohorts that are in the same state, adding up their entities.
+        """
+        if len(self.run) < 2:
+            return self
+        keys = np.stack([self.run, self.process, self.table, self.ahead, np.round(self.time, 9)], axis=1)
+        keys, first, inverse = np.unique(keys, axis=0, return_index=True, return_inverse=True)
+        count = np.bincount(inverse.ravel(), weights=self.count, minlength=len(keys)).astype(int)
+        return Cohorts(self.run[first], count, self.process[first], self.time[first], self.table[first],
+                       self.ahead[first])
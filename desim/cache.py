@@ -0,0 +1,166 @@
+from collections import OrderedDict
+from enum import Enum
+import hashlib
+import json
+import os
+from typing import Optional
+
+import numpy as np
+
+from desim.data import SimResults
+
+# Changed when the simulation or the stored format changes, so that old entries are not served
+CACHE_VERSION = 4
+
+# The attributes of a model that are derived from the other attributes and left out of its key
+DERIVED_ATTRIBUTES = ('interarrival_processes', 'routing_before_flow', 'routing_after_flow', 'time_steps',
+                      'observation_times', 'seeded')
+
+# The extension of the files of the stored results
+RESULTS_EXTENSION = '.desim'
+
+
+def canonical(value):
+    """
+    Converts a value to plain json data that is the same for equal inputs, with the dicts in a fixed order.
+    """
+    if isinstance(value, Enum):
+        return canonical(value.value)
+    if isinstance(value, dict):
+        return [[canonical(k), canonical(v)] for k, v in sorted(value.items(), key=lambda item: str(item[0]))]
+    if isinstance(value, (list, tuple)):
+        return [canonical(v) for v in value]
+    if isinstance(value, np.ndarray):
+        return canonical(value.tolist())
+    if isinstance(value, np.generic):
+        return value.item()
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    return [type(value).__name__, canonical(vars(value))]
+
+
+def model_key(model, method: str, runs: int, **parameters) -> str:
+    """
+    The key of the results of running a compiled model with a method, as the sha256 of its canonical inputs.
+    The parameters are anything else that changes the results, such as how the runs are divided into chunks.
+    """
+    engine = type(model).__name__
+    model = getattr(model, 'model', model)  # The SimulationModel of a BatchModel
+    inputs = {k: v for k, v in vars(model).items() if k not in DERIVED_ATTRIBUTES}
+    data = [CACHE_VERSION, engine, method, runs, canonical(inputs), canonical(parameters)]
+    return hashlib.sha256(json.dumps(data, separators=(',', ':')).encode()).hexdigest()
+
+
+def is_deterministic(model) -> bool:
+    """
+    Whether the runs of the model give the same results every time, which is when they are seeded.
+    The seed that paired runs draw when they are not given one is different every time.
+    """
+    return getattr(model, 'model', model).seeded
+
+
+class ResultsCache(object):
+    """
+    A cache of simulation results keyed by the hash of their inputs.
+
+    The latest results are kept in memory, up to max_entries. If a directory is given the results are
+    also stored on disk, where they are kept until the stored results exceed max_disk_bytes and the least
+    recently used results are removed. The stored results are saved with SimResults.save and memory-mapped
+    when they are loaded. Only the results of seeded runs are cached, since runs without a
+    seed are different every time.
+    """
+
+    def __init__(self, max_entries: int = 32, directory: Optional[str] = None,
+                 max_disk_bytes: Optional[int] = None) -> None:
+        self.max_entries = max_entries
+        self.directory = directory
+        self.max_disk_bytes = max_disk_bytes
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, key + RESULTS_EXTENSION)
+
+    def get(self, key: str) -> Optional[SimResults]:
+        """
+        Returns the cached results of the key, or None if they are not cached.
+        """
+        results = self.entries.get(key)
+        if results is not None:
+            self.entries.move_to_end(key)
+        elif self.directory is not None and os.path.exists(self.path(key)):
+            results = self.load(key)
+            self.remember(key, results)
+
+        if results is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return results
+
+    def put(self, key: str, results: SimResults):
+        """
+        Caches the results of the key, in memory and on disk.
+        """
+        self.remember(key, results)
+        if self.directory is not None:
+            self.store(key, results)
+            self.evict()
+
+    def get_or_run(self, key: str, run) -> SimResults:
+        """
+        Returns the cached results of the key, or runs and caches them.
+        """
+        results = self.get(key)
+        if results is None:
+            results = run()
+            self.put(key, results)
+        return results
+
+    def remember(self, key: str, results: SimResults):
+        self.entries[key] = results
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def store(self, key: str, results: SimResults):
+        results.save(self.path(key))
+
+    def load(self, key: str) -> SimResults:
+        path = self.path(key)
+        results = SimResults.load(path)
+        os.utime(path)  # Marks the results as recently used
+        return results
+
+    def evict(self):
+        """
+        Removes the least recently used results from the disk until they fit in max_disk_bytes.
+        """
+        if self.max_disk_bytes is None:
+            return
+
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith(RESULTS_EXTENSION):
+                stat = os.stat(os.path.join(self.directory, name))
+                entries.append((stat.st_mtime, stat.st_size, name))
+
+        size = sum([s for _, s, _ in entries])
+        for _, entry_size, name in sorted(entries):
+            if size <= self.max_disk_bytes:
+                break
+            os.remove(os.path.join(self.directory, name))
+            size -= entry_size
+
+    def clear(self):
+        """
+        Removes all cached results, in memory and on disk.
+        """
+        self.entries.clear()
+        if self.directory is not None:
+            for name in os.listdir(self.directory):
+                if name.endswith(RESULTS_EXTENSION):
+                    os.remove(os.path.join(self.directory, name))
@@ -1,8 +1,18 @@
 from dataclasses import dataclass
-from typing import List
+import functools
+import json
+from multiprocessing import shared_memory
+import math
+import os
+from statistics import NormalDist
+from typing import List, Optional, Union
 from enum import Enum
 import numpy as np
 
+from desim.profiling import SimulationStats
+from desim.stats import SeriesStatistics
+
+
 class NonTechCost(Enum):
     """
     The ways of choosing how to apply the non-technical process costs
@@ -25,33 +35,255 @@ class TimeFormat(Enum):
     MONTH = 12
     YEAR = 1
 
-@dataclass(unsafe_hash=True)
+class SharedResultsMemory(shared_memory.SharedMemory):
+    """
+    A shared memory block that parallel runs write their results to. The block holds the
+    time axis followed by the cumulative NPVs, total costs and total revenues, each laid
+    out as a (runs × time steps) float array.
+    """
+    SERIES = 3
+
+    def __init__(self, runs: int, steps: int, name: Optional[str] = None) -> None:
+        self.runs = runs
+        self.steps = steps
+        size = (1 + self.SERIES * runs) * steps * np.dtype(float).itemsize
+        if name is None:
+            super().__init__(create=True, size=max(size, 1))
+        else:  # Attach to a block created by another process, which is responsible for unlinking it
+            super().__init__(name=name)
+
+    def __reduce__(self):
+        return self.__class__, (self.runs, self.steps, self.name)
+
+    def __del__(self):
+        # Only the file descriptor is closed. The arrays from arrays() keep the memory map alive and
+        # it is unmapped when the last of them is released. Closing it here would leave them dangling.
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+    def arrays(self):
+        """
+        Returns the time axis and the (runs × time steps) arrays of the cumulative NPVs, total costs
+        and total revenues as views of the block. The block must not be closed while they are used.
+        """
+        data = np.ndarray(((1 + self.SERIES * self.runs) * self.steps,), dtype=float, buffer=self.buf)
+        time = data[:self.steps]
+        npvs, costs, revenues = data[self.steps:].reshape(self.SERIES, self.runs, self.steps)
+        return time, npvs, costs, revenues
+
+
+def as_series_array(series) -> np.ndarray:
+    """
+    Converts series to a read-only 2-D float array with one row per run, without copying
+    if they already are a float array.
+    """
+    array = np.asarray(series, dtype=float)
+    if array.ndim == 1:
+        array = array.reshape(1, -1) if array.size > 0 else array.reshape(0, 0)
+    array = array.view()
+    array.flags.writeable = False
+    return array
+
+
+# The start of a file of saved SimResults, followed by the version of the format
+RESULTS_MAGIC = b'DESIMRES'
+RESULTS_VERSION = 1
+# The series of a saved file start at a multiple of this, so that they are aligned when memory-mapped
+RESULTS_ALIGNMENT = 64
+
+
+def process_metadata(process) -> dict:
+    return {'id': process.id, 'name': process.name, 'time': process.time, 'cost': process.cost,
+            'revenue': process.revenue, 'add_non_tech': process.add_non_tech.value}
+
+
+def discount_factors(discount_rates, time) -> np.ndarray:
+    """
+    The (rates × time steps) factors (1 + rate) ** time that the cashflow of each time step is divided
+    by to discount it with each of the discount rates. The factors of each rate are calculated once
+    for each time axis.
+    """
+    rates = np.atleast_1d(np.asarray(discount_rates, dtype=float))
+    time = np.ascontiguousarray(time, dtype=float)
+    key = time.tobytes()
+    return np.stack([rate_discount_factors(float(rate), key) for rate in rates]) if len(rates) > 0 \
+        else np.zeros((0, len(time)))
+
+
+@functools.lru_cache(maxsize=256)
+def rate_discount_factors(discount_rate: float, time: bytes) -> np.ndarray:
+    """
+    The factors of discount_factors for one discount rate, with the time axis given as the bytes of a float array.
+    """
+    factors = (1 + discount_rate) ** np.frombuffer(time, dtype=float)
+    factors.flags.writeable = False
+    return factors
+
+
+def discount_cashflows(cashflows: np.ndarray, discount_rates, time) -> np.ndarray:
+    """
+    The cumulative NPV of the cashflows for each of the discount rates. The cashflows are a
+    (time steps) series or a (runs × time steps) array, and the result has a leading rates axis.
+    """
+    factors = discount_factors(discount_rates, time)
+    if cashflows.ndim == 2:
+        factors = factors[:, None, :]
+    return np.cumsum(cashflows / factors, axis=-1)
+
+
+@dataclass(eq=False)
 class SimResults:
     """
     Class for saving the results from a simulation and doing simple
-    calculations on the results
+    calculations on the results.
+
+    The series are stored as 2-D float arrays with one row per run, and the time axis,
+    which is the same for all runs, is stored once in time. timesteps is a read-only
+    (runs × time steps) view of it. The statistics are calculated the first time they
+    are asked for and then cached, so the arrays must not be changed.
+
+    stats is the SimulationStats of the runs if they were profiled, otherwise None.
+
+    Results are equal when their design, processes and series are equal, as when the series were lists.
     """
     design: str
     processes: List
-    timesteps: List[List[float]]
-    npvs: List[List[float]]
-    costs: List[List[float]]
-    revenues: List[List[float]]
+    timesteps: np.ndarray
+    npvs: np.ndarray
+    costs: np.ndarray
+    revenues: np.ndarray
 
-    def normalize_npv(self):
-        normalized_npv = []
+    def __post_init__(self):
+        self.npvs = as_series_array(self.npvs)
+        self.costs = as_series_array(self.costs)
+        self.revenues = as_series_array(self.revenues)
+        timesteps = as_series_array(self.timesteps)
+        self.time = timesteps[-1] if len(timesteps) > 0 else np.zeros(self.npvs.shape[1])
+        self.timesteps = np.broadcast_to(self.time, self.npvs.shape)
+        self.cache = dict()
+        self.stats = None
+
+    def __eq__(self, other):
+        if not isinstance(other, SimResults):
+            return NotImplemented
+        return (self.design == other.design and self.processes == other.processes
+                and all([np.array_equal(a, b) for a, b in zip((self.time, self.npvs, self.costs, self.revenues),
+                                                               (other.time, other.npvs, other.costs, other.revenues))]))
+
+    def __hash__(self):
+        return hash((self.design, self.npvs.shape))  # The arrays are not changed, but equal floats can differ in bytes
+
+    @classmethod
+    def from_shared_memory(cls, design: str, processes: List, block: SharedResultsMemory):
+        """
+        Creates results that wrap the arrays of a shared memory block without copying them.
+        The block is kept open for as long as the results are used.
+        """
+        time, npvs, costs, revenues = block.arrays()
+        results = cls(design, processes, time, npvs, costs, revenues)
+        results.shared_memory = block
+        return results
+
+    @property
+    def runs(self) -> int:
+        return self.npvs.shape[0]
+
+    def to_dict(self) -> dict:
+        """
+        The fields of the results as plain lists and dicts, with the processes as in the header of
+        save, so that they can be serialized as json.
+        """
+        return {
+            'design': self.design,
+            'processes': [process_metadata(p) for p in self.processes],
+            'timesteps': self.timesteps.tolist(),
+            'npvs': self.npvs.tolist(),
+            'costs': self.costs.tolist(),
+            'revenues': self.revenues.tolist(),
+        }
 
-        mean_npv = self.mean_npv()
-        max_npv = max(mean_npv)
-        min_npv = min(mean_npv)
+    def save(self, path: str):
+        """
+        Saves the results to a compact binary file. The file starts with RESULTS_MAGIC, the format
+        version and the length of a json header with the design, the processes and the shape of the
+        series. The time axis and the (runs × time steps) cumulative NPVs, total costs and total
+        revenues follow as little-endian float64 arrays, in the same layout as SharedResultsMemory.
+        """
+        header = json.dumps({
+            'design': self.design,
+            'processes': [process_metadata(p) for p in self.processes],
+            'runs': self.runs,
+            'steps': self.npvs.shape[1],
+        }).encode()
+        prefix = len(RESULTS_MAGIC) + 4 + 8
+        padding = -(prefix + len(header)) % RESULTS_ALIGNMENT
+        temporary = path + '.tmp'
+        with open(temporary, 'wb') as file:
+            file.write(RESULTS_MAGIC)
+            file.write(np.array([RESULTS_VERSION], dtype='<u4').tobytes())
+            file.write(np.array([len(header) + padding], dtype='<u8').tobytes())
+            file.write(header + b' ' * padding)
+            for series in (self.time, self.npvs, self.costs, self.revenues):
+                np.ascontiguousarray(series, dtype='<f8').tofile(file)
+        os.replace(temporary, path)  # Readers never see a partly written file
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = True):
+        """
+        Loads results saved with save. With mmap the series are memory-mapped instead of read, so only
+        the parts of the file that are used, such as the npvs for mean_npv or the series of one run,
+        are read from the disk.
+        """
+        from desim.simulation import Process  # The simulation imports this module
+
+        with open(path, 'rb') as file:
+            if file.read(len(RESULTS_MAGIC)) != RESULTS_MAGIC:
+                raise ValueError(f'{path} is not a file of saved results')
+            version = int(np.frombuffer(file.read(4), dtype='<u4')[0])
+            if version != RESULTS_VERSION:
+                raise ValueError(f'{path} has version {version} of the format, expected {RESULTS_VERSION}')
+            header_length = int(np.frombuffer(file.read(8), dtype='<u8')[0])
+            header = json.loads(file.read(header_length))
+            offset = file.tell()
 
-        delta_npv = max_npv - min_npv
-        for npv in mean_npv:
-            n_npv = (npv - min_npv) / delta_npv
-            normalized_npv.append(n_npv)
+        runs, steps = header['runs'], header['steps']
+        size = (1 + SharedResultsMemory.SERIES * runs) * steps
+        if mmap and size > 0:
+            data = np.memmap(path, dtype='<f8', mode='r', offset=offset, shape=(size,))
+        else:
+            data = np.fromfile(path, dtype='<f8', count=size, offset=offset)
+        time = data[:steps]
+        npvs, costs, revenues = data[steps:].reshape(SharedResultsMemory.SERIES, runs, steps)
 
-        return normalized_npv 
+        processes = [Process(p['id'], p['time'], p['cost'], p['revenue'], p['name'], NonTechCost(p['add_non_tech']),
+                             TimeFormat.YEAR) for p in header['processes']]
+        return cls(header['design'], processes, time, npvs, costs, revenues)
 
+    def cached(self, name: str, calculate):
+        """
+        Returns the cached value of a statistic, calculating it the first time.
+        """
+        if name not in self.cache:
+            value = calculate()
+            if isinstance(value, np.ndarray):
+                value.flags.writeable = False
+            self.cache[name] = value
+        return self.cache[name]
+
+    def series_mean(self, series: np.ndarray) -> np.ndarray:
+        return series.mean(axis=0) if self.runs > 0 else np.zeros(0)
+
+    def mean_npv_array(self) -> np.ndarray:
+        return self.cached('mean_npv', lambda: self.series_mean(self.npvs))
+
+    def normalize_npv(self):
+        def normalize():
+            mean_npv = self.mean_npv_array()
+            min_npv = mean_npv.min()
+            return (mean_npv - min_npv) / (mean_npv.max() - min_npv)
+
+        return self.cached('normalized_npv', normalize).tolist()
 
     def mean_npv_payback_time(self):
         """
@@ -59,36 +291,188 @@ class SimResults:
         starts to generate value. If the mean NPV doesn't
         go above 0 then -1 is returned. 
         """
-        
-        for t, n in zip(self.timesteps[-1], self.mean_npv()):
-            if n > 0:
-                return t
-        
-        return -1
+        def payback_time():
+            positive = np.flatnonzero(self.mean_npv_array() > 0)
+            return self.time[positive[0]].item() if len(positive) > 0 else -1
+
+        return self.cached('mean_npv_payback_time', payback_time)
 
     def mean_npv(self):
-        mean_npvs = []
-        for _cumulative_npv in np.array(self.npvs).transpose():
-            mean_npvs.append(np.mean(_cumulative_npv))
-        
-        return mean_npvs
-    
+        return self.mean_npv_array().tolist()
+
     def mean_costs(self):
-        mean_costs = []
-        for costs in np.array(self.costs).transpose():
-            mean_costs.append(np.mean(costs))
-        
-        return mean_costs
-    
+        return self.cached('mean_costs', lambda: self.series_mean(self.costs)).tolist()
+
     def mean_revenues(self):
-        mean_revenues = []
-        for revenues in np.array(self.revenues).transpose():
-            mean_revenues.append(np.mean(revenues))
+        return self.cached('mean_revenues', lambda: self.series_mean(self.revenues)).tolist()
 
-        return mean_revenues
-    
     def all_max_npv(self):
-        max_npv = []
-        for npv in self.npvs:
-            max_npv.append(npv[-1])
-        return max_npv
\ No newline at end of file
+        return self.npvs[:, -1].tolist() if self.runs > 0 else []
+
+    def cashflows(self) -> np.ndarray:
+        """
+        The (runs × time steps) net cashflow of each time step, the added revenues minus the added costs.
+        The first time step has no cashflow, as in the cumulative NPV.
+        """
+        def cashflows():
+            flows = np.zeros(self.npvs.shape)
+            flows[:, 1:] = np.diff(self.revenues, axis=1) - np.diff(self.costs, axis=1)
+            return flows
+
+        return self.cached('cashflows', cashflows)
+
+    def discounted_npvs(self, discount_rates) -> np.ndarray:
+        """
+        The (rates × runs × time steps) cumulative NPV of every run for each of the discount rates,
+        calculated from the stored cashflows without running the simulation again.
+
+        The cashflows are discounted at the stored time steps. The simulations discount every internal
+        time step, so results kept with an output interval longer than the time step are approximated.
+        """
+        return discount_cashflows(self.cashflows(), discount_rates, self.time)
+
+    def discounted_mean_npv(self, discount_rates) -> np.ndarray:
+        """
+        The (rates × time steps) mean cumulative NPV for each of the discount rates.
+        """
+        return discount_cashflows(self.cashflows().mean(axis=0), discount_rates, self.time)
+
+
+@dataclass
+class ConfidenceInterval:
+    """
+    A normal approximation confidence interval of the expected value of a metric of the runs.
+    """
+    mean: float
+    half_width: float
+    confidence: float
+    runs: int
+
+    @property
+    def low(self) -> float:
+        return self.mean - self.half_width
+
+    @property
+    def high(self) -> float:
+        return self.mean + self.half_width
+
+    @property
+    def relative_half_width(self) -> float:
+        """
+        The half width relative to the magnitude of the mean. Infinite if the mean is 0.
+        """
+        if self.mean == 0:
+            return 0.0 if self.half_width == 0 else math.inf
+        return self.half_width / abs(self.mean)
+
+
+@dataclass
+class SimulationProgress:
+    """
+    The progress of a Monte Carlo simulation that is run asynchronously. The results are only
+    set in the last progress, when all runs have finished.
+    """
+    runs: int
+    total_runs: int
+    mean_npv: float
+    results: Optional[Union['SimResults', 'StreamingSimResults']] = None
+
+    @property
+    def done(self) -> bool:
+        return self.results is not None
+
+
+class StreamingSimResults:
+    """
+    Results of a Monte Carlo simulation that are aggregated while the runs finish, instead of
+    keeping every run. Has the same statistics as SimResults, calculated from online
+    accumulators, so the memory is constant in the amount of runs.
+
+    npv, costs and revenues are the SeriesStatistics of each series, which also give the
+    variance, minimum, maximum and approximate quantiles of every time step.
+    """
+
+    def __init__(self, design: str, processes: List, time, quantiles=(0.05, 0.25, 0.5, 0.75, 0.95)) -> None:
+        self.design = design
+        self.processes = processes
+        self.time = np.asarray(time, dtype=float)
+        self.npv = SeriesStatistics(len(self.time), quantiles)
+        self.costs = SeriesStatistics(len(self.time), quantiles)
+        self.revenues = SeriesStatistics(len(self.time), quantiles)
+        self.time_mean_npv = SeriesStatistics(1, ())  # The mean over time of the npv of each run
+        self.stats = None  # The SimulationStats of the runs if they were profiled
+
+    @property
+    def runs(self) -> int:
+        return self.npv.count
+
+    def add_run(self, npv, costs, revenues):
+        """
+        Adds the series of a finished run to the statistics.
+        """
+        npv = np.asarray(npv, dtype=float)
+        self.npv.add(npv)
+        self.time_mean_npv.add(npv.mean(keepdims=True))
+        self.costs.add(costs)
+        self.revenues.add(revenues)
+
+    def add_runs(self, npvs, costs, revenues, stats: Optional[SimulationStats] = None):
+        """
+        Adds the series of several finished runs, given as (runs × time steps) arrays, and
+        their stats if they were profiled.
+        """
+        for run in zip(npvs, costs, revenues):
+            self.add_run(*run)
+        self.stats = SimulationStats.combine([self.stats, stats])
+
+    def npv_confidence_interval(self, confidence: float = 0.95, metric: str = 'final') -> ConfidenceInterval:
+        """
+        The confidence interval of the expected npv of a run. The metric is either 'final',
+        the npv at the end of the simulation, or 'mean', the mean npv over the simulation.
+        """
+        if metric == 'final':
+            statistics, i = self.npv, -1
+        elif metric == 'mean':
+            statistics, i = self.time_mean_npv, 0
+        else:
+            raise ValueError(f'Unknown npv metric {metric}, expected final or mean')
+
+        z = NormalDist().inv_cdf((1 + confidence) / 2)
+        half_width = z * statistics.std()[i] / math.sqrt(self.runs) if self.runs >= 2 else math.inf
+        return ConfidenceInterval(float(statistics.mean[i]), float(half_width), confidence, self.runs)
+
+    def mean_npv_array(self) -> np.ndarray:
+        return self.npv.mean.copy()
+
+    def normalize_npv(self):
+        mean_npv = self.npv.mean
+        min_npv = mean_npv.min()
+        return ((mean_npv - min_npv) / (mean_npv.max() - min_npv)).tolist()
+
+    def mean_npv_payback_time(self):
+        """
+        Calculates the time it takes before the mean npv
+        starts to generate value. If the mean NPV doesn't
+        go above 0 then -1 is returned.
+        """
+        positive = np.flatnonzero(self.npv.mean > 0)
+        return self.time[positive[0]].item() if len(positive) > 0 else -1
+
+    def mean_npv(self):
+        return self.npv.mean.tolist()
+
+    def mean_costs(self):
+        return self.costs.mean.tolist()
+
+    def mean_revenues(self):
+        return self.revenues.mean.tolist()
+
+    def discounted_mean_npv(self, discount_rates) -> np.ndarray:
+        """
+        The (rates × time steps) mean cumulative NPV for each of the discount rates, calculated from
+        the mean cashflows. The NPV is linear in the cashflows, so this is the same as the mean of the
+        re-discounted runs.
+        """
+        cashflows = np.zeros(len(self.time))
+        cashflows[1:] = np.diff(self.revenues.mean) - np.diff(self.costs.mean)
+        return discount_cashflows(cashflows, discount_rates, self.time)
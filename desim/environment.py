@@ -0,0 +1,40 @@
+from heapq import heappush
+from typing import Optional
+
+import simpy
+
+# The tolerance, in time steps, within which the time of an event is on a time step
+STEP_TOLERANCE = 1e-9
+
+
+class SteppedEnvironment(simpy.Environment):
+    """
+    A simpy environment that puts the events that are within rounding errors of a time step
+    exactly on the time step, at step × timestep.
+
+    The times of the events are sums of their delays, and sums of a time step such as 0.1 or 1/12
+    drift away from the time steps in different ways. Events that should happen at the same time
+    step would otherwise be ordered by their rounding errors instead of by their priority and the
+    order they were scheduled in. The events are not moved if the time step is None.
+    """
+
+    def __init__(self, timestep: Optional[float], initial_time=0) -> None:
+        super().__init__(initial_time)
+        self.timestep = timestep
+
+    def schedule(self, event, priority=simpy.core.NORMAL, delay=0):
+        time = self._now + delay
+        if delay > 0 and self.timestep is not None:
+            steps = time / self.timestep
+            step = round(steps)
+            if abs(steps - step) < STEP_TOLERANCE:
+                time = step * self.timestep
+        heappush(self._queue, (time, priority, next(self._eid), event))
+
+
+def drifts(timestep: float) -> bool:
+    """
+    Whether the sums of a time step drift away from its multiples. The sums of a step that is a
+    binary fraction, such as 0.25, are exact and do not need a stepped environment.
+    """
+    return not (timestep * 2 ** 20).is_integer()
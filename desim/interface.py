@@ -1,7 +1,93 @@
-from typing import List
+from typing import AsyncIterator, Dict, List, Optional, Union
+import asyncio
+import functools
+import inspect
+import math
 import multiprocessing as mp
-from desim.data import SimResults, TimeFormat
-from desim.simulation import Process, Simulation, NonTechCost
+import pickle
+import uuid
+import weakref
+
+import numpy as np
+
+from desim.analytic import AnalyticModel
+from desim.batch import BatchModel
+from desim.cache import ResultsCache, is_deterministic, model_key
+from desim.data import SharedResultsMemory, SimResults, SimulationProgress, StreamingSimResults, TimeFormat
+from desim.profiling import SimulationStats
+from desim.simulation import Process, SimulationModel, NonTechCost
+from desim.sweep import MODEL_OPTIONS, apply_design, halving_eliminated, named_designs, racing_eliminated, \
+    racing_rounds
+
+# The models that have been unpickled by a worker process, keyed by the key given by Des
+worker_models = dict()
+
+# The engines that can run the simulations, simpy runs every run as a discrete event simulation and
+# batch runs many runs at once with numpy
+ENGINES = ('simpy', 'batch')
+
+# The largest amount of runs in each task of a streaming simulation, which bounds the memory used
+# for the runs that have not been aggregated yet
+STREAMING_CHUNK_SIZE = 100
+
+
+def get_worker_model(key: str, payload: bytes) -> SimulationModel:
+    """
+    Returns the model of a task in a worker process. The model is only unpickled
+    the first time the worker sees its key.
+    """
+    model = worker_models.get(key)
+    if model is None:
+        worker_models.clear()  # Only the latest model is kept
+        model = pickle.loads(payload)
+        worker_models[key] = model
+    return model
+
+
+def run_worker_chunk(task):
+    """
+    Runs a chunk of simulations in a worker process. The task is (model key, pickled model,
+    shared memory block, index of the first run, runs). The model is only unpickled the first
+    time the worker sees its key. The results are written directly to the shared memory block.
+    Returns the stats of the runs if the model is profiled.
+    """
+    key, payload, block, start, runs = task
+    model = get_worker_model(key, payload)
+
+    time, npvs, costs, revenues = block.arrays()
+    stats = model.run_into(time, npvs, costs, revenues, start, runs)
+    del time, npvs, costs, revenues
+    block.close()
+    return stats
+
+
+def run_worker_chunk_series(task):
+    """
+    Runs a chunk of simulations in a worker process. The task is (model key, pickled model,
+    index of the first run, runs). Returns the (runs × time steps) arrays of the cumulative NPVs,
+    total costs and total revenues, and the stats of the runs if the model is profiled.
+    """
+    key, payload, start, runs = task
+    return run_chunk_series(get_worker_model(key, payload), start, runs)
+
+
+def run_chunk_series(model, start: int, runs: int):
+    """
+    Runs the runs start to start + runs of the model. Returns the (runs × time steps) arrays of the
+    cumulative NPVs, total costs and total revenues, and the stats of the runs if the model is profiled.
+    """
+    time, npvs, costs, revenues = model.allocate_series(runs)
+    stats = model.run_into(time, npvs, costs, revenues, 0, runs, run_offset=start)
+    return npvs, costs, revenues, stats
+
+
+def run_worker_sweep_chunk(task):
+    """
+    Runs a chunk of simulations of one design of a sweep in a worker process. The task is (design,
+    task of run_worker_chunk_series). Returns the design, the index of the first run and the series of the runs.
+    """
+    design, task = task
+    return design, task[2], run_worker_chunk_series(task)
 
 
 class Des(object):
@@ -15,13 +101,214 @@ class Des(object):
       Parallellized simulation.
     """
 
-    def __init__(self) -> None:
-        pass
+    def __init__(self, workers: Optional[int] = None, chunk_size: Optional[int] = None, engine: str = 'simpy',
+                 cache: Optional[ResultsCache] = None) -> None:
+        """
+        Parameters:
+          workers (int): The amount of worker processes used for parallel simulations. Defaults to the cpu count.
+          chunk_size (int): The amount of runs in each task sent to a worker. Defaults to spreading the runs
+            over four tasks per worker.
+          engine (str): The engine that runs the simulations, 'simpy' or 'batch'. The batch engine runs the runs
+            of a chunk together as numpy arrays, which is much faster but does not support DSM rows that sum to
+            more than 1, and its seeded runs depend on how the runs are divided into chunks.
+          cache (ResultsCache): A cache of the results of run_simulation, run_monte_carlo_simulation,
+            run_parallell_simulations and run_analytic_simulation. Seeded simulations with the same inputs are
+            served from the cache instead of being run again. Streaming results are not cached.
+
+        The worker pool is created on the first parallel simulation and reused until close is called.
+        Des can also be used as a context manager that closes the pool on exit. A pool that is not closed
+        is terminated when Des is garbage collected.
+        """
+        if engine not in ENGINES:
+            raise ValueError(f'Unknown engine {engine}, expected one of {ENGINES}')
+        self.workers = workers if workers is not None else mp.cpu_count()
+        self.chunk_size = chunk_size
+        self.engine = engine
+        self.cache = cache
+        self.pool = None
+        self.pool_finalizer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def get_pool(self):
+        """
+        Returns the worker pool, creating it if needed.
+        """
+        if self.pool is None:
+            # Important! Spawned workers are needed, if forked the server will be terminated after
+            # the simulation is complete.
+            self.pool = mp.get_context('spawn').Pool(self.workers)
+            self.pool_finalizer = weakref.finalize(self, self.pool.terminate)
+        return self.pool
+
+    def close(self):
+        """
+        Closes the worker pool and waits for the workers to exit.
+        """
+        if self.pool is not None:
+            self.pool_finalizer.detach()
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+    def get_chunks(self, runs: int, max_chunk_size: Optional[int] = None, total_runs: Optional[int] = None) -> List[int]:
+        """
+        Divides the runs into the amount of runs of each task sent to the workers. The default chunk size
+        spreads the total runs, of all models that share the pool, over four tasks per worker.
+        """
+        chunk_size = self.chunk_size or max(1, math.ceil((total_runs or runs) / (self.workers * 4)))
+        if max_chunk_size is not None:
+            chunk_size = min(chunk_size, max_chunk_size)
+        return [min(chunk_size, runs - start) for start in range(0, runs, chunk_size)]
+
+    def cached_results(self, model, method: str, runs: int, run, deterministic: bool = False, **parameters):
+        """
+        Returns the results of running the model with a method from the cache, or runs them with run and
+        caches them. Only deterministic results are cached, which are the results of seeded runs. Profiled
+        runs are always run, since their stats are measured.
+        """
+        if self.cache is None or getattr(model, 'model', model).profile or not (deterministic or is_deterministic(model)):
+            return run()
+        return self.cache.get_or_run(model_key(model, method, runs, **parameters), run)
+
+    def create_model(self, *args, **options):
+        """
+        Creates the model that runs the simulations with the engine of Des. Takes the parameters of SimulationModel.
+        """
+        model = SimulationModel(*args, **options)
+        if self.engine == 'batch':
+            return BatchModel(model)
+        return model
+
+    def run_model_in_parallell(self, model: SimulationModel, runs: int):
+        """
+        Runs the model @runs times on the worker pool. The workers write the results to
+        the returned shared memory block. Also returns the stats of all workers merged,
+        if the model is profiled.
+        """
+        key = uuid.uuid4().hex
+        payload = pickle.dumps(model)  # Pickled once, the workers unpickle it once
+        block = SharedResultsMemory(runs, model.steps)
+        try:
+            chunks = self.get_chunks(runs)
+            starts = np.cumsum([0] + chunks[:-1])
+            tasks = [(key, payload, block, int(start), chunk) for start, chunk in zip(starts, chunks)]
+            stats = SimulationStats.combine(self.get_pool().map(run_worker_chunk, tasks))
+        finally:
+            # The name is no longer needed, the memory is freed when the block is no longer used
+            block.unlink()
+
+        return block, stats
+
+    def stream_model(self, model: SimulationModel, runs: int, results: StreamingSimResults, parallell: bool,
+                     task=None) -> StreamingSimResults:
+        """
+        Runs the model @runs times, serially or on the worker pool, and adds each finished
+        run to the streaming results without keeping it. The task is the (key, pickled model)
+        sent to the workers, given when the same model is streamed several times.
+        """
+        first_run = results.runs  # The runs continue from the runs already in the results
+        chunks = self.get_chunks(runs, STREAMING_CHUNK_SIZE)
+        starts = first_run + np.cumsum([0] + chunks[:-1])
+        if not parallell:
+            for start, chunk in zip(starts, chunks):
+                results.add_runs(*run_chunk_series(model, int(start), chunk))
+            return results
+
+        key, payload = task or (uuid.uuid4().hex, pickle.dumps(model))
+        tasks = [(key, payload, int(start), chunk) for start, chunk in zip(starts, chunks)]
+        for series in self.get_pool().imap_unordered(run_worker_chunk_series, tasks):
+            results.add_runs(*series)
+
+        return results
+
+    def submit_chunk(self, loop, model, task, start: int, runs: int) -> asyncio.Future:
+        """
+        Runs the runs start to start + runs of the model without blocking the event loop, on the worker
+        pool or, if task is None, in a thread of the loop. The task is the (key, pickled model) sent to
+        the workers. Returns a future of (index of the first run, series of the runs).
+        """
+        if task is None:
+            return loop.run_in_executor(None, lambda: (start, run_chunk_series(model, start, runs)))
+
+        future = loop.create_future()
+
+        def resolve(setter, value):
+            if not future.done():  # The future is cancelled when the caller no longer waits for the runs
+                setter(value)
+
+        def callback(setter, value):
+            # Called by the result thread of the pool, which must not be stopped by an error
+            try:
+                loop.call_soon_threadsafe(resolve, setter, value)
+            except RuntimeError:
+                pass  # The event loop has been closed
+
+        self.get_pool().apply_async(run_worker_chunk_series, ((task[0], task[1], start, runs),),
+                                    callback=lambda series: callback(future.set_result, (start, series)),
+                                    error_callback=lambda error: callback(future.set_exception, error))
+        return future
+
+    async def iter_model(self, model, processes: List[Process], runs: int, streaming: bool,
+                         parallell: bool) -> AsyncIterator[SimulationProgress]:
+        """
+        Runs the model @runs times without blocking the event loop, on the worker pool or serially in a
+        thread, and yields the progress each time a chunk of runs has finished. The last progress has the
+        results, StreamingSimResults if streaming is set and otherwise SimResults with every run.
+
+        At most two chunks per worker are queued at once. If the caller stops iterating or is cancelled, the
+        chunks that have not been queued are never run and the results of the queued chunks are dropped.
+        """
+        loop = asyncio.get_running_loop()
+        chunks = self.get_chunks(runs, STREAMING_CHUNK_SIZE)
+        queue = list(zip([int(start) for start in np.cumsum([0] + chunks[:-1])], chunks))
+        task = (uuid.uuid4().hex, pickle.dumps(model)) if parallell else None
+        limit = 2 * self.workers if parallell else 1
+
+        if streaming:
+            results = StreamingSimResults('No Design', processes, model.time_steps)
+        else:
+            time, npvs, costs, revenues = model.allocate_series(runs)
+            time[:] = model.time_steps
+            stats = []
+
+        finished = 0
+        npv_sum = 0.0
+        pending = set()
+        try:
+            while queue or pending:
+                while queue and len(pending) < limit:
+                    pending.add(self.submit_chunk(loop, model, task, *queue.pop(0)))
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for future in done:
+                    start, series = future.result()
+                    if streaming:
+                        results.add_runs(*series)
+                    else:
+                        end = start + len(series[0])
+                        npvs[start:end], costs[start:end], revenues[start:end] = series[:3]
+                        stats.append(series[3])
+                    finished += len(series[0])
+                    npv_sum += float(np.sum(series[0][:, -1]))
+                    if finished < runs:
+                        yield SimulationProgress(finished, runs, npv_sum / finished)
+        finally:
+            for future in pending:
+                future.cancel()
+
+        if not streaming:
+            results = SimResults('No Design', processes, time, npvs, costs, revenues)
+            results.stats = SimulationStats.combine(stats)
+        yield SimulationProgress(runs, runs, npv_sum / runs if runs > 0 else 0.0, results)
 
     def run_simulation(self, flow_time: float, flow_rate: float,
                        flow_start_process: str, processes: List[Process],
                        non_tech_processes, non_tech_costs: NonTechCost, dsm: dict, time_format: TimeFormat,
-                       discount_rate=0.08, until=100):
+                       discount_rate=0.08, until=100, **options):
         """
         Function for running a standard discrete event simulation. Will run the simulation once.
 
@@ -36,20 +323,32 @@ class Des(object):
           time_format (TimeFormat): The unit of time of the simulation.
           discount_rate (float): The discount rate.
           until (float): For how long the simulation will run.
+          options: Options of the SimulationModel, such as coalesce_events, cohorts or seed.
 
         """
 
-        sim = Simulation(flow_time, flow_rate, flow_start_process, until, discount_rate,
-                         processes, non_tech_processes, non_tech_costs, dsm, time_format)
-        sim.run_simulation()
+        model = self.create_model(flow_time, flow_rate, flow_start_process, until, discount_rate,
+                                  processes, non_tech_processes, non_tech_costs, dsm, time_format, **options)
 
-        return SimResults('No Design', processes, [sim.time_steps], [sim.cum_NPV], [sim.total_costs],
-                          [sim.total_revenue])
+        def run():
+            if self.engine == 'batch':
+                time, npvs, costs, revenues = model.allocate_series(1)
+                stats = model.run_into(time, npvs, costs, revenues, 0, 1)
+                results = SimResults('No Design', processes, time, npvs, costs, revenues)
+            else:
+                sim = model.run_simulation()
+                results = SimResults('No Design', processes, [sim.time_steps], [sim.cum_NPV], [sim.total_costs],
+                                     [sim.total_revenue])
+                stats = sim.stats
+            results.stats = stats
+            return results
+
+        return self.cached_results(model, 'simulation', 1, run)
 
     def run_monte_carlo_simulation(self, flow_time: float, flow_rate: float,
                                    flow_start_process: str, processes: List[Process],
                                    non_tech_processes, non_tech_costs: NonTechCost, dsm: dict, time_format: TimeFormat,
-                                   discount_rate=0.08, until=100, runs=300):
+                                   discount_rate=0.08, until=100, runs=300, streaming=False, **options):
         """
         Function for running a monte carlo version of the simulation. Will run the simulation @runs amount of times.
 
@@ -65,30 +364,31 @@ class Des(object):
           discount_rate (float): The discount rate.
           until (float): For how long the simulation will run.
           runs (int): The amount of times the simulation will be run.
+          streaming (bool): Aggregate the runs as they finish and return StreamingSimResults, so that
+            the memory does not grow with the amount of runs.
+          options: Options of the SimulationModel, such as coalesce_events, cohorts or seed.
 
         """
 
-        time_steps = []
-        cumulative_NPV = []
-        total_costs = []
-        total_revenue = []
-
-        for _ in range(runs):
-            sim = Simulation(flow_time, flow_rate, flow_start_process, until, discount_rate,
-                             processes, non_tech_processes, non_tech_costs, dsm, time_format)
-            sim.run_simulation()
+        model = self.create_model(flow_time, flow_rate, flow_start_process, until, discount_rate,
+                                  processes, non_tech_processes, non_tech_costs, dsm, time_format, **options)
+        if streaming:
+            results = StreamingSimResults('No Design', processes, model.time_steps)
+            return self.stream_model(model, runs, results, parallell=False)
 
-            time_steps.append(sim.time_steps)
-            cumulative_NPV.append(sim.cum_NPV)
-            total_costs.append(sim.total_costs)
-            total_revenue.append(sim.total_revenue)
+        def run():
+            time, npvs, costs, revenues = model.allocate_series(runs)
+            stats = model.run_into(time, npvs, costs, revenues, 0, runs)
+            results = SimResults('No Design', processes, time, npvs, costs, revenues)
+            results.stats = stats
+            return results
 
-        return SimResults('No Design', processes, time_steps, cumulative_NPV, total_costs, total_revenue)
+        return self.cached_results(model, 'monte_carlo', runs, run)
 
     def run_parallell_simulations(self, flow_time: float, flow_rate: float,
                                   flow_start_process: str, processes: List[Process],
                                   non_tech_processes, non_tech_costs: NonTechCost, dsm: dict, time_format: TimeFormat,
-                                  discount_rate=0.08, until=100, runs=300):
+                                  discount_rate=0.08, until=100, runs=300, streaming=False, **options):
         """
         Function for running a parallelized monte carlo version of the simulation.
         Will run the simulation @runs amount of times.
@@ -105,48 +405,398 @@ class Des(object):
           discount_rate (float): The discount rate.
           until (float): For how long the simulation will run.
           runs (int): The amount of times the simulation will be run.
+          streaming (bool): Aggregate the runs as they finish and return StreamingSimResults, so that
+            the memory does not grow with the amount of runs.
+          options: Options of the SimulationModel, such as coalesce_events, cohorts or seed.
+
+        """
+
+        model = self.create_model(flow_time, flow_rate, flow_start_process, until, discount_rate,
+                                  processes, non_tech_processes, non_tech_costs, dsm, time_format, **options)
+        if streaming:
+            results = StreamingSimResults('No Design', processes, model.time_steps)
+            return self.stream_model(model, runs, results, parallell=True)
+
+        def run():
+            block, stats = self.run_model_in_parallell(model, runs)
+            results = SimResults.from_shared_memory('No Design', processes, block)
+            results.stats = stats
+            return results
+
+        # The seeded runs of the batch engine depend on how they are divided into chunks
+        chunks = self.get_chunks(runs) if self.engine == 'batch' else None
+        return self.cached_results(model, 'parallell', runs, run, chunks=chunks)
+
+    def run_analytic_simulation(self, flow_time: float, flow_rate: float,
+                                flow_start_process: str, processes: List[Process],
+                                non_tech_processes, non_tech_costs: NonTechCost, dsm: dict, time_format: TimeFormat,
+                                discount_rate=0.08, until=100, **options):
+        """
+        Function for calculating the expected results of the simulation without running it. The DSM is
+        solved as an absorbing Markov chain, which gives the mean of infinitely many monte carlo runs.
+        The results have a single run with the expected series.
+
+        Parameters:
+          flow_time (float): The time that entities will flow in the simulation.
+          flow_rate (float): The rate that entities will flow in the simulation. Calculated as Product/time_unit
+          flow_start_process (str): The process that will start the flow of entites. Takes the name of the process.
+          processes (List[Process]): The list of processes of the simulation.
+          non_tech_processes (List[NonTechProcess]): The list of non technical processes in the simulation.
+          non_tech_costs (NonTechCost): How the non technical processes will be distributed.
+          dsm (dict): A design structure matrix showing how the processes interact with eachother.
+          time_format (TimeFormat): The unit of time of the simulation.
+          discount_rate (float): The discount rate.
+          until (float): For how long the simulation will run.
+          options: Options of the SimulationModel. The options that only change how the simulation is run,
+            such as coalesce_events or seed, do not change the expected results.
+
+        """
+
+        model = SimulationModel(flow_time, flow_rate, flow_start_process, until, discount_rate,
+                                processes, non_tech_processes, non_tech_costs, dsm, time_format, **options)
+
+        def run():
+            time, npv, costs, revenues = AnalyticModel(model).expected_series()
+            return SimResults('No Design', processes, time, [npv], [costs], [revenues])
+
+        return self.cached_results(model, 'analytic', 1, run, deterministic=True)
+
+    async def run_simulation_async(self, *args, **kwargs):
+        """
+        Runs run_simulation in a thread of the event loop, so that the loop is not blocked.
+        Takes the same parameters as run_simulation.
+        """
+        return await asyncio.get_running_loop().run_in_executor(
+            None, functools.partial(self.run_simulation, *args, **kwargs))
+
+    async def run_analytic_simulation_async(self, *args, **kwargs):
+        """
+        Runs run_analytic_simulation in a thread of the event loop, so that the loop is not blocked.
+        Takes the same parameters as run_analytic_simulation.
+        """
+        return await asyncio.get_running_loop().run_in_executor(
+            None, functools.partial(self.run_analytic_simulation, *args, **kwargs))
+
+    def iter_monte_carlo_simulation(self, flow_time: float, flow_rate: float,
+                                    flow_start_process: str, processes: List[Process],
+                                    non_tech_processes, non_tech_costs: NonTechCost, dsm: dict, time_format: TimeFormat,
+                                    discount_rate=0.08, until=100, runs=300, streaming=False, parallell=True,
+                                    **options) -> AsyncIterator[SimulationProgress]:
+        """
+        Function for running a monte carlo version of the simulation without blocking the event loop.
+        Returns an async iterator of the progress of the runs, SimulationProgress with the runs that have
+        finished and their mean npv. The last progress has the results.
+
+        Stopping the iteration, or cancelling the task that iterates, stops the simulation. The runs that
+        the workers have already started are finished but not waited for.
+
+        Parameters:
+          flow_time (float): The time that entities will flow in the simulation.
+          flow_rate (float): The rate that entities will flow in the simulation. Calculated as Product/time_unit
+          flow_start_process (str): The process that will start the flow of entites. Takes the name of the process.
+          processes (List[Process]): The list of processes of the simulation.
+          non_tech_processes (List[NonTechProcess]): The list of non technical processes in the simulation.
+          non_tech_costs (NonTechCost): How the non technical processes will be distributed.
+          dsm (dict): A design structure matrix showing how the processes interact with eachother.
+          time_format (TimeFormat): The unit of time of the simulation.
+          discount_rate (float): The discount rate.
+          until (float): For how long the simulation will run.
+          runs (int): The amount of times the simulation will be run.
+          streaming (bool): Aggregate the runs as they finish and return StreamingSimResults, so that
+            the memory does not grow with the amount of runs.
+          parallell (bool): Run the simulations on the worker pool, otherwise in a thread of the event loop.
+          options: Options of the SimulationModel, such as coalesce_events, cohorts or seed.
 
+        The runs are divided into chunks of at most STREAMING_CHUNK_SIZE runs, so the seeded runs of the
+        batch engine differ from those of run_monte_carlo_simulation. The results are not cached.
         """
+        model = self.create_model(flow_time, flow_rate, flow_start_process, until, discount_rate,
+                                  processes, non_tech_processes, non_tech_costs, dsm, time_format, **options)
+        return self.iter_model(model, processes, runs, streaming, parallell)
 
-        time_steps = []
-        cumulative_NPV = []
-        total_costs = []
-        total_revenue = []
+    async def run_monte_carlo_simulation_async(self, *args, progress=None, **kwargs):
+        """
+        Function for running a monte carlo version of the simulation without blocking the event loop, and
+        returning the results when all runs have finished. Takes the same parameters as
+        iter_monte_carlo_simulation, and progress, a function or coroutine function that is called
+        with the SimulationProgress each time a chunk of runs has finished.
 
-        # Try/Catch because it can only be set once.
+        Cancelling the task that awaits the results stops the simulation.
+        """
+        iterator = self.iter_monte_carlo_simulation(*args, **kwargs)
         try:
-            # Important! If not set, the server will be terminated after simulation is complete.
-            mp.set_start_method('spawn')
-        except RuntimeError:
-            pass
-        pool = mp.Pool(mp.cpu_count())
+            async for update in iterator:
+                if progress is not None:
+                    result = progress(update)
+                    if inspect.isawaitable(result):
+                        await result
+        finally:
+            await iterator.aclose()
+        return update.results
+
+    def run_adaptive_simulation(self, flow_time: float, flow_rate: float,
+                                flow_start_process: str, processes: List[Process],
+                                non_tech_processes, non_tech_costs: NonTechCost, dsm: dict, time_format: TimeFormat,
+                                discount_rate=0.08, until=100, target=0.05, confidence=0.95, metric='final',
+                                min_runs=30, max_runs=10000, batch_size=None, parallell=False, **options):
+        """
+        Function for running a monte carlo version of the simulation until the expected npv is known
+        with the wanted precision. Runs batches of simulations until the relative half width of the
+        confidence interval of the npv is at most @target, or until @max_runs runs have been made.
+
+        Parameters:
+          flow_time (float): The time that entities will flow in the simulation.
+          flow_rate (float): The rate that entities will flow in the simulation. Calculated as Product/time_unit
+          flow_start_process (str): The process that will start the flow of entites. Takes the name of the process.
+          processes (List[Process]): The list of processes of the simulation.
+          non_tech_processes (List[NonTechProcess]): The list of non technical processes in the simulation.
+          non_tech_costs (NonTechCost): How the non technical processes will be distributed.
+          dsm (dict): A design structure matrix showing how the processes interact with eachother.
+          time_format (TimeFormat): The unit of time of the simulation.
+          discount_rate (float): The discount rate.
+          until (float): For how long the simulation will run.
+          target (float): The largest accepted half width of the confidence interval, relative to the npv.
+          confidence (float): The confidence level of the interval.
+          metric (str): The npv that is estimated, 'final' for the npv at the end or 'mean' for the mean over time.
+          min_runs (int): The amount of runs made before the precision is checked.
+          max_runs (int): The largest amount of runs that are made.
+          batch_size (int): The smallest amount of runs made between the checks. Defaults to min_runs.
+          parallell (bool): Run the batches on the worker pool.
+          options: Options of the SimulationModel, such as coalesce_events, cohorts or seed.
+
+        Returns StreamingSimResults with the achieved confidence_interval and whether the target
+        was met as converged. The amount of runs used is results.runs.
+        """
+        if min_runs < 2 or max_runs < min_runs:
+            raise ValueError('At least two runs are needed and max_runs can not be less than min_runs')
+        if metric not in ('final', 'mean'):
+            raise ValueError(f'Unknown npv metric {metric}, expected final or mean')
+        if target <= 0:
+            raise ValueError('The target relative half width must be positive')
 
-        mp_processes = [
-            pool.apply_async(func=self.help_run_simulation, args=(flow_time, flow_rate, flow_start_process, processes,
-                                                                  non_tech_processes, non_tech_costs, dsm, time_format,
-                                                                  discount_rate, until)) for _ in range(runs)]
+        model = self.create_model(flow_time, flow_rate, flow_start_process, until, discount_rate,
+                                  processes, non_tech_processes, non_tech_costs, dsm, time_format, **options)
+        results = StreamingSimResults('No Design', processes, model.time_steps)
+        task = (uuid.uuid4().hex, pickle.dumps(model)) if parallell else None
+        batch_size = batch_size or min_runs
 
-        res = [f.get() for f in mp_processes]
+        runs = min_runs
+        while True:
+            self.stream_model(model, runs, results, parallell, task)
+            interval = results.npv_confidence_interval(confidence, metric)
+            if interval.relative_half_width <= target or results.runs >= max_runs:
+                break
 
-        for time, npv, cost, revenue in res:
-            time_steps.append(time)
-            cumulative_NPV.append(npv)
-            total_costs.append(cost)
-            total_revenue.append(revenue)
+            # The half width shrinks with the square root of the runs, estimate the runs needed to reach the
+            # target but at most double the runs, since the estimate is noisy with few runs. Without an
+            # estimate, when the mean is 0, the largest batch is made.
+            runs = min(results.runs, max_runs - results.runs)
+            if math.isfinite(interval.relative_half_width):
+                needed = results.runs * (interval.relative_half_width / target) ** 2
+                runs = int(min(max(batch_size, math.ceil(needed) - results.runs), runs))
 
-        return SimResults('No Design', processes, time_steps, cumulative_NPV, total_costs, total_revenue)
+        results.confidence_interval = interval
+        results.converged = interval.relative_half_width <= target
+        return results
 
-    def help_run_simulation(self, flow_time: float, flow_rate: float,
-                            flow_start_process: str, processes: List[Process],
-                            non_tech_processes, non_tech_costs: NonTechCost, dsm: dict, time_format: TimeFormat,
-                            discount_rate=0.08, until=100):
+    def run_sweep(self, designs: Union[Dict[str, dict], List[dict]], flow_time: float, flow_rate: float,
+                  flow_start_process: str, processes: List[Process],
+                  non_tech_processes, non_tech_costs: NonTechCost, dsm: dict, time_format: TimeFormat,
+                  discount_rate=0.08, until=100, runs=300, streaming=False, parallell=True,
+                  **options) -> Dict[str, Union[SimResults, StreamingSimResults]]:
         """
-        Helper function for the parallelization module in this class.
+        Function for running a monte carlo simulation of every design in a design space. The designs are
+        overrides of the given base simulation, and the runs of all designs are scheduled together on the
+        worker pool, so that the workers are kept busy until the whole sweep is done.
 
+        Parameters:
+          designs: The overrides of each design, as {name: overrides} or as a list of overrides named after
+            their values. See desim.sweep.apply_design for the overrides and desim.sweep.design_grid for
+            creating the designs of a grid.
+          flow_time (float): The time that entities will flow in the simulation.
+          flow_rate (float): The rate that entities will flow in the simulation. Calculated as Product/time_unit
+          flow_start_process (str): The process that will start the flow of entites. Takes the name of the process.
+          processes (List[Process]): The list of processes of the simulation.
+          non_tech_processes (List[NonTechProcess]): The list of non technical processes in the simulation.
+          non_tech_costs (NonTechCost): How the non technical processes will be distributed.
+          dsm (dict): A design structure matrix showing how the processes interact with eachother.
+          time_format (TimeFormat): The unit of time of the simulation.
+          discount_rate (float): The discount rate.
+          until (float): For how long the simulation will run.
+          runs (int): The amount of times the simulation of each design will be run.
+          streaming (bool): Aggregate the runs as they finish and return StreamingSimResults.
+          parallell (bool): Run the designs on the worker pool.
+          options: Options of the SimulationModel, such as coalesce_events, cohorts or seed.
+
+        Returns the results of each design as {name: results}, in the order of the designs.
+        """
+        base = dict(flow_time=flow_time, flow_rate=flow_rate, flow_start_process=flow_start_process,
+                    processes=processes, non_tech_processes=non_tech_processes, non_tech_costs=non_tech_costs,
+                    dsm=dsm, time_format=time_format, discount_rate=discount_rate, until=until, **options)
+        models = self.create_design_models(base, designs)
+        if streaming:
+            results = {name: StreamingSimResults(name, design_processes, model.time_steps)
+                       for name, (design_processes, model) in models.items()}
+            return self.stream_designs(models, results, runs, parallell)
+
+        series = {name: model.allocate_series(runs) for name, (_, model) in models.items()}
+        stats = {name: None for name in models}
+        if not parallell:
+            for name, (_, model) in models.items():
+                stats[name] = model.run_into(*series[name], 0, runs)
+        else:
+            tasks = [(name, (key, payload, start, chunk)) for name, (start, chunk), (key, payload)
+                     in self.design_chunks(models, {name: 0 for name in models}, runs)]
+            for name, (_, model) in models.items():
+                series[name][0][:] = model.time_steps
+
+            for name, start, (npvs, costs, revenues, chunk_stats) in self.get_pool().imap_unordered(
+                    run_worker_sweep_chunk, tasks):
+                _, all_npvs, all_costs, all_revenues = series[name]
+                all_npvs[start:start + len(npvs)] = npvs
+                all_costs[start:start + len(npvs)] = costs
+                all_revenues[start:start + len(npvs)] = revenues
+                stats[name] = SimulationStats.combine([stats[name], chunk_stats])
+
+        results = {name: SimResults(name, models[name][0], *series[name]) for name in models}
+        for name, design_results in results.items():
+            design_results.stats = stats[name]
+        return results
+
+    def run_race(self, designs: Union[Dict[str, dict], List[dict]], flow_time: float, flow_rate: float,
+                 flow_start_process: str, processes: List[Process],
+                 non_tech_processes, non_tech_costs: NonTechCost, dsm: dict, time_format: TimeFormat,
+                 discount_rate=0.08, until=100, keep=1, method='racing', confidence=0.95, min_runs=30,
+                 max_runs=1000, batch_size=None, parallell=False, **options) -> Dict[str, StreamingSimResults]:
+        """
+        Function for finding the best designs, by their expected npv at the end of the simulation, without
+        running every design the full amount of times. The designs are run in rounds and the designs that
+        are clearly worse are dropped, so that the runs are spent on the designs that can still be the best.
+
+        Two methods can be used:
+          racing: Every round each remaining design is run @batch_size more times, and the designs whose
+            confidence interval is entirely below the intervals of @keep other designs are dropped. The
+            confidence is divided over the designs and the largest amount of rounds, so that the intervals
+            of every design in every round hold together with at least the given confidence.
+          halving: The remaining designs are run until they have twice as many runs as in the last round,
+            starting with @min_runs, and the worse half of them by the mean npv is dropped.
+        The race ends when @keep designs remain or the remaining designs have been run @max_runs times.
+        Designs run with the same seed draw the same random numbers, which makes the comparisons more precise.
+
+        Parameters:
+          designs: The overrides of each design, as {name: overrides} or as a list of overrides, as in run_sweep.
+          flow_time (float): The time that entities will flow in the simulation.
+          flow_rate (float): The rate that entities will flow in the simulation. Calculated as Product/time_unit
+          flow_start_process (str): The process that will start the flow of entites. Takes the name of the process.
+          processes (List[Process]): The list of processes of the simulation.
+          non_tech_processes (List[NonTechProcess]): The list of non technical processes in the simulation.
+          non_tech_costs (NonTechCost): How the non technical processes will be distributed.
+          dsm (dict): A design structure matrix showing how the processes interact with eachother.
+          time_format (TimeFormat): The unit of time of the simulation.
+          discount_rate (float): The discount rate.
+          until (float): For how long the simulation will run.
+          keep (int): The amount of best designs that are wanted.
+          method (str): 'racing' or 'halving'.
+          confidence (float): The confidence that no design that is among the best is dropped by racing.
+          min_runs (int): The amount of runs of each design in the first round.
+          max_runs (int): The largest amount of runs of a design.
+          batch_size (int): The amount of runs added to each design every round of racing. Defaults to min_runs.
+          parallell (bool): Run the rounds on the worker pool.
+          options: Options of the SimulationModel, such as coalesce_events, cohorts or seed.
+
+        Returns the StreamingSimResults of every design as {name: results}, with the remaining designs first
+        and each group ordered by the mean final npv. The results have the confidence_interval of the final
+        npv and whether they were eliminated.
+        """
+        if method not in ('racing', 'halving'):
+            raise ValueError(f'Unknown method {method}, expected racing or halving')
+        if keep < 1 or min_runs < 2 or max_runs < min_runs:
+            raise ValueError('At least one design is kept, at least two runs are needed and max_runs '
+                             'can not be less than min_runs')
+
+        base = dict(flow_time=flow_time, flow_rate=flow_rate, flow_start_process=flow_start_process,
+                    processes=processes, non_tech_processes=non_tech_processes, non_tech_costs=non_tech_costs,
+                    dsm=dsm, time_format=time_format, discount_rate=discount_rate, until=until, **options)
+        models = self.create_design_models(base, designs)
+        payloads = {name: (uuid.uuid4().hex, pickle.dumps(model)) for name, (_, model) in models.items()} \
+            if parallell else None
+        results = {name: StreamingSimResults(name, design_processes, model.time_steps)
+                   for name, (design_processes, model) in models.items()}
+        batch_size = batch_size or min_runs
+        # The intervals of all designs in all rounds hold together with the given confidence when racing,
+        # halving only uses the intervals for the results
+        looks = len(models) * (racing_rounds(min_runs, max_runs, batch_size) if method == 'racing' else 1)
+        design_confidence = 1 - (1 - confidence) / looks
+
+        remaining = dict(models)
+        runs = min_runs
+        while True:
+            self.stream_designs(remaining, results, runs - results[next(iter(remaining))].runs, parallell, payloads)
+            intervals = {name: results[name].npv_confidence_interval(design_confidence) for name in remaining}
+            if method == 'racing':
+                eliminated = racing_eliminated(intervals, keep)
+            else:
+                eliminated = halving_eliminated({name: interval.mean for name, interval in intervals.items()}, keep)
+            for name in eliminated:
+                del remaining[name]
+
+            if len(remaining) <= keep or runs >= max_runs:
+                break
+            runs = min(runs + batch_size if method == 'racing' else runs * 2, max_runs)
+
+        for name, design_results in results.items():
+            design_results.confidence_interval = design_results.npv_confidence_interval(design_confidence)
+            design_results.eliminated = name not in remaining
+
+        ranked = sorted(results, key=lambda name: (results[name].eliminated, -results[name].confidence_interval.mean))
+        return {name: results[name] for name in ranked}
+
+    def create_design_models(self, base: dict, designs: Union[Dict[str, dict], List[dict]]) -> dict:
+        """
+        Creates the model of each design from the base parameters of a simulation, as {name: (processes, model)}.
+        The models are created, and the designs validated, once before any run.
+        """
+        models = dict()
+        for name, overrides in named_designs(designs).items():
+            p = apply_design(base, overrides)
+            model_options = {k: v for k, v in p.items() if k in MODEL_OPTIONS}
+            models[name] = (p['processes'], self.create_model(
+                p['flow_time'], p['flow_rate'], p['flow_start_process'], p['until'], p['discount_rate'],
+                p['processes'], p['non_tech_processes'], p['non_tech_costs'], p['dsm'], p['time_format'],
+                **model_options))
+        return models
+
+    def design_chunks(self, models: dict, first_runs: dict, runs: int, max_chunk_size: Optional[int] = None,
+                      payloads: Optional[dict] = None):
+        """
+        Divides @runs runs of each design, continuing from its first run, into the tasks of the worker pool.
+        Yields (design, (index of the first run, runs), (key, pickled model)). The chunks are sized after the
+        runs of all designs, and the chunks of a design follow each other, so a worker only unpickles a model
+        again when it moves on to the next design.
+        """
+        chunks = self.get_chunks(runs, max_chunk_size, total_runs=runs * len(models))
+        starts = [int(start) for start in np.cumsum([0] + chunks[:-1])]
+        for name, (_, model) in models.items():
+            task = payloads[name] if payloads is not None else (uuid.uuid4().hex, pickle.dumps(model))
+            for start, chunk in zip(starts, chunks):
+                yield name, (first_runs[name] + start, chunk), task
+
+    def stream_designs(self, models: dict, results: dict, runs: int, parallell: bool,
+                       payloads: Optional[dict] = None) -> dict:
+        """
+        Runs each of the models @runs more times and adds the runs to its streaming results. In parallel the
+        runs of all designs are scheduled together on the worker pool. The payloads are the {design: (key,
+        pickled model)} sent to the workers, given when the same models are streamed several times.
         """
+        if not parallell:
+            for name, (_, model) in models.items():
+                self.stream_model(model, runs, results[name], parallell=False)
+            return results
 
-        sim = Simulation(flow_time, flow_rate, flow_start_process, until, discount_rate,
-                         processes, non_tech_processes, non_tech_costs, dsm, time_format)
-        sim.run_simulation()
+        first_runs = {name: results[name].runs for name in models}
+        tasks = [(name, (key, payload, start, chunk)) for name, (start, chunk), (key, payload)
+                 in self.design_chunks(models, first_runs, runs, STREAMING_CHUNK_SIZE, payloads)]
+        for name, _, series in self.get_pool().imap_unordered(run_worker_sweep_chunk, tasks):
+            results[name].add_runs(*series)
 
-        return sim.time_steps, sim.cum_NPV, sim.total_costs, sim.total_revenue
+        return results
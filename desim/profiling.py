@@ -0,0 +1,108 @@
+from collections import Counter
+import time
+from typing import Optional
+
+import simpy
+
+from desim.environment import SteppedEnvironment
+
+
+class SimulationStats(object):
+    """
+    Counters and wall-clock timings of one or more runs of a simulation, collected when the
+    simulation is profiled.
+
+    counters holds the events scheduled in simpy, the entities created, the peak of the entities
+    alive at once, the routing draws, the observations and the updates of the running totals.
+    process_runs counts the invocations of each process, by name. timings holds the seconds spent
+    in each phase of the runs: 'observe' is observing the costs, which includes 'non_tech', adding
+    the continuous non-technical costs, and 'accrual', accruing the coalesced processes. 'routing'
+    is choosing the following processes of the entities. 'total' is the whole runs and 'simpy' the
+    time outside of observe and routing, which is mostly the event dispatch and the process bodies.
+    """
+
+    def __init__(self) -> None:
+        self.runs = 0
+        self.counters = Counter()
+        self.process_runs = Counter()
+        self.timings = Counter()
+
+    def merge(self, other: 'SimulationStats') -> 'SimulationStats':
+        """
+        Adds the stats of other runs to these. The peaks are the largest peak of the runs.
+        """
+        if other is None:
+            return self
+        peak = max(self.counters['peak_entities_alive'], other.counters['peak_entities_alive'])
+        self.runs += other.runs
+        self.counters.update(other.counters)
+        self.counters['peak_entities_alive'] = peak
+        self.process_runs.update(other.process_runs)
+        self.timings.update(other.timings)
+        return self
+
+    @classmethod
+    def combine(cls, stats) -> 'SimulationStats':
+        """
+        Returns the merged stats of several chunks of runs, or None if none of them were profiled.
+        """
+        combined = None
+        for s in stats:
+            if s is not None:
+                combined = (combined or cls()).merge(s)
+        return combined
+
+    def finish_run(self, sim, seconds: float):
+        """
+        Adds the counters of a finished simulation and the time that it took.
+        """
+        self.runs += 1
+        self.counters['entities_created'] += sim.entities_created
+        self.counters['observations'] += sim.observations
+        self.counters['entity_updates'] += sim.entity_updates
+        self.timings['total'] += seconds
+        self.timings['simpy'] = self.timings['total'] - self.timings['observe'] - self.timings['routing']
+
+    def rates(self) -> dict:
+        """
+        The runs and events per second of wall-clock time.
+        """
+        seconds = self.timings['total']
+        if seconds <= 0:
+            return {'runs_per_second': 0.0, 'events_per_second': 0.0}
+        return {'runs_per_second': self.runs / seconds,
+                'events_per_second': self.counters['events_scheduled'] / seconds}
+
+    def to_dict(self) -> dict:
+        return {'runs': self.runs, 'counters': dict(self.counters), 'process_runs': dict(self.process_runs),
+                'timings': dict(self.timings), **self.rates()}
+
+
+class ProfiledEnvironment(SteppedEnvironment):
+    """
+    A stepped simpy environment that counts the events that it schedules.
+    """
+
+    def __init__(self, stats: SimulationStats, timestep: Optional[float] = None, initial_time=0) -> None:
+        super().__init__(timestep, initial_time)
+        self.stats = stats
+
+    def schedule(self, event, priority=simpy.core.NORMAL, delay=0):
+        self.stats.counters['events_scheduled'] += 1
+        super().schedule(event, priority, delay)
+
+
+def timed(function, stats: SimulationStats, phase: str):
+    """
+    Wraps a function so that the time spent in it is added to a phase of the stats. Used to
+    instrument the methods of a profiled simulation, so that simulations that are not profiled
+    run the methods without any overhead.
+    """
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            stats.timings[phase] += time.perf_counter() - start
+
+    return wrapper
@@ -0,0 +1,92 @@
+import math
+import random as r
+from typing import Optional
+import zlib
+
+import numpy as np
+
+
+class RandomStream(object):
+    """
+    The source of the random numbers of one part of a simulation. random draws a uniform number
+    in [0, 1) and multinomial divides a number of entities over probabilities. ordered is set when
+    the choices must be drawn in the order of their cumulative weights, so that a larger number
+    always gives a later choice, as the paired runs of antithetic streams need.
+    """
+    __slots__ = ('random', 'multinomial', 'ordered')
+
+    def __init__(self, random=r.random, multinomial=np.random.multinomial, ordered: bool = False) -> None:
+        self.random = random
+        self.multinomial = multinomial
+        self.ordered = ordered
+
+    @classmethod
+    def from_seed_sequence(cls, seed_sequence: np.random.SeedSequence, antithetic: bool = False,
+                           ordered: bool = False):
+        """
+        Creates a stream from a seed sequence. An antithetic stream draws 1 - u for every
+        uniform u of the stream with the same seed sequence.
+        """
+        generator = np.random.default_rng(seed_sequence)
+        random = generator.random
+        if antithetic:
+            def random():
+                u = generator.random()
+                return 1.0 - u if u > 0 else 0.0  # Keeps the number in [0, 1)
+
+        return cls(random, generator.multinomial, ordered)
+
+    def exponential(self, scale: float) -> float:
+        """
+        Draws from the exponential distribution by inverting its cdf, so antithetic streams
+        give antithetic draws.
+        """
+        return -scale * math.log1p(-self.random())
+
+
+# The stream used when a simulation is not seeded, the global random state as before
+GLOBAL_STREAM = RandomStream()
+
+
+class RandomStreams(object):
+    """
+    The random numbers of one run of a simulation.
+
+    Each run has its own independent streams, derived from the seed and the run index as
+    numpy.random.SeedSequence(seed).spawn would, so a run gives the same results regardless of
+    which process runs it or in what order. Without a seed the global random state is used.
+
+    common_random_numbers gives every row of the DSM and the arrivals a stream of its own, keyed
+    by the name of the process, so designs compared with the same seed draw the same numbers for
+    the parts that they have in common.
+    antithetic pairs the runs, the odd runs draw 1 - u for every uniform u of the preceding run. Both
+    runs of a pair choose the processes in the order of their cumulative weights, so that the opposite
+    numbers give opposite choices.
+    """
+
+    def __init__(self, seed: Optional[int] = None, run: int = 0, common_random_numbers: bool = False,
+                 antithetic: bool = False) -> None:
+        self.seed = seed
+        self.common_random_numbers = common_random_numbers
+        self.antithetic = antithetic and run % 2 == 1
+        self.ordered = antithetic
+        self.spawn_key = (run // 2 if antithetic else run,)
+        self.streams = dict()
+        self.default = GLOBAL_STREAM if seed is None else self.create_stream(self.spawn_key)
+
+    def create_stream(self, spawn_key) -> RandomStream:
+        return RandomStream.from_seed_sequence(np.random.SeedSequence(self.seed, spawn_key=spawn_key),
+                                               self.antithetic, self.ordered)
+
+    def get(self, name: str) -> RandomStream:
+        """
+        Returns the stream of the named part of the simulation.
+        """
+        if not self.common_random_numbers or self.seed is None:
+            return self.default
+
+        stream = self.streams.get(name)
+        if stream is None:
+            stream = self.create_stream(self.spawn_key + (zlib.crc32(name.encode()),))
+            self.streams[name] = stream
+        return stream
@@ -0,0 +1,153 @@
+import random as r
+from typing import Dict, List, Optional
+
+import numpy as np
+
+
+class RoutingRow(object):
+    """
+    A compiled row of a DSM. Holds the processes that can follow a process and how they are chosen.
+
+    If the weights of the row sum to at most 1 one process is chosen, with the weights normalized,
+    using an alias table, or in the order of the cumulative weights when the draws must be ordered. If they sum to more than 1 processes are chosen one at a time, without
+    replacement, until the remaining weights sum to at most 1 and one last process is chosen.
+    If any of the chosen columns is outside of the processes (the end of the DSM) nothing is chosen.
+    The row is never modified, so it can be shared between entities and simulations.
+    """
+    __slots__ = ('columns', 'weights', 'total', 'targets', 'multiple', 'probabilities', 'alias', 'cumulative')
+
+    def __init__(self, row: List[float], processes: List) -> None:
+        self.columns = tuple(i for i, w in enumerate(row) if w > 0)
+        self.weights = tuple(float(row[i]) for i in self.columns)
+        self.total = sum(self.weights)
+        # The process of each column, or None if the column is the end. -1 because the first column is the start.
+        self.targets = tuple(processes[c - 1] if c - 1 < len(processes) else None for c in self.columns)
+        self.multiple = self.total > 1
+        self.probabilities, self.alias = self.create_alias_table(self.weights)
+        self.cumulative = np.cumsum(self.weights)
+
+    @staticmethod
+    def create_alias_table(weights):
+        """
+        Creates the tables for Vose's alias method, used to draw a column in O(1).
+        """
+        n = len(weights)
+        if n == 0:
+            return (), ()
+
+        total = sum(weights)
+        scaled = [w * n / total for w in weights]
+        probabilities = [1.0] * n
+        alias = list(range(n))
+        small = [i for i, p in enumerate(scaled) if p < 1]
+        large = [i for i, p in enumerate(scaled) if p >= 1]
+        while small and large:
+            s = small.pop()
+            l = large.pop()
+            probabilities[s] = scaled[s]
+            alias[s] = l
+            scaled[l] -= 1 - scaled[s]
+            (small if scaled[l] < 1 else large).append(l)
+
+        return tuple(probabilities), tuple(alias)
+
+    def draw(self, random=r.random):
+        """
+        Draws the index of a column in the row with the alias method.
+        """
+        u = random() * len(self.columns)
+        i = int(u)
+        return i if u - i < self.probabilities[i] else self.alias[i]
+
+    def draw_ordered(self, random=r.random):
+        """
+        Draws the index of a column in the row from the cumulative weights, so that a larger
+        number gives a later column.
+        """
+        i = int(np.searchsorted(self.cumulative, random() * self.total, side='right'))
+        return min(i, len(self.columns) - 1)  # A number that rounds up to the total is in the last column
+
+    def choose(self, random=r.random, ordered: bool = False):
+        """
+        Chooses the processes that follow this row for one entity. The rows that choose several
+        processes always draw in order.
+        """
+        if len(self.columns) == 0:
+            return []
+
+        if not self.multiple:
+            target = self.targets[self.draw_ordered(random) if ordered else self.draw(random)]
+            return [] if target is None else [target]
+
+        chosen = self.choose_multiple(random)
+        return [] if any([t is None for t in chosen]) else chosen
+
+    def choose_multiple(self, random):
+        remaining = list(range(len(self.columns)))
+        weights = list(self.weights)
+        total = self.total
+        chosen = []
+        while total > 0:
+            x = random() * total
+            for k, w in enumerate(weights):
+                x -= w
+                if x < 0:
+                    break
+            chosen.append(self.targets[remaining[k]])
+            last = total <= 1
+            total -= weights.pop(k)
+            remaining.pop(k)
+            if last:
+                break
+
+        return chosen
+
+    def split(self, weight: int, multinomial=np.random.multinomial):
+        """
+        Divides a cohort of entities over the processes that follow this row, so that each
+        entity chooses as in choose. Returns a list of (weight, processes).
+        """
+        if len(self.columns) == 0:
+            return [(weight, [])]
+
+        cohorts = self.split_columns(weight, list(range(len(self.columns))), multinomial)
+        return [(w, [] if any([t is None for t in chosen]) else chosen) for w, chosen in cohorts]
+
+    def split_columns(self, weight, remaining, multinomial):
+        total = sum([self.weights[k] for k in remaining])
+        if total <= 0:
+            return [(weight, [])]
+
+        if len(remaining) == 1:  # Deterministic, the cohort does not have to be split
+            counts = [weight]
+        else:
+            counts = multinomial(weight, [self.weights[k] / total for k in remaining])
+
+        cohorts = []
+        for k, count in zip(remaining, counts):
+            if count == 0:
+                continue
+            target = self.targets[k]
+            if total > 1:  # Several processes are chosen, the rest are chosen from the remaining columns
+                rest = [c for c in remaining if c != k]
+                cohorts += [(w, [target] + chosen) for w, chosen in self.split_columns(int(count), rest, multinomial)]
+            else:
+                cohorts.append((int(count), [target]))
+
+        return cohorts
+
+
+class RoutingTable(object):
+    """
+    A compiled DSM. Maps the name of a process to the compiled row that decides
+    which processes follow it. Built once per simulation and never modified.
+    """
+
+    def __init__(self, dsm: Dict[str, List[float]], processes: List) -> None:
+        self.rows = {name: RoutingRow(row, processes) for name, row in dsm.items()}
+
+    def __contains__(self, name):
+        return name in self.rows
+
+    def get(self, name: str) -> Optional[RoutingRow]:
+        return self.rows.get(name)
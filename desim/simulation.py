@@ -1,190 +1,626 @@
 from dataclasses import dataclass
-import random as r
+import math
 import numpy as np
-from typing import Optional
+from time import perf_counter
+from typing import NamedTuple, Optional
 
 import simpy
 
 from desim.data import NonTechCost, TimeFormat
+from desim.environment import SteppedEnvironment, drifts
 from desim.helper import isfloat
+from desim.profiling import ProfiledEnvironment, SimulationStats, timed
+from desim.randomness import GLOBAL_STREAM, RandomStreams
+from desim.routing import RoutingTable
 
-TIMESTEP = 0.25
+TIMESTEP = 0.25  # The default time step of the simulations, in years
 
-class Simulation(object):
+
+# Whether a time is a whole year, ignoring rounding errors
+def is_whole_year(time: float) -> bool:
+    return round(time, 9) % 1 == 0
+
+
+class Observation(NamedTuple):
+    """
+    An observation of a running simulation, as yielded by Simulation.stream.
+    """
+    time: float
+    cost: float
+    revenue: float
+    npv: float
+
+
+class SimulationModel(object):
+    # A validated and compiled simulation setup. The processes, the DSM and the time conversions are
+    # prepared once and the model can then be used for any number of independent runs.
+    # The model is never modified by the simulations, so it can be shared between runs and processes.
     # @param:
     # flow_time = the time that entities will flow in the system
-    # interarrival_time = the rate at which entities will flow in the system
-    # interarrival_process = the process at which the entities will start flowing
-    # until = the total simulation time
+    # flow_rate = the rate at which entities will flow in the system
+    # flow_process = the process at which the entities will start flowing
+    # simulation_runtime = the total simulation time
+    # coalesce_events = schedule one event per process and let observe_costs compute the accrued
+    #                   costs of the running processes, instead of one event per time step
+    # keep_entities = keep every entity in self.entities after its lifecycle has ended, instead of
+    #                 only adding it to the retired aggregate
+    # cohorts = let one weighted entity represent all entities that arrive at the same time. The cohort
+    #           is only split when the entities in it choose different processes.
+    # seed = the seed of the random numbers. Each run draws from its own stream, derived from the seed
+    #        and the index of the run, so the results do not depend on how the runs are distributed.
+    #        Without a seed the global random state is used.
+    # common_random_numbers = give each row of the dsm its own stream, so that designs run with the same
+    #                         seed draw the same random numbers for the processes they have in common
+    # antithetic = pair the runs, the second run of each pair draws 1 - u for each random number u of the first
+    # profile = collect the counters and phase timings of each run in a SimulationStats
+    # timestep = the time step in years. The processes accrue their costs and the costs are observed once per
+    #            time step, and processes shorter than a time step add their costs at once.
+    # output_interval = the time in years between the observations kept in the output series, a multiple of
+    #                   the time step. Defaults to the time step. The NPV is still discounted per time step,
+    #                   so the output is the same as keeping every n:th observation of the time step.
     def __init__(self, flow_time: float, flow_rate: float, flow_process: str, simulation_runtime: float,
                  discount_rate: float, processes, non_tech_processes, non_tech_addition, dsm,
-                 time_format: TimeFormat) -> None:
+                 time_format: TimeFormat, coalesce_events: bool = False, keep_entities: bool = False,
+                 cohorts: bool = False, seed: Optional[int] = None, common_random_numbers: bool = False,
+                 antithetic: bool = False, profile: bool = False, timestep: float = TIMESTEP,
+                 output_interval: Optional[float] = None) -> None:
+        if len(processes) == 0:
+            raise ValueError('The simulation needs at least one process')
+        if antithetic and cohorts:
+            raise ValueError('Antithetic runs can not be used with cohorts, the cohorts are split by '
+                             'multinomial draws that have no antithetic counterpart')
+        if timestep <= 0:
+            raise ValueError('The time step must be positive')
+        output_interval = timestep if output_interval is None else output_interval
+        self.output_every = int(round(output_interval / timestep))  # The time steps between the kept observations
+        if self.output_every < 1 or not math.isclose(self.output_every * timestep, output_interval):
+            raise ValueError(f'The output interval {output_interval} is not a multiple of the time step {timestep}')
+        self.timestep = timestep
+        self.output_interval = output_interval
         self.flow_time = flow_time
         self.flow_rate = flow_rate
         self.interarrival_time = 0 if flow_rate <= 0 else 1 / (
                     flow_rate * time_format.value)  # Causes the interarrival time to be in years.
         self.interarrival_process = flow_process
+        self.interarrival_processes = [p for p in processes if p.name == flow_process]
+        if self.interarrival_time > 0 and flow_time > 0 and len(self.interarrival_processes) == 0:
+            raise ValueError(f'The flow start process {flow_process} is not one of the processes')
+        self.total_ent_amount = 0 if self.interarrival_time <= 0 else (1 / self.interarrival_time) * flow_time
         self.until = simulation_runtime / time_format.value  # Causes the runtime to be in years.
+        # The observed times, which the stepped environment puts exactly on step × timestep, and the kept observations
+        self.observation_steps = int(math.ceil(round((self.until + timestep) / timestep, 9)))
+        self.observation_times = [step * timestep for step in range(self.observation_steps)]
+        self.time_steps = self.observation_times[::self.output_every]
+        self.steps = len(self.time_steps)  # The length of the output series
         self.discount_rate = discount_rate
-        self.cum_NPV = [0]
-        self.total_costs = [0]
-        self.total_revenue = [0]
-        self.time_steps = [0]
-        self.entities = []
         self.processes = processes
         self.non_tech_costs = sum([p.cost for p in non_tech_processes])
         self.non_tech_revenues = sum([p.revenue for p in non_tech_processes])
         self.add_non_tech = non_tech_addition
         self.dsm_before_flow, self.dsm_after_flow = self.get_dsm_separation(dsm)
+        self.routing_before_flow = RoutingTable(self.dsm_before_flow, processes)
+        self.routing_after_flow = RoutingTable(self.dsm_after_flow, processes)
         self.time_format = time_format
+        self.coalesce_events = coalesce_events
+        self.keep_entities = keep_entities
+        self.cohorts = cohorts
+        self.seeded = seed is not None  # Whether the runs give the same results every time
+        if seed is None and (common_random_numbers or antithetic):
+            seed = np.random.SeedSequence().entropy  # The runs need a common seed to be paired
+        self.seed = seed
+        self.common_random_numbers = common_random_numbers
+        self.antithetic = antithetic
+        self.profile = profile
+
+    # Separates the given DSM into two dictionaries with the before flow and after flow parts of the dsm
+    def get_dsm_separation(self, dsm):
+        before_dsm = dict()
+        dsm = dsm.copy()
+        for key, row in dsm.items():
+            dsm[key] = [float(x) if isfloat(x) else 0 for x in row]
+        for i in range(len(self.processes)):
+            if self.processes[i].name == self.interarrival_process:
+                break
+            before_dsm.update({self.processes[i-1].name: dsm.pop(self.processes[i-1].name)})
+        return before_dsm, dsm
+
+    # Creates a simulation of the run with the given index
+    def create_simulation(self, run: int = 0):
+        return Simulation.from_model(self, run)
+
+    # The amount of entities created at each tick of the flow, the time between the ticks and the amount of ticks
+    def flow_ticks(self):
+        if self.flow_rate >= 1 / self.timestep:
+            n_entities, timeout = int(self.flow_rate * self.timestep), self.timestep
+        else:
+            n_entities, timeout = int(self.flow_rate), 1
+        ticks = max(0, int(math.ceil(round(self.flow_time / timeout, 9))))
+        return n_entities, timeout, ticks
+
+    # Runs the run with the given index of the model and returns the finished simulation
+    def run_simulation(self, run: int = 0):
+        sim = self.create_simulation(run)
+        sim.run_simulation()
+        return sim
+
+    # Runs run @run of the model and yields its observations, see Simulation.stream
+    def stream(self, run: int = 0, keep_series: bool = True):
+        return self.create_simulation(run).stream(keep_series)
+
+    # Runs the model @runs times and returns the time steps, cumulative NPVs, total costs and
+    # total revenues of each run
+    def run_simulations(self, runs: int):
+        time_steps = []
+        cumulative_NPV = []
+        total_costs = []
+        total_revenue = []
+
+        for run in range(runs):
+            sim = self.run_simulation(run)
+            time_steps.append(sim.time_steps)
+            cumulative_NPV.append(sim.cum_NPV)
+            total_costs.append(sim.total_costs)
+            total_revenue.append(sim.total_revenue)
+
+        return time_steps, cumulative_NPV, total_costs, total_revenue
+
+    # Runs the model for the rows start to start + runs of the given (runs × steps) arrays and
+    # writes the observed series of each run to its row. The time axis is written to time.
+    # The run of row i is run_offset + i. Returns the merged SimulationStats of the runs if the
+    # model is profiled, otherwise None.
+    def run_into(self, time, npvs, costs, revenues, start: int, runs: int, run_offset: int = 0):
+        stats = SimulationStats() if self.profile else None
+        for i in range(start, start + runs):
+            sim = self.run_simulation(run_offset + i)
+            if len(sim.time_steps) != self.steps:
+                raise RuntimeError(f'Expected {self.steps} time steps but the simulation had {len(sim.time_steps)}')
+            npvs[i] = sim.cum_NPV
+            costs[i] = sim.total_costs
+            revenues[i] = sim.total_revenue
+            time[:] = sim.time_steps
+            if stats is not None:
+                stats.merge(sim.stats)
+        return stats
+
+    # Allocates the arrays for the series of @runs runs, as (time, npvs, costs, revenues)
+    def allocate_series(self, runs: int):
+        return (np.zeros(self.steps), np.zeros((runs, self.steps)), np.zeros((runs, self.steps)),
+                np.zeros((runs, self.steps)))
+
+
+class Simulation(object):
+    # @param:
+    # flow_time = the time that entities will flow in the system
+    # interarrival_time = the rate at which entities will flow in the system
+    # interarrival_process = the process at which the entities will start flowing
+    # until = the total simulation time
+    # The remaining parameters are the same as for SimulationModel. Use SimulationModel.create_simulation
+    # to run a model several times without preparing it again.
+    def __init__(self, flow_time: float, flow_rate: float, flow_process: str, simulation_runtime: float,
+                 discount_rate: float, processes, non_tech_processes, non_tech_addition, dsm,
+                 time_format: TimeFormat, coalesce_events: bool = False, keep_entities: bool = False,
+                 cohorts: bool = False, seed: Optional[int] = None, common_random_numbers: bool = False,
+                 antithetic: bool = False, profile: bool = False, timestep: float = TIMESTEP,
+                 output_interval: Optional[float] = None) -> None:
+        self.setup(SimulationModel(flow_time, flow_rate, flow_process, simulation_runtime, discount_rate,
+                                   processes, non_tech_processes, non_tech_addition, dsm, time_format,
+                                   coalesce_events, keep_entities, cohorts, seed, common_random_numbers,
+                                   antithetic, profile, timestep, output_interval))
+
+    # Creates a simulation of the run with the given index from a prepared model
+    @classmethod
+    def from_model(cls, model: SimulationModel, run: int = 0):
+        sim = cls.__new__(cls)
+        sim.setup(model, run)
+        return sim
+
+    # Sets up the state of a run of the model
+    def setup(self, model: SimulationModel, run: int = 0):
+        self.model = model
+        self.run = run
+        self.random = RandomStreams(model.seed, run, model.common_random_numbers, model.antithetic)
+        self.flow_time = model.flow_time
+        self.flow_rate = model.flow_rate
+        self.interarrival_time = model.interarrival_time
+        self.interarrival_process = model.interarrival_process
+        self.until = model.until
+        self.discount_rate = model.discount_rate
+        self.processes = model.processes
+        self.non_tech_costs = model.non_tech_costs
+        self.non_tech_revenues = model.non_tech_revenues
+        self.add_non_tech = model.add_non_tech
+        self.dsm_before_flow, self.dsm_after_flow = model.dsm_before_flow, model.dsm_after_flow
+        self.routing_before_flow, self.routing_after_flow = model.routing_before_flow, model.routing_after_flow
+        self.time_format = model.time_format
+        self.coalesce_events = model.coalesce_events
+        self.keep_entities = model.keep_entities
+        self.cohorts = model.cohorts
+        self.timestep = model.timestep
+        self.output_every = model.output_every
+        self.observation_steps = model.observation_steps
+        self.cum_NPV = [0]
+        self.total_costs = [0]
+        self.total_revenue = [0]
+        self.time_steps = [0]
+        self.entities = []  # Only used if keep_entities is set
+        self.entities_created = 0
+        self.entities_alive = 0
+        self.retired = RetiredEntities(self)
+        self.observations = 0  # The amount of timesteps observed by observe_costs
+        # The totals at the previous observation and the NPV up to it
+        self.observed_cost = 0
+        self.observed_revenue = 0
+        self.npv = 0
+        # Running totals of the costs and revenues of all entities, updated by the entities as deltas
+        self.cost_total = 0
+        self.revenue_total = 0
+        self.entity_updates = 0  # The amount of deltas applied to the running totals
+        # Changes in the accrual rates of coalesced processes, keyed by the observation where they apply
+        self.accrual_changes = dict()
+        self.accrual_rate = [0, 0, 0]  # Running processes, cost per step, revenue per step
+        # The continuously allocated non-technical costs per entity, summed over all timesteps.
+        # An entity's share is the difference between this value now and when it was created.
+        self.non_tech_share = 0
+        self.stats = None
+        if model.profile:
+            # Only the profiled simulations have their phases timed, the others run the methods directly
+            self.stats = SimulationStats()
+            self.add_static_costs_to_entities = timed(self.add_static_costs_to_entities, self.stats, 'non_tech')
+            self.accrue_running_processes = timed(self.accrue_running_processes, self.stats, 'accrual')
 
     # Sets up the simpy environment and runs the simulation
     def run_simulation(self):
-        env = simpy.Environment()
+        start = perf_counter()
+        env = self.create_environment()
+        env.run(until=self.until + self.timestep)
+        if self.stats is not None:
+            self.stats.finish_run(self, perf_counter() - start)
+
+    # Runs the simulation and yields an Observation of the time, total costs, total revenue and
+    # cumulative NPV each time an observation is kept in the output series. An observation is
+    # yielded when all events at its time have run, so it has the same values as the series of
+    # run_simulation. Stopping the iteration stops the simulation, for example when the NPV
+    # turns positive. If keep_series is False the series of the simulation only keep the latest
+    # observation, so that long simulations can be streamed without holding their whole series.
+    def stream(self, keep_series: bool = True):
+        start = perf_counter()
+        env = self.create_environment()
+        until = self.until + self.timestep
+        yielded = 0  # The observations in the series that have been yielded
+        while True:
+            finished = env.peek() >= until
+            if not finished:
+                env.step()
+            while yielded < len(self.time_steps) and (finished or self.time_steps[yielded] < env.peek()):
+                yield Observation(self.time_steps[yielded], self.total_costs[yielded], self.total_revenue[yielded],
+                                  self.cum_NPV[yielded])
+                yielded += 1
+            if finished:
+                break
+            if not keep_series and yielded == len(self.time_steps) > 1:
+                # observe_costs only reads the latest observation
+                for series in (self.time_steps, self.total_costs, self.total_revenue, self.cum_NPV):
+                    del series[:-1]
+                yielded = 1
+
+        if self.stats is not None:
+            self.stats.finish_run(self, perf_counter() - start)
+
+    # Creates the environment of a run with the lifecycle and the observations started
+    def create_environment(self):
+        timestep = self.timestep if drifts(self.timestep) else None
+        if self.stats is not None:
+            env = ProfiledEnvironment(self.stats, timestep)
+        elif timestep is not None:
+            env = SteppedEnvironment(timestep)
+        else:
+            env = simpy.Environment()
         env.process(self.lifecycle(env))
         env.process(self.observe_costs(env))
-        env.run(until=self.until + TIMESTEP)
+        return env
 
     # Initializes the lifecycle in each of the entities. Runs everything before the interarrival
     # process as a single entity.
     def lifecycle(self, env):
-        interarrival_process = list(filter(lambda p: p.name == self.interarrival_process, self.processes))
-        total_ent_amount = 0 if self.interarrival_time <= 0 else (1 / self.interarrival_time) * self.flow_time
+        interarrival_process = self.model.interarrival_processes
+        total_ent_amount = self.model.total_ent_amount
 
         if self.interarrival_process != self.processes[0].name:
-            e = Entity(env, self.processes, self.non_tech_costs)
-            self.entities.append(e)
-            yield env.process(e.lifecycle(self.dsm_before_flow, [self.processes[0]], 1))
+            e = self.create_entity(env)
+            yield env.process(e.lifecycle(self.routing_before_flow, [self.processes[0]], 1))
+
+        n_entities, timeout, ticks = self.model.flow_ticks()
+        mod_entities = self.flow_rate % (1/timeout)
+        for _ in range(ticks):  # The ticks are counted, since the sums of the timeouts have rounding errors
+            if self.cohorts:
+                amount = n_entities
+                if is_whole_year(env.now) and mod_entities != 0:
+                    amount *= 1 + int(mod_entities)
+                if amount > 0:
+                    e = self.create_entity(env, int(amount))
+                    env.process(e.lifecycle(self.routing_after_flow, interarrival_process, total_ent_amount))
+                yield env.timeout(timeout)
+                continue
 
-        end_flow = env.now + self.flow_time
-        while env.now < end_flow:
-            if self.flow_rate >= 1/TIMESTEP:
-                n_entities = int(self.flow_rate * TIMESTEP)
-                timeout = TIMESTEP
-            else:
-                n_entities = int(self.flow_rate)
-                timeout = 1
             for _ in range(int(n_entities)):
-                mod_entities = self.flow_rate % (1/timeout)
-                if env.now % 1 == 0 and mod_entities != 0:
+                if is_whole_year(env.now) and mod_entities != 0:
                     for _ in range(int(mod_entities)): # Run the entities that are left over from converting n_entities to an integer
-                        e = Entity(env, self.processes, self.non_tech_costs)
-                        self.entities.append(e)
-                        env.process(e.lifecycle(self.dsm_after_flow, interarrival_process, total_ent_amount))
-                e = Entity(env, self.processes, self.non_tech_costs)
-                self.entities.append(e)
-                env.process(e.lifecycle(self.dsm_after_flow, interarrival_process, total_ent_amount))
+                        e = self.create_entity(env)
+                        env.process(e.lifecycle(self.routing_after_flow, interarrival_process, total_ent_amount))
+                e = self.create_entity(env)
+                env.process(e.lifecycle(self.routing_after_flow, interarrival_process, total_ent_amount))
             yield env.timeout(timeout)
 
-
-    # Observes the total time, cost, revenue, and NPV for each entity in each timestep.
+    # Creates a new entity in the simulation. The weight is the amount of entities it represents.
+    def create_entity(self, env, weight=1):
+        e = Entity(env, self.processes, self.non_tech_costs, self, weight)
+        if self.keep_entities:
+            self.entities.append(e)
+        self.entities_created += weight
+        self.entities_alive += weight
+        if self.stats is not None and self.entities_alive > self.stats.counters['peak_entities_alive']:
+            self.stats.counters['peak_entities_alive'] = self.entities_alive
+        return e
+
+    # Adds an entity whose lifecycle has ended to the retired aggregate
+    def retire_entity(self, entity):
+        self.retired.add(entity)
+        self.entities_alive -= entity.weight
+
+    # Observes the total time, cost, revenue, and NPV for each entity in each timestep. Every
+    # output_every:th observation is kept in the output series.
     def observe_costs(self, env):
 
         if self.add_non_tech == NonTechCost.LUMP_SUM:
             self.total_costs[0] += self.non_tech_costs
-
-        while True:
-            yield env.timeout(TIMESTEP)
+        self.observed_cost = self.total_costs[0]
+
+        stats = self.stats
+        # Stops at the last time step, which rounding errors could otherwise be observed after
+        while self.observations < self.observation_steps - 1:
+            yield env.timeout(self.timestep)
+            if stats is not None:
+                start = perf_counter()
+            self.observations += 1
             if self.add_non_tech == NonTechCost.CONTINOUSLY:
                 self.add_static_costs_to_entities()
 
-            self.total_costs.append(sum([e.cost for e in self.entities]))
-            self.total_revenue.append(sum([e.revenue for e in self.entities]))
-            self.time_steps.append(env.now)
+            if self.coalesce_events:
+                self.accrue_running_processes()
+
+            self.calculate_NPV(env.now)
+            if self.observations % self.output_every == 0:
+                self.total_costs.append(self.cost_total)
+                self.total_revenue.append(self.revenue_total)
+                self.time_steps.append(env.now)
+                self.cum_NPV.append(self.npv)
+            if stats is not None:
+                stats.timings['observe'] += perf_counter() - start
+
+
+    # Schedules the accrual of a coalesced process that has been started after the current
+    # observation. Its k:th step is accrued at observation self.observations + 1 + k.
+    def add_accrual(self, num_steps, cost_per_step, revenue_per_step):
+        start = self.observations + 1
+        for observation, sign in ((start, 1), (start + num_steps, -1)):
+            change = self.accrual_changes.setdefault(observation, [0, 0, 0])
+            change[0] += sign
+            change[1] += sign * cost_per_step
+            change[2] += sign * revenue_per_step
+        self.entity_updates += 1
+
+    # Adds one step of all running coalesced processes to the running totals
+    def accrue_running_processes(self):
+        change = self.accrual_changes.pop(self.observations, None)
+        if change is not None:
+            rate = self.accrual_rate
+            rate[0] += change[0]
+            if rate[0] == 0:  # Avoids accumulating rounding errors when nothing is running
+                rate[1] = rate[2] = 0
+            else:
+                rate[1] += change[1]
+                rate[2] += change[2]
 
-            self.calculate_NPV(self.total_costs, self.total_revenue, self.time_steps)
-            
-            
+        self.cost_total += self.accrual_rate[1]
+        self.revenue_total += self.accrual_rate[2]
 
     # Generates the waiting time as interarrival rate on an exponential distribution
     def generate_interarrival(self):
-        return np.random.exponential(self.interarrival_time)
-
-    def add_static_costs_to_entities(self):  # Adds the costs of the non-technical processes to all active entities.
-        for e in self.entities:
-            e.cost += self.non_tech_costs * TIMESTEP / (
-                        len(self.entities) * (self.until)) # This works in the margin of 0.00000002 euros
-
-    def calculate_NPV(self, total_costs, total_revenue, time_steps):
-        timestep_revenue = total_revenue[len(time_steps) - 1] - total_revenue[len(time_steps) - 2]
-        timestep_cost = total_costs[len(time_steps) - 1] - total_costs[len(time_steps) - 2]
+        return self.random.get('interarrival').exponential(self.interarrival_time)
+
+    # Adds the costs of the non-technical processes for one timestep, divided evenly over all entities.
+    # The share of each entity is derived from non_tech_share when it is asked for.
+    def add_static_costs_to_entities(self):
+        if self.entities_created > 0:
+            cost = self.non_tech_costs * self.timestep / self.until
+            self.cost_total += cost
+            self.non_tech_share += cost / self.entities_created
+
+    # Adds the discounted cashflow of the timestep that ends now to the NPV
+    def calculate_NPV(self, now):
+        timestep_revenue = self.revenue_total - self.observed_revenue
+        timestep_cost = self.cost_total - self.observed_cost
+        self.observed_cost, self.observed_revenue = self.cost_total, self.revenue_total
 
         net_revenue = timestep_revenue - timestep_cost  # Cashflow for the timestep
-        npv = net_revenue / ((1 + self.discount_rate) ** time_steps[-1])
-        self.cum_NPV.append(self.cum_NPV[-1] + npv)
-
-    # Separates the given DSM into two dictionaries with the before flow and after flow parts of the dsm
-    def get_dsm_separation(self, dsm):
-        before_dsm = dict()
-        dsm = dsm.copy()
-        for key, row in dsm.items():
-            dsm[key] = [float(x) if isfloat(x) else 0 for x in row]
-        for i in range(len(self.processes)):
-            if self.processes[i].name == self.interarrival_process:
-                break
-            before_dsm.update({self.processes[i-1].name: dsm.pop(self.processes[i-1].name)})
-        return before_dsm, dsm
+        npv = net_revenue / ((1 + self.discount_rate) ** now)
+        self.npv = self.npv + npv
 
 
 class Entity(object):
+    __slots__ = ('env', 'processes', 'direct_cost', 'direct_revenue', 'total_non_tech_costs', 'simulation',
+                 'non_tech_offset', 'accrual', 'weight')
+
     # @param
     # env = the simpy environment
     # processes = the processes that the entity will go through
-    def __init__(self, env, processes, total_non_tech_costs) -> None:
+    # simulation = the simulation that the entity belongs to
+    # weight = the amount of identical entities that the entity represents.
+    #          The costs and revenues of the entity are given per represented entity.
+    def __init__(self, env, processes, total_non_tech_costs, simulation=None, weight=1) -> None:
         self.env = env
         self.processes = processes
-        self.total_time = []
-        self.total_cost = []
-        self.total_revenue = []
-        self.cost = 0
-        self.revenue = 0
+        self.direct_cost = 0  # The costs added by the processes of the entity
+        self.direct_revenue = 0
         self.total_non_tech_costs = total_non_tech_costs
+        self.simulation = simulation
+        self.non_tech_offset = 0 if simulation is None else simulation.non_tech_share
+        # The process that is currently accruing costs when the events are coalesced, as
+        # (observations at start, number of steps, cost per step, revenue per step)
+        self.accrual = None
+        self.weight = weight
 
     # Runs the lifecycle for this entity.
     # Can choose between processes but cannot run multiple processes in parallell
-    def lifecycle(self, dsm, current_processes, ent_amount):
+    # A weighted entity is split into several entities when its entities choose different processes.
+    def lifecycle(self, routing, current_processes, ent_amount):
         active_activities = current_processes
+        coalesce = self.simulation is not None and self.simulation.coalesce_events
+        stats = None if self.simulation is None else self.simulation.stats
+        timestep = TIMESTEP if self.simulation is None else self.simulation.timestep
         while len(active_activities) > 0:
             for activity in active_activities:
-                yield self.env.process(activity.run_process(self.env, self, ent_amount, self.total_non_tech_costs))
-            active_activities = self.find_active_activities(dsm, active_activities)  # Find subsequent activities
+                yield self.env.process(activity.run_process(self.env, self, ent_amount, self.total_non_tech_costs,
+                                                            coalesce, timestep))
+
+            if stats is not None:
+                start = perf_counter()
+                stats.process_runs.update([activity.name for activity in active_activities])
+                stats.counters['routing_draws'] += len(active_activities)
+
+            if self.weight > 1:
+                cohorts = self.split_active_activities(routing, active_activities)
+                for weight, activities in cohorts[1:]:
+                    self.env.process(self.split(weight).lifecycle(routing, activities, ent_amount))
+                self.weight, active_activities = cohorts[0]
+            else:
+                active_activities = self.find_active_activities(routing, active_activities)  # Find subsequent activities
+
+            if stats is not None:
+                stats.timings['routing'] += perf_counter() - start
+
+        if self.simulation is not None:
+            self.simulation.retire_entity(self)
+
+    # The costs of the entity, including its share of the continuously added non-technical costs
+    # and the steps of its coalesced process that have been accrued
+    @property
+    def cost(self):
+        if self.accrual is None:
+            return self.direct_cost + self.non_tech_cost
+        return self.direct_cost + self.non_tech_cost + self.accrued_steps() * self.accrual[2]
+
+    # The revenues of the entity, including the steps of its coalesced process that have been accrued
+    @property
+    def revenue(self):
+        if self.accrual is None:
+            return self.direct_revenue
+        return self.direct_revenue + self.accrued_steps() * self.accrual[3]
+
+    # The steps of the coalesced process that the simulation has accrued to its running totals.
+    # A process started after observation m has accrued its k:th step at observation m + 1 + k.
+    def accrued_steps(self):
+        start, num_steps, _, _ = self.accrual
+        return min(self.simulation.observations - start, num_steps)
+
+    # The share of the continuously added non-technical costs that belongs to the entity
+    @property
+    def non_tech_cost(self):
+        if self.simulation is None:
+            return 0
+        return self.simulation.non_tech_share - self.non_tech_offset
+
+    # Adds a cost and a revenue to the entity and to the running totals of the simulation
+    def add(self, cost, revenue):
+        self.direct_cost += cost
+        self.direct_revenue += revenue
+        if self.simulation is not None:
+            self.simulation.cost_total += cost * self.weight
+            self.simulation.revenue_total += revenue * self.weight
+            self.simulation.entity_updates += 1
+
+    # Starts the accrual of a coalesced process. The simulation accrues the running totals from the
+    # per-step rates while the process is running.
+    def start_accrual(self, num_steps, cost_per_step, revenue_per_step):
+        self.accrual = (self.simulation.observations, num_steps, cost_per_step, revenue_per_step)
+        self.simulation.add_accrual(num_steps, cost_per_step * self.weight, revenue_per_step * self.weight)
+
+    # Moves the given amount of the represented entities to a new entity with the same state
+    def split(self, weight):
+        e = Entity(self.env, self.processes, self.total_non_tech_costs, self.simulation, weight)
+        e.direct_cost = self.direct_cost
+        e.direct_revenue = self.direct_revenue
+        e.non_tech_offset = self.non_tech_offset
+        self.weight -= weight
+        if self.simulation is not None and self.simulation.keep_entities:
+            self.simulation.entities.append(e)
+        return e
+
+    # Ends the accrual of a coalesced process and adds the full costs of the process to the entity.
+    def end_accrual(self):
+        _, num_steps, cost_per_step, revenue_per_step = self.accrual
+        self.accrual = None
+        self.direct_cost += num_steps * cost_per_step
+        self.direct_revenue += num_steps * revenue_per_step
+
+    # Finds the active processes for the lifecycle based on the routing table of the dsm and the
+    # current state that the lifecycle is in.
+    def find_active_activities(self, routing: RoutingTable, current_processes):
+        active_activities = []
+        for process in current_processes:
+            row = routing.get(process.name)
+            if row is None:
+                break
 
+            stream = self.random_stream(process.name)
+            active_activities += row.choose(stream.random, stream.ordered)  # Empty if the end is chosen
 
-    # Finds the active processes for the lifecycle based on the dsm and the current state
-    # That the lifecycle is in.
-    def find_active_activities(self, dsm: dict, current_processes):
-        active_activities = []
+        return active_activities
+
+    # Finds the active processes for all the entities that the entity represents. The entities are
+    # divided into cohorts by drawing from the multinomial distribution of each row in the dsm.
+    # Returns a list of (weight, active processes) that is never empty.
+    def split_active_activities(self, routing: RoutingTable, current_processes):
+        cohorts = [(self.weight, [])]
         for process in current_processes:
-            if (process.name not in dsm.keys()):
+            row = routing.get(process.name)
+            if row is None:
                 break
 
-            transitions = dsm.get(process.name)
+            multinomial = self.random_stream(process.name).multinomial
+            cohorts = [(w, active_activities + next_processes) for weight, active_activities in cohorts
+                       for w, next_processes in row.split(weight, multinomial)]
 
-            if (all([p == 0 for p in
-                     transitions])):  # Checks if all rows are 0, if that is the case then there is nothing more to be done after this process
-                continue
+        return cohorts
 
-            next_processes = []
-            self.choose_process_from_row(transitions, next_processes)  # Select the process index from its row
-            #if process_index >= len(self.processes):  # Simulation has reached the end
-            #    continue
-            
-            if any([p >= len(self.processes) for p in next_processes]):
-                continue
-            
-            active_activities += [self.processes[p] for p in next_processes]
+    # The random numbers used to choose the processes that follow the named process
+    def random_stream(self, name):
+        if self.simulation is None:
+            return GLOBAL_STREAM
+        return self.simulation.random.get(name)
 
-        return active_activities
 
-    # Selects a process index from a row of transitional probabilities
-    def choose_process_from_row(self, row, next_processes):
-        if sum(row) > 1:
-            process_index = r.choices([i for i, _ in enumerate(row)], row, k=1)[0] - 1
-            next_processes.append(process_index)
-            row[process_index + 1] = 0
-            self.choose_process_from_row(row, next_processes)
-        elif sum(row) > 0:
-            next_processes.append(r.choices([i for i, _ in enumerate(row)], row, k=1)[0] - 1)  # -1 because the first column is the start
+class RetiredEntities(object):
+    # The aggregated costs and revenues of the entities whose lifecycle has ended.
+    # @param
+    # simulation = the simulation that the entities belonged to
+    def __init__(self, simulation) -> None:
+        self.simulation = simulation
+        self.count = 0
+        self.direct_cost = 0
+        self.revenue = 0
+        self.non_tech_offset = 0  # The sum of the non_tech_offset of the retired entities
+
+    def add(self, entity):
+        self.count += entity.weight
+        self.direct_cost += entity.direct_cost * entity.weight
+        self.revenue += entity.direct_revenue * entity.weight
+        self.non_tech_offset += entity.non_tech_offset * entity.weight
+
+    # The costs of the retired entities, including their share of the continuously added non-technical costs
+    @property
+    def cost(self):
+        return self.direct_cost + self.count * self.simulation.non_tech_share - self.non_tech_offset
 
 
 @dataclass
@@ -211,31 +647,40 @@ class Process(object):
     def convert_time_format_to_default(self, time, time_format: Optional[TimeFormat] = None):
         return (time / time_format.value) if time_format is not None else 0
 
-    # Runs a process and adds the cost and the revenue to the entity
-    def run_process(self, env, entity, ent_amount, non_tech_costs):
+    # Runs a process and adds the cost and the revenue to the entity.
+    # If coalesce is set the process waits for its whole duration with a single event and
+    # the entity's accrual is used to observe the costs of the process while it is running.
+    def run_process(self, env, entity, ent_amount, non_tech_costs, coalesce=False, timestep=TIMESTEP):
         # Calculate the number of timesteps based on the total time and the timestep
-        if self.time >= TIMESTEP:
-            num_steps = int(self.time * self.W / TIMESTEP)
+        if self.time >= timestep:
+            num_steps = int(self.time * self.W / timestep)
 
             # Calculate the cost and revenue to be added at each timestep
             cost_per_step = self.cost / num_steps
             revenue_per_step = self.revenue / num_steps
-            
+
+            if coalesce:
+                if self.add_non_tech == NonTechCost.TO_TECHNICAL_PROCESS:
+                    cost_per_step += (non_tech_costs * self.time / (sum([p.time for p in entity.processes]) * ent_amount)) / num_steps
+
+                entity.start_accrual(num_steps, cost_per_step, revenue_per_step)
+                yield env.timeout(num_steps * timestep)  # Wait for the whole process
+                entity.end_accrual()
+                return
+
             for _ in range(num_steps):
-                entity.cost += cost_per_step
-                entity.revenue += revenue_per_step
+                entity.add(cost_per_step, revenue_per_step)
 
                 if self.add_non_tech == NonTechCost.TO_TECHNICAL_PROCESS:
                     added_cost = (non_tech_costs * self.time / (sum([p.time for p in entity.processes]) * ent_amount)) / num_steps
-                    entity.cost += added_cost
-                yield env.timeout(TIMESTEP)  # Wait for the timestep duration
-        else: # Add full value if under TIMESTEP. If the time is 0, then the process is instantaneous
-            entity.cost += self.cost
-            entity.revenue += self.revenue
+                    entity.add(added_cost, 0)
+                yield env.timeout(timestep)  # Wait for the timestep duration
+        else: # Add full value if under the timestep. If the time is 0, then the process is instantaneous
+            entity.add(self.cost, self.revenue)
 
             if self.add_non_tech == NonTechCost.TO_TECHNICAL_PROCESS:
                 added_cost = non_tech_costs * self.time / (sum([p.time for p in entity.processes]) * ent_amount)
-                entity.cost += added_cost
+                entity.add(added_cost, 0)
             yield env.timeout(self.time)
 
 @dataclass
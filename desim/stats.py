@@ -0,0 +1,109 @@
+from typing import Sequence
+
+import numpy as np
+
+
+class P2Quantile(object):
+    """
+    Estimates a quantile of every position of a series, one series at a time, with the P² algorithm
+    (Jain & Chlamtac, 1985). Uses five markers per position, so the memory does not depend on the
+    amount of series that have been added.
+    """
+
+    def __init__(self, p: float, length: int) -> None:
+        self.p = p
+        self.count = 0
+        self.heights = np.zeros((5, length))  # The marker heights
+        self.positions = np.tile(np.arange(5, dtype=float)[:, None], (1, length))  # The marker positions
+        self.desired = np.array([0, 2 * p, 4 * p, 2 + 2 * p, 4])  # The desired marker positions
+        self.increments = np.array([0, p / 2, p, (1 + p) / 2, 1])
+
+    def add(self, values: np.ndarray):
+        if self.count < 5:  # The first five values are the initial marker heights
+            self.heights[self.count] = values
+            self.count += 1
+            if self.count == 5:
+                self.heights.sort(axis=0)
+            return
+
+        self.count += 1
+        q, n = self.heights, self.positions
+        q[0] = np.minimum(q[0], values)
+        q[4] = np.maximum(q[4], values)
+        k = (values[None, :] >= q[1:4]).sum(axis=0)  # The cell of the value, 0 to 3
+        n += np.arange(5)[:, None] > k[None, :]
+        self.desired += self.increments
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            for i in range(1, 4):
+                d = self.desired[i] - n[i]
+                adjust = ((d >= 1) & (n[i + 1] - n[i] > 1)) | ((d <= -1) & (n[i - 1] - n[i] < -1))
+                if not adjust.any():
+                    continue
+
+                d = np.sign(d)
+                parabolic = q[i] + d / (n[i + 1] - n[i - 1]) * (
+                        (n[i] - n[i - 1] + d) * (q[i + 1] - q[i]) / (n[i + 1] - n[i]) +
+                        (n[i + 1] - n[i] - d) * (q[i] - q[i - 1]) / (n[i] - n[i - 1]))
+                neighbour_q = np.where(d > 0, q[i + 1], q[i - 1])
+                neighbour_n = np.where(d > 0, n[i + 1], n[i - 1])
+                linear = q[i] + d * (neighbour_q - q[i]) / (neighbour_n - n[i])
+                height = np.where((q[i - 1] < parabolic) & (parabolic < q[i + 1]), parabolic, linear)
+
+                q[i] = np.where(adjust, height, q[i])
+                n[i] = np.where(adjust, n[i] + d, n[i])
+
+    def value(self) -> np.ndarray:
+        if self.count >= 5:
+            return self.heights[2].copy()
+        if self.count == 0:
+            return np.full(self.heights.shape[1], np.nan)
+        # Too few values for the markers, use the exact quantile
+        return np.quantile(self.heights[:self.count], self.p, axis=0)
+
+
+class SeriesStatistics(object):
+    """
+    Online statistics of every position of a series, updated one series at a time.
+    Keeps the mean and variance (Welford's algorithm), the minimum and maximum and
+    P² estimates of the given quantiles. The memory is constant in the amount of series.
+    """
+
+    def __init__(self, length: int, quantiles: Sequence[float] = (0.05, 0.25, 0.5, 0.75, 0.95)) -> None:
+        self.count = 0
+        self.mean = np.zeros(length)
+        self.m2 = np.zeros(length)
+        self.min = np.full(length, np.inf)
+        self.max = np.full(length, -np.inf)
+        self.quantiles = {q: P2Quantile(q, length) for q in quantiles}
+
+    def add(self, values):
+        values = np.asarray(values, dtype=float)
+        self.count += 1
+        delta = values - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (values - self.mean)
+        np.minimum(self.min, values, out=self.min)
+        np.maximum(self.max, values, out=self.max)
+        for estimator in self.quantiles.values():
+            estimator.add(values)
+
+    def variance(self) -> np.ndarray:
+        """
+        The sample variance of each position. NaN until two series have been added.
+        """
+        if self.count < 2:
+            return np.full(len(self.mean), np.nan)
+        return self.m2 / (self.count - 1)
+
+    def std(self) -> np.ndarray:
+        return np.sqrt(self.variance())
+
+    def quantile(self, q: float) -> np.ndarray:
+        """
+        The estimated quantile of each position. Only the quantiles given when the
+        statistics were created are available.
+        """
+        if q not in self.quantiles:
+            raise KeyError(f'The quantile {q} is not tracked, the tracked quantiles are {list(self.quantiles)}')
+        return self.quantiles[q].value()
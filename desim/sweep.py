@@ -0,0 +1,129 @@
+import copy
+import inspect
+import itertools
+import math
+from typing import Dict, List, Union
+
+from desim.data import ConfidenceInterval
+from desim.simulation import SimulationModel
+
+# The options of SimulationModel that a design can also override
+MODEL_OPTIONS = [name for name, parameter in inspect.signature(SimulationModel).parameters.items()
+                 if parameter.default is not inspect.Parameter.empty]
+
+
+def design_grid(values: dict) -> List[dict]:
+    """
+    Returns the overrides of every combination of the given values, as a list of dicts.
+    The values are given as {key: [value, ...]} with the keys described in apply_design.
+    """
+    keys = list(values)
+    return [dict(zip(keys, combination)) for combination in itertools.product(*[values[k] for k in keys])]
+
+
+def design_name(overrides: dict) -> str:
+    """
+    The name of the design with the given overrides, such as 'flow_rate=10, Testing.cost=5'.
+    """
+    if len(overrides) == 0:
+        return 'No Design'
+    return ', '.join([f'{".".join([str(k) for k in key[1:]]) if isinstance(key, tuple) else key}={value}'
+                      for key, value in overrides.items()])
+
+
+def named_designs(designs: Union[Dict[str, dict], List[dict]]) -> Dict[str, dict]:
+    """
+    Returns the designs as {name: overrides}. Designs given as a list are named by design_name.
+    """
+    if isinstance(designs, dict):
+        return designs
+
+    named = dict()
+    for overrides in designs:
+        name = design_name(overrides)
+        if name in named:
+            raise ValueError(f'The design {name} is given more than once')
+        named[name] = overrides
+    return named
+
+
+def apply_design(parameters: dict, overrides: dict) -> dict:
+    """
+    Returns a copy of the parameters of a simulation with the overrides of a design applied.
+    The parameters are the keyword arguments of Des.run_monte_carlo_simulation. The base
+    parameters, processes and DSM are never modified.
+
+    The keys of the overrides can be:
+      The name of a parameter, such as 'flow_rate', 'flow_time' or 'discount_rate'.
+      ('process', process name, attribute) to set an attribute of a process, such as 'cost', 'revenue'
+        or 'time'. The time is in years, as Process.time.
+      ('dsm', row process name, column process name) to set an entry of the DSM. The column 'End'
+        is the end of the lifecycle.
+    """
+    parameters = dict(parameters)
+    processes = list(parameters['processes'])
+    dsm = dict(parameters['dsm'])
+    for key, value in overrides.items():
+        if not isinstance(key, tuple):
+            if key not in parameters and key not in MODEL_OPTIONS:
+                raise ValueError(f'Unknown parameter {key}')
+            parameters[key] = value
+            continue
+
+        kind, name, target = key
+        if kind == 'process':
+            index = process_index(processes, name)
+            process = copy.copy(processes[index])
+            if not hasattr(process, target):
+                raise ValueError(f'The process {name} has no attribute {target}')
+            setattr(process, target, value)
+            processes[index] = process
+        elif kind == 'dsm':
+            if name not in dsm:
+                raise ValueError(f'The DSM has no row {name}')
+            # The first column is the start and the column after the processes is the end
+            column = len(processes) + 1 if target == 'End' else process_index(processes, target) + 1
+            row = list(dsm[name]) + [0] * max(0, column + 1 - len(dsm[name]))
+            row[column] = value
+            dsm[name] = row
+        else:
+            raise ValueError(f'Unknown override {key}, expected a parameter, process or dsm override')
+
+    parameters['processes'] = processes
+    parameters['dsm'] = dsm
+    return parameters
+
+
+def process_index(processes: List, name: str) -> int:
+    for i, p in enumerate(processes):
+        if p.name == name:
+            return i
+    raise ValueError(f'There is no process named {name}')
+
+
+def racing_eliminated(intervals: Dict[str, ConfidenceInterval], keep: int) -> List[str]:
+    """
+    The designs that are clearly worse than the best designs: the upper bound of their interval is
+    below the lower bound of at least @keep other designs.
+    """
+    lows = sorted([interval.low for interval in intervals.values()], reverse=True)
+    if len(lows) <= keep:
+        return []
+    bound = lows[keep - 1]
+    return [name for name, interval in intervals.items() if interval.high < bound]
+
+
+def racing_rounds(min_runs: int, max_runs: int, batch_size: int) -> int:
+    """
+    The largest amount of rounds of racing, when the designs are run @batch_size more times each round
+    from @min_runs until @max_runs.
+    """
+    return 1 + math.ceil((max_runs - min_runs) / batch_size)
+
+
+def halving_eliminated(means: Dict[str, float], keep: int) -> List[str]:
+    """
+    The worst half of the designs by their mean, keeping at least @keep designs.
+    """
+    ranked = sorted(means, key=lambda name: means[name], reverse=True)
+    return ranked[max(keep, math.ceil(len(ranked) / 2)):]
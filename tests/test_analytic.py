@@ -0,0 +1,117 @@
+import numpy as np
+import pytest
+
+from desim.analytic import AnalyticModel
+from desim.data import TimeFormat, NonTechCost
+
+import desim.simulation as sim
+
+
+def get_processes(add_non_tech=NonTechCost.CONTINOUSLY):
+    processes = [
+        sim.Process(1, 5, 100000, 0, 'Architectural design', add_non_tech, TimeFormat.MONTH),
+        sim.Process(2, 0, 0, 0, 'Verification', add_non_tech),
+        sim.Process(3, 0.8, 30000, 0, 'Testing', add_non_tech, TimeFormat.YEAR),
+        sim.Process(4, 3, 200, 1000, 'Manufacturing', add_non_tech, TimeFormat.HOUR),
+        sim.Process(5, 1, 100, 10000, 'Integration', add_non_tech, TimeFormat.DAY),
+    ]
+    non_tech_processes = [
+        sim.NonTechnicalProcess("Quality Management Process", 10000, 0)
+    ]
+    return processes, non_tech_processes
+
+
+@pytest.mark.parametrize("flow_start_process, flow_rate, non_tech_costs", [
+    ("Architectural design", 13.3, NonTechCost.CONTINOUSLY),
+    ("Testing", 2.5, NonTechCost.LUMP_SUM),
+    ("Manufacturing", 260, NonTechCost.TO_TECHNICAL_PROCESS),
+])
+def test_analytic_sequential(flow_start_process, flow_rate, non_tech_costs):
+    processes, non_tech_processes = get_processes(non_tech_costs)
+    dsm = {
+        "Start":                ["X", 1, 0, 0, 0, 0, 0],
+        "Architectural design": [0, "X", 1, 0, 0, 0, 0],
+        "Verification":         [0, 0, "X", 1, 0, 0, 0],
+        "Testing":              [0, 0, 0, "X", 1, 0, 0],
+        "Manufacturing":        [0, 0, 0, 0, "X", 1, 0],
+        "Integration":          [0, 0, 0, 0, 0, "X", 1],
+        "End":                  [0, 0, 0, 0, 0, 0, "X"]
+    }
+
+    model = sim.SimulationModel(3, flow_rate, flow_start_process, 10, 0.08, processes, non_tech_processes,
+                                non_tech_costs, dsm, TimeFormat.YEAR)
+    time, npv, costs, revenues = AnalyticModel(model).expected_series()
+
+    # Without any choices in the dsm the expected results are the results of every run
+    simulation = model.run_simulation()
+    assert list(time) == simulation.time_steps
+    assert list(costs) == pytest.approx(simulation.total_costs)
+    assert list(revenues) == pytest.approx(simulation.total_revenue)
+    assert list(npv) == pytest.approx(simulation.cum_NPV)
+
+
+@pytest.mark.parametrize("timestep", [0.25, 0.1, 1/12])
+def test_analytic_probabilities(timestep):
+    processes, non_tech_processes = get_processes()
+    dsm = {
+        "Start":                ["X", 1, 0, 0, 0, 0, 0],
+        "Architectural design": [0, "X", 0.3, 0.2, 0.5, 0, 0],
+        "Verification":         [0, 0.5, "X", 0.5, 0, 0, 0],
+        "Testing":              [0, 0, 0.2, "X", 0.4, 0.4, 0],
+        "Manufacturing":        [0, 0, 0, 0, "X", 0.5, 0.5],
+        "Integration":          [0, 0, 0, 0, 0, "X", 1],
+        "End":                  [0, 0, 0, 0, 0, 0, "X"]
+    }
+
+    model = sim.SimulationModel(2, 13.3, "Testing", 8, 0.08, processes, non_tech_processes,
+                                NonTechCost.CONTINOUSLY, dsm, TimeFormat.YEAR, cohorts=True, seed=3,
+                                timestep=timestep)
+    time, npv, costs, revenues = AnalyticModel(model).expected_series()
+
+    _, npvs, all_costs, all_revenues = model.allocate_series(500)
+    model.run_into(time.copy(), npvs, all_costs, all_revenues, 0, 500)
+    for expected, runs in [(npv, npvs), (costs, all_costs), (revenues, all_revenues)]:
+        error = np.abs(expected - runs.mean(axis=0))
+        assert (error <= 5 * runs.std(axis=0) / np.sqrt(len(runs)) + 1e-6 * np.abs(expected)).all()
+
+
+def test_analytic_multiple_processes():
+    processes, non_tech_processes = get_processes()
+    dsm = {
+        "Architectural design": [0, 0, 1, 1, 0, 0, 0],
+    }
+
+    model = sim.SimulationModel(2, 13.3, "Architectural design", 8, 0.08, processes, non_tech_processes,
+                                NonTechCost.CONTINOUSLY, dsm, TimeFormat.YEAR)
+    with pytest.raises(ValueError):
+        AnalyticModel(model).expected_series()
+
+
+@pytest.mark.parametrize("timestep, output_interval", [
+    (0.1, 0.5),
+    (0.5, 1),
+    (1/12, 1),
+])
+def test_analytic_time_resolution(timestep, output_interval):
+    processes, non_tech_processes = get_processes(NonTechCost.CONTINOUSLY)
+    dsm = {
+        "Start":                ["X", 1, 0, 0, 0, 0, 0],
+        "Architectural design": [0, "X", 1, 0, 0, 0, 0],
+        "Verification":         [0, 0, "X", 1, 0, 0, 0],
+        "Testing":              [0, 0, 0, "X", 1, 0, 0],
+        "Manufacturing":        [0, 0, 0, 0, "X", 1, 0],
+        "Integration":          [0, 0, 0, 0, 0, "X", 1],
+        "End":                  [0, 0, 0, 0, 0, 0, "X"]
+    }
+
+    model = sim.SimulationModel(3, 13.3, "Architectural design", 10, 0.08, processes, non_tech_processes,
+                                NonTechCost.CONTINOUSLY, dsm, TimeFormat.YEAR, timestep=timestep,
+                                output_interval=output_interval)
+    time, npv, costs, revenues = AnalyticModel(model).expected_series()
+
+    simulation = model.run_simulation()
+    assert len(time) == model.steps
+    assert list(time) == pytest.approx(simulation.time_steps)
+    assert list(costs) == pytest.approx(simulation.total_costs)
+    assert list(revenues) == pytest.approx(simulation.total_revenue)
+    assert list(npv) == pytest.approx(simulation.cum_NPV)
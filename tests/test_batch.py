@@ -0,0 +1,123 @@
+import numpy as np
+import pytest
+
+from desim.analytic import AnalyticModel
+from desim.batch import BatchModel
+from desim.data import TimeFormat, NonTechCost
+
+import desim.simulation as sim
+
+
+def get_processes(add_non_tech=NonTechCost.CONTINOUSLY):
+    processes = [
+        sim.Process(1, 5, 100000, 0, 'Architectural design', add_non_tech, TimeFormat.MONTH),
+        sim.Process(2, 0, 0, 0, 'Verification', add_non_tech),
+        sim.Process(3, 0.8, 30000, 0, 'Testing', add_non_tech, TimeFormat.YEAR),
+        sim.Process(4, 3, 200, 1000, 'Manufacturing', add_non_tech, TimeFormat.HOUR),
+        sim.Process(5, 1, 100, 10000, 'Integration', add_non_tech, TimeFormat.DAY),
+    ]
+    non_tech_processes = [
+        sim.NonTechnicalProcess("Quality Management Process", 10000, 0)
+    ]
+    return processes, non_tech_processes
+
+
+@pytest.mark.parametrize("flow_start_process, flow_rate, non_tech_costs", [
+    ("Architectural design", 13.3, NonTechCost.CONTINOUSLY),
+    ("Testing", 2.5, NonTechCost.LUMP_SUM),
+    ("Manufacturing", 260, NonTechCost.TO_TECHNICAL_PROCESS),
+])
+def test_batch_sequential(flow_start_process, flow_rate, non_tech_costs):
+    processes, non_tech_processes = get_processes(non_tech_costs)
+    dsm = {
+        "Start":                ["X", 1, 0, 0, 0, 0, 0],
+        "Architectural design": [0, "X", 1, 0, 0, 0, 0],
+        "Verification":         [0, 0, "X", 1, 0, 0, 0],
+        "Testing":              [0, 0, 0, "X", 1, 0, 0],
+        "Manufacturing":        [0, 0, 0, 0, "X", 1, 0],
+        "Integration":          [0, 0, 0, 0, 0, "X", 1],
+        "End":                  [0, 0, 0, 0, 0, 0, "X"]
+    }
+
+    model = sim.SimulationModel(3, flow_rate, flow_start_process, 10, 0.08, processes, non_tech_processes,
+                                non_tech_costs, dsm, TimeFormat.YEAR)
+    batch = BatchModel(model)
+    time, npvs, costs, revenues = batch.allocate_series(3)
+    batch.run_into(time, npvs, costs, revenues, 0, 3)
+
+    simulation = model.run_simulation()
+    assert list(time) == simulation.time_steps
+    for i in range(3):
+        assert list(costs[i]) == pytest.approx(simulation.total_costs)
+        assert list(revenues[i]) == pytest.approx(simulation.total_revenue)
+        assert list(npvs[i]) == pytest.approx(simulation.cum_NPV)
+
+
+@pytest.mark.parametrize("timestep", [0.25, 1/12])
+def test_batch_probabilities(timestep):
+    processes, non_tech_processes = get_processes()
+    dsm = {
+        "Start":                ["X", 1, 0, 0, 0, 0, 0],
+        "Architectural design": [0, "X", 0.3, 0.2, 0.5, 0, 0],
+        "Verification":         [0, 0.5, "X", 0.5, 0, 0, 0],
+        "Testing":              [0, 0, 0.2, "X", 0.4, 0.4, 0],
+        "Manufacturing":        [0, 0, 0, 0, "X", 0.5, 0.5],
+        "Integration":          [0, 0, 0, 0, 0, "X", 1],
+        "End":                  [0, 0, 0, 0, 0, 0, "X"]
+    }
+
+    model = sim.SimulationModel(2, 13.3, "Testing", 8, 0.08, processes, non_tech_processes,
+                                NonTechCost.CONTINOUSLY, dsm, TimeFormat.YEAR, seed=3, timestep=timestep)
+    _, npv, costs, revenues = AnalyticModel(model).expected_series()
+
+    batch = BatchModel(model)
+    time, npvs, all_costs, all_revenues = batch.allocate_series(2000)
+    batch.run_into(time, npvs, all_costs, all_revenues, 0, 2000)
+    for expected, runs in [(npv, npvs), (costs, all_costs), (revenues, all_revenues)]:
+        error = np.abs(expected - runs.mean(axis=0))
+        assert (error <= 5 * runs.std(axis=0) / np.sqrt(len(runs)) + 1e-6 * np.abs(expected)).all()
+
+    # The runs vary and the same seed gives the same runs
+    assert len(set(npvs[:, -1])) > 1
+    _, npvs2, _, _ = batch.allocate_series(2000)
+    batch.run_into(time, npvs2, all_costs, all_revenues, 0, 2000)
+    assert (npvs == npvs2).all()
+
+
+def test_batch_unsupported():
+    processes, non_tech_processes = get_processes()
+    dsm = {
+        "Architectural design": [0, 0, 1, 1, 0, 0, 0],
+    }
+
+    model = sim.SimulationModel(2, 13.3, "Architectural design", 8, 0.08, processes, non_tech_processes,
+                                NonTechCost.CONTINOUSLY, dsm, TimeFormat.YEAR)
+    with pytest.raises(ValueError):
+        BatchModel(model)
+
+
+def test_batch_time_resolution():
+    processes, non_tech_processes = get_processes()
+    dsm = {
+        "Start":                ["X", 1, 0, 0, 0, 0, 0],
+        "Architectural design": [0, "X", 1, 0, 0, 0, 0],
+        "Verification":         [0, 0, "X", 1, 0, 0, 0],
+        "Testing":              [0, 0, 0, "X", 1, 0, 0],
+        "Manufacturing":        [0, 0, 0, 0, "X", 1, 0],
+        "Integration":          [0, 0, 0, 0, 0, "X", 1],
+        "End":                  [0, 0, 0, 0, 0, 0, "X"]
+    }
+
+    model = sim.SimulationModel(3, 13.3, "Architectural design", 10, 0.08, processes, non_tech_processes,
+                                NonTechCost.CONTINOUSLY, dsm, TimeFormat.YEAR, timestep=0.1, output_interval=1)
+    batch = BatchModel(model)
+    assert batch.steps == model.steps == 11
+    time, npvs, costs, revenues = batch.allocate_series(2)
+    batch.run_into(time, npvs, costs, revenues, 0, 2)
+
+    simulation = model.run_simulation()
+    assert list(time) == pytest.approx(simulation.time_steps)
+    for i in range(2):
+        assert list(costs[i]) == pytest.approx(simulation.total_costs)
+        assert list(revenues[i]) == pytest.approx(simulation.total_revenue)
+        assert list(npvs[i]) == pytest.approx(simulation.cum_NPV)
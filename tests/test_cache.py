@@ -0,0 +1,70 @@
+import os
+
+import numpy as np
+
+from desim.cache import ResultsCache, is_deterministic, model_key
+from desim.data import NonTechCost, SimResults, TimeFormat
+from desim.simulation import Process, SimulationModel
+
+
+def get_model(flow_rate=10, seed=1, **options):
+    processes = [
+        Process(1, 1, 100, 0, 'Design', NonTechCost.NO_ADDED_COST, TimeFormat.YEAR),
+        Process(2, 1, 200, 500, 'Testing', NonTechCost.NO_ADDED_COST, TimeFormat.YEAR),
+    ]
+    dsm = {'Design': [0, 0, 1, 0], 'Testing': [0, 0, 0, 1]}
+    return SimulationModel(1, flow_rate, 'Design', 5, 0.08, processes, [], NonTechCost.NO_ADDED_COST, dsm,
+                           TimeFormat.YEAR, seed=seed, **options)
+
+
+def get_results(design='Design', runs=2):
+    return SimResults(design, [], np.arange(4) * 0.25, np.ones((runs, 4)), np.ones((runs, 4)), np.ones((runs, 4)))
+
+
+def test_model_key():
+    key = model_key(get_model(), 'monte_carlo', 10)
+
+    assert key == model_key(get_model(), 'monte_carlo', 10)
+    assert key != model_key(get_model(), 'monte_carlo', 11)
+    assert key != model_key(get_model(), 'parallell', 10)
+    assert key != model_key(get_model(flow_rate=5), 'monte_carlo', 10)
+    assert key != model_key(get_model(seed=2), 'monte_carlo', 10)
+    assert key != model_key(get_model(), 'monte_carlo', 10, chunks=[5, 5])
+    assert is_deterministic(get_model())
+    assert not is_deterministic(get_model(seed=None))
+    # The paired runs draw a seed of their own, which is different every time
+    assert not is_deterministic(get_model(seed=None, common_random_numbers=True))
+    assert not is_deterministic(get_model(seed=None, antithetic=True))
+    assert is_deterministic(get_model(antithetic=True))
+
+
+def test_memory_cache():
+    cache = ResultsCache(max_entries=2)
+    a, b, c = get_results('a'), get_results('b'), get_results('c')
+    cache.put('a', a)
+    cache.put('b', b)
+
+    assert cache.get('a') is a
+    cache.put('c', c)  # b is the least recently used
+    assert cache.get('b') is None
+    assert cache.get('c') is c
+    assert cache.get_or_run('a', lambda: None) is a
+    assert cache.hits == 3 and cache.misses == 1
+
+
+def test_disk_cache(tmp_path):
+    cache = ResultsCache(max_entries=1, directory=str(tmp_path))
+    cache.put('a', get_results('a', runs=1))
+    cache.put('b', get_results('b', runs=1))
+
+    results = cache.get('a')  # Loaded from the disk
+    assert results.design == 'a'
+    assert results.npvs.tolist() == [[1, 1, 1, 1]]
+    assert ResultsCache(directory=str(tmp_path)).get('b').design == 'b'
+
+    size = os.path.getsize(cache.path('a'))
+    cache.max_disk_bytes = 2 * size
+    os.utime(cache.path('b'), (0, 0))  # b is the least recently used
+    cache.put('c', get_results('c', runs=1))
+    assert not os.path.exists(cache.path('b'))
+    assert os.path.exists(cache.path('a')) and os.path.exists(cache.path('c'))
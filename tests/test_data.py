@@ -0,0 +1,116 @@
+import json
+
+import numpy as np
+import pytest
+
+from desim.data import NonTechCost, SimResults, TimeFormat, rate_discount_factors
+from desim.simulation import Process
+
+
+def get_results():
+    timesteps = [[0, 0.25, 0.5, 0.75], [0, 0.25, 0.5, 0.75]]
+    npvs = [[0, -10, 5, 20], [0, -30, -5, 10]]
+    costs = [[0, 10, 10, 10], [0, 30, 30, 40]]
+    revenues = [[0, 0, 15, 30], [0, 0, 25, 50]]
+    return SimResults('Design', [], timesteps, npvs, costs, revenues)
+
+
+def test_sim_results_statistics():
+    results = get_results()
+
+    assert results.runs == 2
+    assert results.npvs.shape == (2, 4)
+    assert list(results.time) == [0, 0.25, 0.5, 0.75]
+    assert list(results.timesteps[-1]) == [0, 0.25, 0.5, 0.75]
+    assert results.mean_npv() == [0, -20, 0, 15]
+    assert results.mean_costs() == [0, 20, 20, 25]
+    assert results.mean_revenues() == [0, 0, 20, 40]
+    assert results.normalize_npv() == pytest.approx([20 / 35, 0, 20 / 35, 1])
+    assert results.mean_npv_payback_time() == 0.75
+    assert results.all_max_npv() == [20, 10]
+
+
+def test_sim_results_empty():
+    results = SimResults('Design', [], [], [], [], [])
+
+    assert results.runs == 0
+    assert results.mean_npv() == []
+    assert results.mean_costs() == []
+    assert results.all_max_npv() == []
+
+
+def test_sim_results_to_dict():
+    results = get_results()
+    results.processes = [Process(1, 6, 100, 50, 'Design', NonTechCost.LUMP_SUM, TimeFormat.MONTH)]
+    data = json.loads(json.dumps(results.to_dict()))
+
+    assert data['design'] == 'Design'
+    assert data['processes'][0]['name'] == 'Design'
+    assert data['timesteps'] == [[0, 0.25, 0.5, 0.75], [0, 0.25, 0.5, 0.75]]
+    assert data['npvs'] == [[0, -10, 5, 20], [0, -30, -5, 10]]
+
+
+def test_sim_results_cache():
+    results = get_results()
+
+    assert results.mean_npv() is not results.mean_npv()  # New lists that can be changed by the caller
+    assert results.mean_npv_array() is results.mean_npv_array()
+    assert not results.mean_npv_array().flags.writeable
+    assert not results.npvs.flags.writeable
+
+
+def test_sim_results_equality():
+    results = get_results()
+    changed = get_results()
+    changed.npvs = changed.npvs + 1
+
+    assert results == get_results()
+    assert hash(results) == hash(get_results())
+    assert len({results, get_results()}) == 1
+    assert results != changed
+    assert results != SimResults('Other', [], results.timesteps, results.npvs, results.costs, results.revenues)
+
+
+def test_sim_results_discounted_npvs():
+    results = get_results()
+
+    assert results.cashflows().tolist() == [[0, -10, 15, 15], [0, -30, 25, 15]]
+    npvs = results.discounted_npvs([0, 0.1])
+    assert npvs.shape == (2, 2, 4)
+    assert npvs[0].tolist() == [[0, -10, 5, 20], [0, -30, -5, 10]]
+    assert npvs[1, 0] == pytest.approx([0, -10 / 1.1 ** 0.25, -10 / 1.1 ** 0.25 + 15 / 1.1 ** 0.5,
+                                        -10 / 1.1 ** 0.25 + 15 / 1.1 ** 0.5 + 15 / 1.1 ** 0.75])
+    assert results.discounted_npvs(0.1).shape == (1, 2, 4)
+    assert results.discounted_mean_npv([0, 0.1]) == pytest.approx(npvs.mean(axis=1))
+
+    # The factors of a rate are calculated once for each time axis
+    assert rate_discount_factors(0.1, results.time.tobytes()) is rate_discount_factors(0.1, results.time.tobytes())
+
+
+def test_sim_results_save_load(tmp_path):
+    results = get_results()
+    results.processes = [Process(1, 6, 100, 50, 'Design', NonTechCost.LUMP_SUM, TimeFormat.MONTH)]
+    path = str(tmp_path / 'results.desim')
+    results.save(path)
+
+    for loaded in [SimResults.load(path), SimResults.load(path, mmap=False)]:
+        assert loaded.design == 'Design'
+        assert loaded.runs == 2
+        assert list(loaded.time) == [0, 0.25, 0.5, 0.75]
+        assert loaded.npvs.tolist() == results.npvs.tolist()
+        assert loaded.mean_costs() == results.mean_costs()
+        assert loaded.revenues[1].tolist() == [0, 0, 25, 50]
+        assert not loaded.npvs.flags.writeable
+        assert loaded.processes[0].name == 'Design'
+        assert loaded.processes[0].time == 0.5
+        assert loaded.processes[0].add_non_tech == NonTechCost.LUMP_SUM
+
+    array = SimResults.load(path).npvs
+    while not isinstance(array, np.memmap) and array.base is not None:
+        array = array.base
+    assert isinstance(array, np.memmap)
+
+    with open(path, 'r+b') as file:
+        file.write(b'NOTRESUL')
+    with pytest.raises(ValueError):
+        SimResults.load(path)
@@ -1,7 +1,12 @@
-from desim.data import TimeFormat, NonTechCost
+import asyncio
+import pytest
+
+from desim.data import ConfidenceInterval, StreamingSimResults, TimeFormat, NonTechCost
 from typing import List
 import desim.interface as des
 import desim.simulation as sim
+from desim.cache import ResultsCache
+from desim.sweep import design_grid
 
 def create_simple_dsm(processes: List[sim.Process]) -> dict:
   l = len(processes)
@@ -13,6 +18,23 @@ def create_simple_dsm(processes: List[sim.Process]) -> dict:
   return dsm
 
 
+def create_branching_processes():
+  """
+  Processes where the architectural design is followed by either testing or manufacturing, and their dsm.
+  """
+  processes = [
+    sim.Process(1, 5, 100000, 0, 'Architectural design', NonTechCost.NO_ADDED_COST, TimeFormat.MONTH),
+    sim.Process(2, 1, 30000, 1000, 'Testing', NonTechCost.NO_ADDED_COST, TimeFormat.YEAR),
+    sim.Process(3, 1, 30000, 50000, 'Manufacturing', NonTechCost.NO_ADDED_COST, TimeFormat.YEAR),
+  ]
+  dsm = {
+    'Architectural design': [0, 0, 0.5, 0.5, 0],
+    'Testing':              [0, 0, 0, 0, 1],
+    'Manufacturing':        [0, 0, 0, 0, 1],
+  }
+  return processes, dsm
+
+
 def test_monte_carlo_simulation():
   simulation = des.Des()
 
@@ -71,3 +93,316 @@ def test_multiprocessing():
     until, runs=10)
   
   assert len(results.mean_npv()) > 0
+
+
+def test_multiprocessing_pool():
+  processes = [
+    sim.Process(1, 5, 100000, 0, 'Architectural design', NonTechCost.CONTINOUSLY, TimeFormat.MONTH),
+    sim.Process(2, 0, 0, 0, 'Verification', NonTechCost.CONTINOUSLY),
+    sim.Process(3, 1, 30000, 1000, 'Testing', NonTechCost.CONTINOUSLY, TimeFormat.YEAR),
+  ]
+  dsm = create_simple_dsm(processes)
+
+  with des.Des(workers=2, chunk_size=3) as simulation:
+    assert simulation.get_chunks(10) == [3, 3, 3, 1]
+
+    results1 = simulation.run_parallell_simulations(3, 10, "Testing", processes, [], NonTechCost.NO_ADDED_COST,
+      dsm, TimeFormat.YEAR, 0.08, 10, runs=10)
+    pool = simulation.pool
+    results2 = simulation.run_monte_carlo_simulation(3, 10, "Testing", processes, [], NonTechCost.NO_ADDED_COST,
+      dsm, TimeFormat.YEAR, 0.08, 10, runs=2)
+    results3 = simulation.run_parallell_simulations(3, 10, "Testing", processes, [], NonTechCost.NO_ADDED_COST,
+      dsm, TimeFormat.YEAR, 0.08, 10, runs=4)
+
+    assert simulation.pool is pool
+    assert len(results1.npvs) == 10
+    assert len(results3.npvs) == 4
+    assert results1.mean_npv() == pytest.approx(results2.mean_npv())
+    assert results1.npvs.shape == (10, len(results2.npvs[0]))
+    assert list(results1.timesteps[-1]) == list(results2.timesteps[-1])
+    assert results1.shared_memory.runs == 10
+
+  assert simulation.pool is None
+
+  # A pool that is not closed is terminated with Des
+  simulation = des.Des(workers=1)
+  simulation.get_pool()
+  finalizer = simulation.pool_finalizer
+  del simulation
+  assert not finalizer.alive
+
+
+def test_streaming_simulation():
+  processes = [
+    sim.Process(1, 5, 100000, 0, 'Architectural design', NonTechCost.CONTINOUSLY, TimeFormat.MONTH),
+    sim.Process(2, 0, 0, 0, 'Verification', NonTechCost.CONTINOUSLY),
+    sim.Process(3, 1, 30000, 1000, 'Testing', NonTechCost.CONTINOUSLY, TimeFormat.YEAR),
+  ]
+  dsm = create_simple_dsm(processes)
+
+  with des.Des(workers=2, chunk_size=3) as simulation:
+    results1 = simulation.run_monte_carlo_simulation(3, 10, "Testing", processes, [], NonTechCost.NO_ADDED_COST,
+      dsm, TimeFormat.YEAR, 0.08, 10, runs=5)
+    results2 = simulation.run_monte_carlo_simulation(3, 10, "Testing", processes, [], NonTechCost.NO_ADDED_COST,
+      dsm, TimeFormat.YEAR, 0.08, 10, runs=5, streaming=True)
+    results3 = simulation.run_parallell_simulations(3, 10, "Testing", processes, [], NonTechCost.NO_ADDED_COST,
+      dsm, TimeFormat.YEAR, 0.08, 10, runs=7, streaming=True)
+
+  assert results2.runs == 5
+  assert results3.runs == 7
+  assert list(results2.time) == list(results1.time)
+  assert list(results3.time) == list(results1.time)
+  assert results2.mean_npv() == pytest.approx(results1.mean_npv())
+  assert results3.mean_npv() == pytest.approx(results1.mean_npv())
+  assert results2.mean_npv_payback_time() == results1.mean_npv_payback_time()
+
+
+def test_adaptive_simulation():
+  processes, dsm = create_branching_processes()
+
+  simulation = des.Des()
+  results = simulation.run_adaptive_simulation(1, 10, 'Architectural design', processes, [], NonTechCost.NO_ADDED_COST,
+    dsm, TimeFormat.YEAR, 0.08, 5, target=0.05, min_runs=10, max_runs=2000)
+
+  assert results.converged
+  assert 10 <= results.runs <= 2000
+  assert results.confidence_interval.runs == results.runs
+  assert results.confidence_interval.relative_half_width <= 0.05
+  assert results.confidence_interval.mean == pytest.approx(results.mean_npv()[-1])
+
+  results = simulation.run_adaptive_simulation(1, 10, 'Architectural design', processes, [], NonTechCost.NO_ADDED_COST,
+    dsm, TimeFormat.YEAR, 0.08, 5, target=0.0001, metric='mean', min_runs=10, max_runs=25, batch_size=5)
+
+  assert not results.converged
+  assert results.runs == 25
+  assert results.confidence_interval.mean == pytest.approx(sum(results.mean_npv()) / len(results.mean_npv()))
+
+  with pytest.raises(ValueError):
+    simulation.run_adaptive_simulation(1, 10, 'Architectural design', processes, [], NonTechCost.NO_ADDED_COST,
+      dsm, TimeFormat.YEAR, 0.08, 5, metric='median')
+  with pytest.raises(ValueError):
+    simulation.run_adaptive_simulation(1, 10, 'Architectural design', processes, [], NonTechCost.NO_ADDED_COST,
+      dsm, TimeFormat.YEAR, 0.08, 5, target=0)
+
+
+def test_adaptive_simulation_zero_mean(monkeypatch):
+  processes, dsm = create_branching_processes()
+
+  # A mean of 0 has no relative half width, so the runs are doubled until max_runs
+  monkeypatch.setattr(StreamingSimResults, 'npv_confidence_interval',
+                      lambda self, confidence, metric: ConfidenceInterval(0.0, 1.0, confidence, self.runs))
+  results = des.Des().run_adaptive_simulation(1, 10, 'Architectural design', processes, [], NonTechCost.NO_ADDED_COST,
+    dsm, TimeFormat.YEAR, 0.08, 5, min_runs=10, max_runs=40)
+
+  assert not results.converged
+  assert results.runs == 40
+
+
+def test_seeded_simulation():
+  processes, dsm = create_branching_processes()
+
+  with des.Des(workers=2, chunk_size=3) as simulation:
+    results1 = simulation.run_monte_carlo_simulation(1, 10, 'Architectural design', processes, [],
+      NonTechCost.NO_ADDED_COST, dsm, TimeFormat.YEAR, 0.08, 5, runs=8, seed=12)
+    results2 = simulation.run_parallell_simulations(1, 10, 'Architectural design', processes, [],
+      NonTechCost.NO_ADDED_COST, dsm, TimeFormat.YEAR, 0.08, 5, runs=8, seed=12)
+    results3 = simulation.run_parallell_simulations(1, 10, 'Architectural design', processes, [],
+      NonTechCost.NO_ADDED_COST, dsm, TimeFormat.YEAR, 0.08, 5, runs=8, streaming=True, seed=12)
+
+  assert (results1.npvs == results2.npvs).all()
+  assert results3.mean_npv() == pytest.approx(results1.mean_npv())
+  assert len(set([npvs[-1] for npvs in results1.npvs])) > 1
+
+
+def test_analytic_simulation():
+  processes, dsm = create_branching_processes()
+
+  simulation = des.Des()
+  expected = simulation.run_analytic_simulation(1, 10, 'Architectural design', processes, [],
+    NonTechCost.NO_ADDED_COST, dsm, TimeFormat.YEAR, 0.08, 5)
+  results = simulation.run_monte_carlo_simulation(1, 10, 'Architectural design', processes, [],
+    NonTechCost.NO_ADDED_COST, dsm, TimeFormat.YEAR, 0.08, 5, runs=200, seed=1)
+
+  assert expected.runs == 1
+  assert list(expected.time) == list(results.time)
+  assert expected.mean_npv()[-1] == pytest.approx(results.mean_npv()[-1], rel=0.05)
+
+
+def test_batch_engine():
+  processes, dsm = create_branching_processes()
+
+  with des.Des(workers=2, engine='batch') as simulation:
+    results1 = simulation.run_monte_carlo_simulation(1, 10, 'Architectural design', processes, [],
+      NonTechCost.NO_ADDED_COST, dsm, TimeFormat.YEAR, 0.08, 5, runs=400)
+    results2 = simulation.run_parallell_simulations(1, 10, 'Architectural design', processes, [],
+      NonTechCost.NO_ADDED_COST, dsm, TimeFormat.YEAR, 0.08, 5, runs=400)
+    results3 = simulation.run_monte_carlo_simulation(1, 10, 'Architectural design', processes, [],
+      NonTechCost.NO_ADDED_COST, dsm, TimeFormat.YEAR, 0.08, 5, runs=400, streaming=True)
+    results4 = simulation.run_simulation(1, 10, 'Architectural design', processes, [],
+      NonTechCost.NO_ADDED_COST, dsm, TimeFormat.YEAR, 0.08, 5)
+
+  expected = des.Des().run_analytic_simulation(1, 10, 'Architectural design', processes, [],
+    NonTechCost.NO_ADDED_COST, dsm, TimeFormat.YEAR, 0.08, 5)
+
+  assert results1.npvs.shape == results2.npvs.shape == (400, len(expected.time))
+  assert results3.runs == 400
+  assert results4.runs == 1
+  for results in [results1, results2, results3]:
+    assert results.mean_npv()[-1] == pytest.approx(expected.mean_npv()[-1], rel=0.05)
+
+  with pytest.raises(ValueError):
+    des.Des(engine='gpu')
+
+
+def test_discounted_npvs():
+  processes, dsm = create_branching_processes()
+  non_tech_processes = [sim.NonTechnicalProcess("Quality Mangement Process", 10000, 0)]
+
+  simulation = des.Des()
+  results = simulation.run_monte_carlo_simulation(1, 10, 'Architectural design', processes, non_tech_processes,
+    NonTechCost.LUMP_SUM, dsm, TimeFormat.YEAR, 0.08, 5, runs=6, seed=3)
+  other = simulation.run_monte_carlo_simulation(1, 10, 'Architectural design', processes, non_tech_processes,
+    NonTechCost.LUMP_SUM, dsm, TimeFormat.YEAR, 0.12, 5, runs=6, seed=3)
+  streaming = simulation.run_monte_carlo_simulation(1, 10, 'Architectural design', processes, non_tech_processes,
+    NonTechCost.LUMP_SUM, dsm, TimeFormat.YEAR, 0.08, 5, runs=6, streaming=True, seed=3)
+
+  npvs = results.discounted_npvs([0.08, 0.12])
+  assert npvs.shape == (2, 6, len(results.time))
+  assert npvs[0] == pytest.approx(results.npvs)
+  assert npvs[1] == pytest.approx(other.npvs)
+  assert streaming.discounted_mean_npv([0.08, 0.12]) == pytest.approx(npvs.mean(axis=1))
+
+
+def test_design_sweep():
+  processes, dsm = create_branching_processes()
+  designs = design_grid({'flow_rate': [5, 10], ('dsm', 'Architectural design', 'Testing'): [0.5, 0]})
+
+  with des.Des(workers=2, chunk_size=3) as simulation:
+    results1 = simulation.run_sweep(designs, 1, 10, 'Architectural design', processes, [],
+      NonTechCost.NO_ADDED_COST, dsm, TimeFormat.YEAR, 0.08, 5, runs=8, seed=4)
+    results2 = simulation.run_sweep(designs, 1, 10, 'Architectural design', processes, [],
+      NonTechCost.NO_ADDED_COST, dsm, TimeFormat.YEAR, 0.08, 5, runs=8, parallell=False, seed=4)
+    results3 = simulation.run_sweep({'Cheap testing': {('process', 'Testing', 'cost'): 0}}, 1, 10,
+      'Architectural design', processes, [], NonTechCost.NO_ADDED_COST, dsm, TimeFormat.YEAR, 0.08, 5,
+      runs=8, streaming=True, seed=4)
+
+  assert list(results1) == ['flow_rate=5, Architectural design.Testing=0.5', 'flow_rate=5, Architectural design.Testing=0',
+    'flow_rate=10, Architectural design.Testing=0.5', 'flow_rate=10, Architectural design.Testing=0']
+  assert all([results1[name].design == name for name in results1])
+  assert all([(results1[name].npvs == results2[name].npvs).all() for name in results1])
+  base = simulation.run_monte_carlo_simulation(1, 10, 'Architectural design', processes, [],
+    NonTechCost.NO_ADDED_COST, dsm, TimeFormat.YEAR, 0.08, 5, runs=8, seed=4)
+  assert (results1['flow_rate=10, Architectural design.Testing=0.5'].npvs == base.npvs).all()
+  # Only manufacturing is chosen, which costs as much as testing but has a larger revenue
+  assert (results1['flow_rate=10, Architectural design.Testing=0'].mean_npv_array()[-1]
+    > results1['flow_rate=10, Architectural design.Testing=0.5'].mean_npv_array()[-1])
+  assert results3['Cheap testing'].runs == 8
+  assert processes[1].cost == 30000
+  assert dsm['Architectural design'] == [0, 0, 0.5, 0.5, 0]
+
+
+def test_design_race():
+  processes, dsm = create_branching_processes()
+  designs = design_grid({('process', 'Manufacturing', 'revenue'): [0, 20000, 50000, 51000]})
+
+  simulation = des.Des()
+  results = simulation.run_race(designs, 1, 10, 'Architectural design', processes, [], NonTechCost.NO_ADDED_COST,
+    dsm, TimeFormat.YEAR, 0.08, 5, min_runs=10, max_runs=200, seed=5)
+
+  names = list(results)
+  assert not results[names[0]].eliminated
+  assert set(names[:2]) == {'Manufacturing.revenue=50000', 'Manufacturing.revenue=51000'}
+  assert results['Manufacturing.revenue=0'].eliminated
+  assert results['Manufacturing.revenue=0'].runs < results[names[0]].runs
+  assert results[names[0]].runs <= 200
+
+  with des.Des(workers=2) as simulation:
+    results = simulation.run_race(designs, 1, 10, 'Architectural design', processes, [], NonTechCost.NO_ADDED_COST,
+      dsm, TimeFormat.YEAR, 0.08, 5, keep=2, method='halving', min_runs=10, max_runs=200, parallell=True, seed=5)
+
+  assert [results[name].eliminated for name in results] == [False, False, True, True]
+  assert set(list(results)[:2]) == {'Manufacturing.revenue=50000', 'Manufacturing.revenue=51000'}
+  assert results['Manufacturing.revenue=0'].runs == 10
+  assert results['Manufacturing.revenue=50000'].runs == 10
+
+  with pytest.raises(ValueError):
+    simulation.run_race(designs, 1, 10, 'Architectural design', processes, [], NonTechCost.NO_ADDED_COST,
+      dsm, TimeFormat.YEAR, 0.08, 5, method='tournament')
+
+
+def test_cached_simulation(tmp_path):
+  processes, dsm = create_branching_processes()
+
+  cache = ResultsCache(directory=str(tmp_path))
+  with des.Des(workers=2, cache=cache) as simulation:
+    results1 = simulation.run_monte_carlo_simulation(1, 10, 'Architectural design', processes, [],
+      NonTechCost.NO_ADDED_COST, dsm, TimeFormat.YEAR, 0.08, 5, runs=8, seed=7)
+    results2 = simulation.run_monte_carlo_simulation(1, 10, 'Architectural design', processes, [],
+      NonTechCost.NO_ADDED_COST, dsm, TimeFormat.YEAR, 0.08, 5, runs=8, seed=7)
+    results3 = simulation.run_parallell_simulations(1, 10, 'Architectural design', processes, [],
+      NonTechCost.NO_ADDED_COST, dsm, TimeFormat.YEAR, 0.08, 5, runs=8, seed=7)
+    results4 = simulation.run_monte_carlo_simulation(1, 10, 'Architectural design', processes, [],
+      NonTechCost.NO_ADDED_COST, dsm, TimeFormat.YEAR, 0.08, 5, runs=8)
+
+  assert results2 is results1
+  assert cache.hits == 1
+  assert (results3.npvs == results1.npvs).all()
+  assert len(cache.entries) == 2  # Unseeded runs are not cached
+
+  # A new cache on the same directory serves the stored results
+  simulation = des.Des(cache=ResultsCache(directory=str(tmp_path)))
+  results5 = simulation.run_monte_carlo_simulation(1, 10, 'Architectural design', processes, [],
+    NonTechCost.NO_ADDED_COST, dsm, TimeFormat.YEAR, 0.08, 5, runs=8, seed=7)
+  assert simulation.cache.hits == 1
+  assert (results5.npvs == results1.npvs).all()
+
+
+def test_profiled_simulation():
+  processes, dsm = create_branching_processes()
+
+  with des.Des(workers=2, chunk_size=3) as simulation:
+    results1 = simulation.run_parallell_simulations(1, 10, 'Architectural design', processes, [],
+      NonTechCost.NO_ADDED_COST, dsm, TimeFormat.YEAR, 0.08, 5, runs=8, seed=2, profile=True)
+    results2 = simulation.run_parallell_simulations(1, 10, 'Architectural design', processes, [],
+      NonTechCost.NO_ADDED_COST, dsm, TimeFormat.YEAR, 0.08, 5, runs=8, streaming=True, profile=True)
+    results3 = simulation.run_monte_carlo_simulation(1, 10, 'Architectural design', processes, [],
+      NonTechCost.NO_ADDED_COST, dsm, TimeFormat.YEAR, 0.08, 5, runs=8, seed=2)
+
+  assert results1.stats.runs == 8
+  assert results1.stats.counters['entities_created'] > 0
+  assert results1.stats.process_runs['Architectural design'] == results1.stats.counters['entities_created']
+  assert results2.stats.runs == 8
+  assert results3.stats is None
+  assert (results1.npvs == results3.npvs).all()
+
+
+def test_async_simulation():
+  processes, dsm = create_branching_processes()
+  args = (1, 10, 'Architectural design', processes, [], NonTechCost.NO_ADDED_COST, dsm, TimeFormat.YEAR, 0.08, 5)
+
+  async def run(simulation):
+    updates = []
+    results = await simulation.run_monte_carlo_simulation_async(*args, runs=8, seed=2, progress=updates.append)
+
+    # Stopping the iteration stops the simulation, and the pool can be used again
+    async for update in simulation.iter_monte_carlo_simulation(*args, runs=100, seed=2):
+      break
+
+    streamed = await simulation.run_monte_carlo_simulation_async(*args, runs=8, seed=2, streaming=True,
+                                                                parallell=False)
+    single = await simulation.run_simulation_async(*args, seed=2)
+    return updates, results, update, streamed, single
+
+  with des.Des(workers=2, chunk_size=3) as simulation:
+    updates, results, update, streamed, single = asyncio.run(run(simulation))
+    expected = simulation.run_monte_carlo_simulation(*args, runs=8, seed=2)
+
+  assert [u.runs for u in updates] == sorted([u.runs for u in updates])
+  assert updates[-1].runs == updates[-1].total_runs == 8
+  assert updates[-1].done and not updates[0].done
+  assert updates[-1].mean_npv == pytest.approx(expected.npvs[:, -1].mean())
+  assert (results.npvs == expected.npvs).all()
+  assert update.runs == 3 and update.results is None
+  assert streamed.runs == 8
+  assert streamed.mean_npv()[-1] == pytest.approx(expected.mean_npv()[-1])
+  assert single.npvs[0] == pytest.approx(expected.npvs[0])
@@ -0,0 +1,52 @@
+from desim.data import NonTechCost, TimeFormat
+from desim.profiling import SimulationStats
+from desim.simulation import Process, SimulationModel
+
+
+def get_model(**options):
+    processes = [
+        Process(1, 1, 100, 0, 'Design', NonTechCost.CONTINOUSLY, TimeFormat.YEAR),
+        Process(2, 1, 200, 500, 'Testing', NonTechCost.CONTINOUSLY, TimeFormat.YEAR),
+    ]
+    dsm = {'Design': [0, 0, 1, 0], 'Testing': [0, 0, 0.5, 0.5]}
+    return SimulationModel(1, 8, 'Design', 5, 0.08, processes, [], NonTechCost.CONTINOUSLY, dsm,
+                           TimeFormat.YEAR, seed=1, **options)
+
+
+def test_profiled_simulation():
+    sim = get_model(profile=True).run_simulation()
+    stats = sim.stats
+
+    assert stats.runs == 1
+    assert stats.counters['events_scheduled'] > 0
+    assert stats.counters['entities_created'] == 8
+    assert 0 < stats.counters['peak_entities_alive'] <= 8
+    assert stats.counters['observations'] == len(sim.time_steps) - 1
+    assert stats.process_runs['Design'] == 8
+    assert stats.process_runs['Testing'] >= 8
+    assert stats.counters['routing_draws'] == sum(stats.process_runs.values())
+    assert stats.timings['total'] >= stats.timings['observe'] >= stats.timings['non_tech'] > 0
+    assert stats.timings['simpy'] > 0
+    assert stats.to_dict()['events_per_second'] > 0
+
+    unprofiled = get_model().run_simulation()
+    assert unprofiled.stats is None
+    assert unprofiled.cum_NPV == sim.cum_NPV
+
+
+def test_merged_stats():
+    model = get_model(profile=True)
+    time, npvs, costs, revenues = model.allocate_series(3)
+    stats = model.run_into(time, npvs, costs, revenues, 0, 3)
+    first = model.run_simulation(0).stats
+
+    assert stats.runs == 3
+    assert stats.counters['entities_created'] == 24
+    assert stats.counters['peak_entities_alive'] <= 8
+    assert stats.process_runs['Design'] == 24
+
+    combined = SimulationStats.combine([None, first, None, stats])
+    assert combined.runs == 4
+    assert combined.counters['events_scheduled'] == first.counters['events_scheduled'] + stats.counters['events_scheduled']
+    assert SimulationStats.combine([None, None]) is None
+    assert get_model().run_into(time, npvs, costs, revenues, 0, 3) is None
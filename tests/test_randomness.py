@@ -0,0 +1,38 @@
+import numpy as np
+import pytest
+
+from desim.randomness import RandomStreams
+
+
+def test_random_streams_runs():
+    streams = [RandomStreams(42, run) for run in range(3)]
+    draws = [[s.get('Testing').random() for _ in range(5)] for s in streams]
+
+    # The same as the children spawned by a seed sequence
+    spawned = np.random.SeedSequence(42).spawn(3)
+    assert draws == [list(np.random.default_rng(s).random(5)) for s in spawned]
+    assert draws[0] != draws[1]
+    stream = RandomStreams(42, 1).get('Testing')
+    assert [stream.random() for _ in range(5)] == draws[1]
+
+
+def test_random_streams_antithetic():
+    first, second = RandomStreams(7, 2, antithetic=True), RandomStreams(7, 3, antithetic=True)
+    for _ in range(10):
+        assert first.get('Testing').random() + second.get('Testing').random() == pytest.approx(1)
+
+    third = RandomStreams(7, 4, antithetic=True)
+    assert third.get('Testing').random() != RandomStreams(7, 2, antithetic=True).get('Testing').random()
+
+
+def test_random_streams_common_random_numbers():
+    streams = RandomStreams(3, 0, common_random_numbers=True)
+    testing = [streams.get('Testing').random() for _ in range(5)]
+    streams.get('Manufacturing').random()  # Other rows do not change the numbers of the row
+
+    other = RandomStreams(3, 0, common_random_numbers=True)
+    other.get('Manufacturing').random()
+    other.get('Integration').random()
+    assert [other.get('Testing').random() for _ in range(5)] == testing
+    assert other.get('Manufacturing') is other.get('Manufacturing')
+
@@ -0,0 +1,70 @@
+import random
+
+from desim.data import TimeFormat, NonTechCost
+from desim.routing import RoutingTable
+
+import desim.simulation as sim
+
+
+def get_processes():
+    return [
+        sim.Process(1, 1, 100, 0, 'Design', NonTechCost.NO_ADDED_COST, TimeFormat.YEAR),
+        sim.Process(2, 1, 100, 0, 'Testing', NonTechCost.NO_ADDED_COST, TimeFormat.YEAR),
+        sim.Process(3, 1, 100, 0, 'Manufacturing', NonTechCost.NO_ADDED_COST, TimeFormat.YEAR),
+    ]
+
+
+def test_routing_probabilities():
+    processes = get_processes()
+    dsm = {
+        "Design":        [0, 0, 0.2, 0.6, 0],
+        "Testing":       [0, 0, 0, 0.5, 0.5],
+        "Manufacturing": [0, 0, 0, 0, 0],
+    }
+    routing = RoutingTable(dsm, processes)
+
+    random.seed(0)
+    draws = [routing.get("Design").choose()[0].name for _ in range(20000)]
+    assert abs(draws.count("Testing") / len(draws) - 0.25) < 0.02
+
+    ends = [routing.get("Testing").choose() for _ in range(20000)]
+    assert abs(ends.count([]) / len(ends) - 0.5) < 0.02
+    assert routing.get("Manufacturing").choose() == []
+    assert routing.get("Integration") is None
+
+    # Ordered draws choose the columns in the order of their cumulative weights
+    ordered = [routing.get("Design").choose(lambda: u, ordered=True)[0].name for u in (0, 0.24, 0.26, 0.999)]
+    assert ordered == ["Testing", "Testing", "Manufacturing", "Manufacturing"]
+    ordered = [routing.get("Design").choose(random.random, ordered=True)[0].name for _ in range(20000)]
+    assert abs(ordered.count("Testing") / len(ordered) - 0.25) < 0.02
+
+
+def test_routing_multiple_processes():
+    processes = get_processes()
+    dsm = {
+        "Design":  [0, 0, 1, 1, 0],
+        "Testing": [0, 0, 0, 1, 1],
+    }
+    routing = RoutingTable(dsm, processes)
+
+    for _ in range(100):
+        chosen = routing.get("Design").choose()
+        assert sorted([p.name for p in chosen]) == ["Manufacturing", "Testing"]
+        assert routing.get("Testing").choose() == []  # The end is always chosen
+
+    # The dsm is never modified by the routing
+    assert dsm["Design"] == [0, 0, 1, 1, 0]
+
+
+def test_routing_split():
+    processes = get_processes()
+    dsm = {
+        "Design":  [0, 0, 0.5, 0.5, 0],
+        "Testing": [0, 0, 1, 0, 0],
+    }
+    routing = RoutingTable(dsm, processes)
+
+    cohorts = routing.get("Design").split(1000)
+    assert sum([w for w, _ in cohorts]) == 1000
+    assert sorted([p[0].name for _, p in cohorts]) == ["Manufacturing", "Testing"]
+    assert routing.get("Testing").split(1000) == [(1000, [processes[1]])]
@@ -1,4 +1,7 @@
-from desim.data import TimeFormat, NonTechCost
+import numpy as np
+import pytest
+
+from desim.data import SimResults, TimeFormat, NonTechCost
 from typing import List
 
 import desim.simulation as sim
@@ -245,3 +248,327 @@ def test_sim_time_units():
     assert sim2.time_steps[-1] == 2.25
     assert sim2.total_costs[-1] == 21000
     assert sim2.total_revenue[-1] == 2000
+
+
+def test_simulation_coalesced_events():
+    flow_time = 3
+    flow_rate = 260
+    flow_start_process = "Testing"
+    until = 30
+    discount_rate = 0.08
+
+    for non_tech_cost in NonTechCost:
+        processes, non_tech_processes = get_processes()
+        for process in processes:
+            process.add_non_tech = non_tech_cost
+        dsm = create_simple_dsm(processes)
+
+        simulation1 = sim.Simulation(flow_time, flow_rate, flow_start_process, until,
+                                     discount_rate, processes, non_tech_processes, non_tech_cost, dsm,
+                                     TimeFormat.YEAR)
+        simulation1.run_simulation()
+
+        simulation2 = sim.Simulation(flow_time, flow_rate, flow_start_process, until,
+                                     discount_rate, processes, non_tech_processes, non_tech_cost, dsm,
+                                     TimeFormat.YEAR, coalesce_events=True)
+        simulation2.run_simulation()
+
+        assert simulation1.time_steps == simulation2.time_steps
+        assert simulation1.total_costs == pytest.approx(simulation2.total_costs)
+        assert simulation1.total_revenue == pytest.approx(simulation2.total_revenue)
+        assert simulation1.cum_NPV == pytest.approx(simulation2.cum_NPV)
+
+
+def test_simulation_running_totals():
+    processes, non_tech_processes = get_processes()
+
+    flow_time = 3
+    flow_rate = 260
+    flow_start_process = "Testing"
+    until = 30
+    discount_rate = 0.08
+    dsm = create_simple_dsm(processes)
+
+    simulation1 = sim.Simulation(flow_time, flow_rate, flow_start_process, until,
+                                 discount_rate, processes, non_tech_processes, NonTechCost.CONTINOUSLY, dsm,
+                                 TimeFormat.YEAR, keep_entities=True)
+    simulation1.run_simulation()
+
+    simulation2 = sim.Simulation(flow_time, flow_rate, flow_start_process, until,
+                                 discount_rate, processes, non_tech_processes, NonTechCost.NO_ADDED_COST, dsm,
+                                 TimeFormat.YEAR, coalesce_events=True, keep_entities=True)
+    simulation2.run_simulation()
+
+    assert simulation1.total_costs[-1] == pytest.approx(sum([e.cost for e in simulation1.entities]))
+    assert simulation1.total_revenue[-1] == pytest.approx(sum([e.revenue for e in simulation1.entities]))
+    assert simulation2.total_costs[-1] == pytest.approx(sum([e.cost for e in simulation2.entities]))
+    assert 0 < simulation2.entity_updates < simulation1.entity_updates
+
+
+def test_simulation_coalesced_entity_in_process():
+    processes = [
+        sim.Process(1, 4, 400, 800, 'Design', NonTechCost.NO_ADDED_COST, TimeFormat.YEAR),
+        sim.Process(2, 1, 100, 0, 'Testing', NonTechCost.NO_ADDED_COST, TimeFormat.YEAR),
+    ]
+    dsm = {'Design': [0, 0, 1, 0], 'Testing': [0, 0, 0, 1]}
+
+    # The run ends in the middle of the design, whose accrued steps are part of the entity
+    simulation = sim.Simulation(0, 0, 'Testing', 2, 0.08, processes, [], NonTechCost.NO_ADDED_COST, dsm,
+                                TimeFormat.YEAR, coalesce_events=True, keep_entities=True)
+    simulation.run_simulation()
+
+    entity = simulation.entities[0]
+    assert simulation.total_costs[-1] == pytest.approx(200)
+    assert entity.cost == pytest.approx(simulation.total_costs[-1])
+    assert entity.revenue == pytest.approx(simulation.total_revenue[-1])
+
+
+def test_simulation_continous_non_tech_costs():
+    processes, non_tech_processes = get_processes()
+
+    flow_time = 3
+    flow_rate = 260
+    flow_start_process = "Testing"
+    until = 30
+    discount_rate = 0.08
+    dsm = create_simple_dsm(processes)
+
+    simulation1 = sim.Simulation(flow_time, flow_rate, flow_start_process, until,
+                                 discount_rate, processes, non_tech_processes, NonTechCost.CONTINOUSLY, dsm,
+                                 TimeFormat.YEAR, keep_entities=True)
+    simulation1.run_simulation()
+
+    simulation2 = sim.Simulation(flow_time, flow_rate, flow_start_process, until,
+                                 discount_rate, processes, non_tech_processes, NonTechCost.NO_ADDED_COST, dsm,
+                                 TimeFormat.YEAR, keep_entities=True)
+    simulation2.run_simulation()
+
+    # The non-technical costs are spread over the whole simulation time
+    assert simulation1.total_costs[-1] - simulation2.total_costs[-1] == pytest.approx(10000)
+    assert sum([e.non_tech_cost for e in simulation1.entities]) == pytest.approx(10000)
+    assert simulation1.entities[0].non_tech_cost > simulation1.entities[-1].non_tech_cost > 0
+
+
+def test_simulation_retired_entities():
+    processes, non_tech_processes = get_processes()
+
+    flow_time = 3
+    flow_rate = 260
+    flow_start_process = "Testing"
+    until = 30
+    discount_rate = 0.08
+    dsm = create_simple_dsm(processes)
+
+    simulation = sim.Simulation(flow_time, flow_rate, flow_start_process, until,
+                                discount_rate, processes, non_tech_processes, NonTechCost.CONTINOUSLY, dsm,
+                                TimeFormat.YEAR)
+    simulation.run_simulation()
+
+    assert len(simulation.entities) == 0
+    assert simulation.entities_alive == 0
+    assert simulation.retired.count == simulation.entities_created == 781
+    assert simulation.retired.cost == pytest.approx(simulation.total_costs[-1])
+    assert simulation.retired.revenue == pytest.approx(simulation.total_revenue[-1])
+
+
+def test_simulation_cohorts():
+    processes, non_tech_processes = get_processes()
+
+    flow_time = 3
+    flow_rate = 260
+    flow_start_process = "Testing"
+    until = 30
+    discount_rate = 0.08
+    dsm1 = create_simple_dsm(processes)
+    dsm2 = {
+        "Start":                ["X", 1, 0, 0, 0, 0, 0],
+        "Architectural design": [0, "X", 0.3, 0.2, 0.5, 0, 0],
+        "Verification":         [0, 0, "X", 1, 0, 0, 0],
+        "Testing":              [0, 0, 0, "X", 0.5, 0.5, 0],
+        "Manufacturing":        [0, 0, 0, 0, "X", 1, 0],
+        "Integration":          [0, 0, 0, 0, 0, "X", 1],
+        "End":                  [0, 0, 0, 0, 0, 0, "X"]
+    }
+
+    simulation1 = sim.Simulation(flow_time, flow_rate, flow_start_process, until,
+                                 discount_rate, processes, non_tech_processes, NonTechCost.CONTINOUSLY, dsm1,
+                                 TimeFormat.YEAR)
+    simulation1.run_simulation()
+
+    simulation2 = sim.Simulation(flow_time, flow_rate, flow_start_process, until,
+                                 discount_rate, processes, non_tech_processes, NonTechCost.CONTINOUSLY, dsm1,
+                                 TimeFormat.YEAR, cohorts=True, keep_entities=True)
+    simulation2.run_simulation()
+
+    assert simulation1.total_costs == pytest.approx(simulation2.total_costs)
+    assert simulation1.cum_NPV == pytest.approx(simulation2.cum_NPV)
+    assert len(simulation2.entities) == 13
+    assert simulation2.entities_created == simulation1.entities_created
+
+    simulation3 = sim.Simulation(flow_time, flow_rate, flow_start_process, until,
+                                 discount_rate, processes, non_tech_processes, NonTechCost.CONTINOUSLY, dsm2,
+                                 TimeFormat.YEAR)
+    simulation3.run_simulation()
+
+    simulation4 = sim.Simulation(flow_time, flow_rate, flow_start_process, until,
+                                 discount_rate, processes, non_tech_processes, NonTechCost.CONTINOUSLY, dsm2,
+                                 TimeFormat.YEAR, cohorts=True)
+    simulation4.run_simulation()
+
+    assert simulation4.retired.count == simulation3.retired.count
+    assert simulation4.total_costs[-1] == pytest.approx(simulation3.total_costs[-1], rel=0.01)
+    assert simulation4.total_revenue[-1] == pytest.approx(simulation3.total_revenue[-1], rel=0.05)
+
+
+def test_simulation_model():
+    processes, non_tech_processes = get_processes()
+
+    flow_time = 3
+    flow_rate = 260
+    flow_start_process = "Testing"
+    until = 30
+    discount_rate = 0.08
+    dsm = create_simple_dsm(processes)
+
+    model = sim.SimulationModel(flow_time, flow_rate, flow_start_process, until,
+                                discount_rate, processes, non_tech_processes, NonTechCost.CONTINOUSLY, dsm,
+                                TimeFormat.YEAR)
+    simulation = sim.Simulation(flow_time, flow_rate, flow_start_process, until,
+                                discount_rate, processes, non_tech_processes, NonTechCost.CONTINOUSLY, dsm,
+                                TimeFormat.YEAR)
+    simulation.run_simulation()
+
+    time_steps, cum_NPV, total_costs, total_revenue = model.run_simulations(3)
+
+    assert len(cum_NPV) == 3
+    for i in range(3):
+        assert time_steps[i] == simulation.time_steps
+        assert cum_NPV[i] == pytest.approx(simulation.cum_NPV)
+        assert total_costs[i] == pytest.approx(simulation.total_costs)
+        assert total_revenue[i] == pytest.approx(simulation.total_revenue)
+
+    with pytest.raises(ValueError):
+        sim.SimulationModel(flow_time, flow_rate, "Unknown", until, discount_rate, processes,
+                            non_tech_processes, NonTechCost.CONTINOUSLY, dsm, TimeFormat.YEAR)
+
+
+def test_simulation_seed():
+    processes, non_tech_processes = get_processes()
+
+    dsm = {
+        "Start":                ["X", 1, 0, 0, 0, 0, 0],
+        "Architectural design": [0, "X", 1, 0, 0, 0, 0],
+        "Verification":         [0, 0.9, "X", 0.1, 0, 0, 0],
+        "Testing":              [0, 0, 0, "X", 0.5, 0.5, 0],
+        "Manufacturing":        [0, 0, 0, 0, "X", 1, 0],
+        "Integration":          [0, 0, 0, 0, 0, "X", 1],
+        "End":                  [0, 0, 0, 0, 0, 0, "X"]
+    }
+
+    def run_model(run, **options):
+        model = sim.SimulationModel(3, 20, "Testing", 10, 0.08, processes, non_tech_processes,
+                                    NonTechCost.CONTINOUSLY, dsm, TimeFormat.YEAR, **options)
+        return model.run_simulation(run).cum_NPV
+
+    assert run_model(0, seed=1) == run_model(0, seed=1)
+    assert run_model(0, seed=1) != run_model(1, seed=1)
+    assert run_model(0, seed=1) != run_model(0, seed=2)
+    assert run_model(2, seed=1, cohorts=True) == run_model(2, seed=1, cohorts=True)
+    assert run_model(1, seed=1, antithetic=True) != run_model(0, seed=1, antithetic=True)
+    assert run_model(0, seed=1, common_random_numbers=True) == run_model(0, seed=1, common_random_numbers=True)
+
+    with pytest.raises(ValueError):
+        run_model(0, seed=1, cohorts=True, antithetic=True)
+
+
+def test_simulation_antithetic():
+    processes = [
+        sim.Process(1, 1, 1000, 0, 'Design', NonTechCost.NO_ADDED_COST, TimeFormat.YEAR),
+        sim.Process(2, 1, 1000, 30000, 'Testing', NonTechCost.NO_ADDED_COST, TimeFormat.YEAR),
+        sim.Process(3, 1, 1000, 10000, 'Manufacturing', NonTechCost.NO_ADDED_COST, TimeFormat.YEAR),
+    ]
+    dsm = {'Design': [0, 0, 0.6, 0.3, 0.1], 'Testing': [0, 0, 0, 0, 1], 'Manufacturing': [0, 0, 0, 0, 1]}
+
+    def final_npvs(**options):
+        model = sim.SimulationModel(1, 10, 'Design', 5, 0.08, processes, [], NonTechCost.NO_ADDED_COST, dsm,
+                                    TimeFormat.YEAR, seed=1, **options)
+        return np.array([model.run_simulation(run).cum_NPV[-1] for run in range(400)])
+
+    # The paired runs choose opposite processes, so their npvs are negatively correlated
+    # and the mean of each pair varies less than the mean of two independent runs
+    antithetic, independent = final_npvs(antithetic=True), final_npvs()
+    assert np.corrcoef(antithetic[0::2], antithetic[1::2])[0, 1] < -0.3
+    assert (antithetic[0::2] + antithetic[1::2]).var() < 0.7 * (independent[0::2] + independent[1::2]).var()
+
+
+def test_simulation_time_resolution():
+    processes, non_tech_processes = get_processes()
+    dsm = create_simple_dsm(processes)
+
+    def run_model(**options):
+        model = sim.SimulationModel(3, 20, "Testing", 10, 0.08, processes, non_tech_processes,
+                                    NonTechCost.CONTINOUSLY, dsm, TimeFormat.YEAR, seed=1, **options)
+        return model, model.run_simulation()
+
+    # The yearly output keeps every fourth observation of the same run
+    model, quarterly = run_model()
+    yearly_model, yearly = run_model(output_interval=1)
+    assert yearly_model.steps == 11
+    assert yearly.time_steps == quarterly.time_steps[::4]
+    assert yearly.total_costs == quarterly.total_costs[::4]
+    assert yearly.total_revenue == quarterly.total_revenue[::4]
+    assert yearly.cum_NPV == pytest.approx(quarterly.cum_NPV[::4])
+
+    # The npvs are discounted every time step, which the discounted npvs of the output series approximate
+    def discounted(simulation):
+        results = SimResults('Design', processes, simulation.time_steps, simulation.cum_NPV, simulation.total_costs,
+                             simulation.total_revenue)
+        return list(results.discounted_npvs(0.08)[0, 0])
+
+    assert discounted(quarterly) == pytest.approx(quarterly.cum_NPV)
+    assert discounted(yearly) == pytest.approx(yearly.cum_NPV, rel=0.05)
+
+    # A finer time step observes more often but keeps the yearly output
+    monthly_model, monthly = run_model(timestep=1/12, output_interval=1)
+    assert monthly_model.observation_steps == 121
+    assert monthly.observations == 120
+    assert monthly.time_steps == pytest.approx(yearly.time_steps)
+
+    # The left over entities of the flow are created on the whole years with any time step
+    for timestep in [0.25, 0.1, 1/12]:
+        model = sim.SimulationModel(3, 13.3, "Testing", 10, 0.08, processes, non_tech_processes,
+                                    NonTechCost.CONTINOUSLY, dsm, TimeFormat.YEAR, timestep=timestep)
+        assert model.run_simulation().entities_created == {0.25: 46, 0.1: 40, 1/12: 40}[timestep]
+
+    with pytest.raises(ValueError):
+        run_model(output_interval=0.3)
+    with pytest.raises(ValueError):
+        run_model(timestep=0)
+
+
+@pytest.mark.parametrize("non_tech_costs", [NonTechCost.CONTINOUSLY, NonTechCost.LUMP_SUM])
+def test_simulation_stream(non_tech_costs):
+    processes, non_tech_processes = get_processes()
+    dsm = create_simple_dsm(processes)
+    model = sim.SimulationModel(3, 20, "Testing", 10, 0.08, processes, non_tech_processes,
+                                non_tech_costs, dsm, TimeFormat.YEAR, seed=1, output_interval=0.5)
+    simulation = model.run_simulation()
+
+    observations = list(model.stream())
+    assert [o.time for o in observations] == simulation.time_steps
+    assert [o.cost for o in observations] == simulation.total_costs
+    assert [o.revenue for o in observations] == simulation.total_revenue
+    assert [o.npv for o in observations] == simulation.cum_NPV
+
+    # Without the series only the latest observation is kept
+    streamed = model.create_simulation(0)
+    assert list(streamed.stream(keep_series=False)) == observations
+    assert streamed.time_steps == simulation.time_steps[-1:]
+    assert streamed.cum_NPV == simulation.cum_NPV[-1:]
+
+    # The simulation stops when the iteration does
+    stopped = model.create_simulation(0)
+    for observation in stopped.stream():
+        if observation.time >= 2:
+            break
+    assert stopped.time_steps == simulation.time_steps[:5]
@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+
+from desim.data import StreamingSimResults
+from desim.stats import SeriesStatistics
+
+
+def test_series_statistics():
+    rng = np.random.default_rng(0)
+    values = rng.normal(10, 2, size=(5000, 3))
+    statistics = SeriesStatistics(3, quantiles=(0.05, 0.5, 0.95))
+    for row in values:
+        statistics.add(row)
+
+    assert statistics.count == 5000
+    assert statistics.mean == pytest.approx(values.mean(axis=0))
+    assert statistics.variance() == pytest.approx(values.var(axis=0, ddof=1))
+    assert list(statistics.min) == list(values.min(axis=0))
+    assert list(statistics.max) == list(values.max(axis=0))
+    for q in [0.05, 0.5, 0.95]:
+        assert statistics.quantile(q) == pytest.approx(np.quantile(values, q, axis=0), rel=0.02)
+
+    with pytest.raises(KeyError):
+        statistics.quantile(0.25)
+
+
+def test_series_statistics_few_values():
+    statistics = SeriesStatistics(2, quantiles=(0.5,))
+    assert np.isnan(statistics.variance()).all()
+
+    statistics.add([1, 4])
+    statistics.add([3, 2])
+    assert list(statistics.quantile(0.5)) == [2, 3]
+    assert not np.isnan(statistics.variance()).any()
+
+
+def test_streaming_sim_results():
+    results = StreamingSimResults('Design', [], [0, 0.25, 0.5, 0.75])
+    results.add_runs([[0, -10, 5, 20], [0, -30, -5, 10]],
+                     [[0, 10, 10, 10], [0, 30, 30, 40]],
+                     [[0, 0, 15, 30], [0, 0, 25, 50]])
+
+    assert results.runs == 2
+    assert results.mean_npv() == [0, -20, 0, 15]
+    assert results.mean_costs() == [0, 20, 20, 25]
+    assert results.mean_revenues() == [0, 0, 20, 40]
+    assert results.normalize_npv() == pytest.approx([20 / 35, 0, 20 / 35, 1])
+    assert results.mean_npv_payback_time() == 0.75
+    assert list(results.npv.min) == [0, -30, -5, 10]
@@ -0,0 +1,62 @@
+import pytest
+
+from desim.data import ConfidenceInterval, NonTechCost
+from desim.simulation import Process
+from desim.sweep import apply_design, design_grid, design_name, halving_eliminated, named_designs, racing_eliminated, \
+    racing_rounds
+
+
+def get_parameters():
+    processes = [
+        Process(1, 1, 100, 0, 'Design', NonTechCost.NO_ADDED_COST),
+        Process(2, 1, 200, 50, 'Testing', NonTechCost.NO_ADDED_COST),
+    ]
+    dsm = {'Design': [0, 0, 1, 0], 'Testing': [0, 0, 0, 1]}
+    return dict(flow_rate=10, processes=processes, dsm=dsm)
+
+
+def test_design_grid():
+    designs = design_grid({'flow_rate': [1, 2], ('process', 'Testing', 'cost'): [10, 20, 30]})
+
+    assert len(designs) == 6
+    assert designs[1] == {'flow_rate': 1, ('process', 'Testing', 'cost'): 20}
+    assert design_name(designs[1]) == 'flow_rate=1, Testing.cost=20'
+    assert list(named_designs(designs))[0] == 'flow_rate=1, Testing.cost=10'
+    with pytest.raises(ValueError):
+        named_designs([{'flow_rate': 1}, {'flow_rate': 1}])
+
+
+def test_apply_design():
+    parameters = get_parameters()
+    design = apply_design(parameters, {'flow_rate': 5, ('process', 'Testing', 'cost'): 0,
+                                       ('dsm', 'Design', 'End'): 0.5, ('dsm', 'Design', 'Testing'): 0.5})
+
+    assert design['flow_rate'] == 5
+    assert design['processes'][1].cost == 0
+    assert design['processes'][0] is parameters['processes'][0]
+    assert design['dsm']['Design'] == [0, 0, 0.5, 0.5]
+    assert parameters['processes'][1].cost == 200
+    assert parameters['dsm']['Design'] == [0, 0, 1, 0]
+
+    with pytest.raises(ValueError):
+        apply_design(parameters, {'flow_speed': 5})
+    with pytest.raises(ValueError):
+        apply_design(parameters, {('process', 'Manufacturing', 'cost'): 5})
+    with pytest.raises(ValueError):
+        apply_design(parameters, {('dsm', 'Testing', 'Manufacturing'): 1})
+
+
+def test_eliminated_designs():
+    intervals = {
+        'a': ConfidenceInterval(10, 1, 0.95, 10),
+        'b': ConfidenceInterval(8, 2, 0.95, 10),
+        'c': ConfidenceInterval(5, 1, 0.95, 10),
+    }
+
+    assert racing_eliminated(intervals, 1) == ['c']
+    assert racing_eliminated(intervals, 2) == []
+    assert halving_eliminated({'a': 1, 'b': 3, 'c': 2}, 1) == ['a']
+    assert halving_eliminated({'a': 1, 'b': 3, 'c': 2, 'd': 0}, 3) == ['d']
+    assert racing_rounds(30, 30, 10) == 1
+    assert racing_rounds(30, 100, 10) == 8
+    assert racing_rounds(30, 101, 10) == 9